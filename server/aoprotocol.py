@@ -19,7 +19,7 @@
 import asyncio
 import re
 
-from time import localtime, strftime
+from time import localtime, perf_counter, strftime
 
 from server import logger
 from server.constants import ArgType, Clients, Constants
@@ -32,11 +32,16 @@ class AOProtocol(asyncio.Protocol):
     The main class that deals with the AO protocol.
     """
 
+    # Maximum size, in bytes, of received data not yet parsed into messages
+    BUFFER_LIMIT = 8192
+    # Character list request of some old clients, which is not terminated with the usual #%
+    ASKCHAR2 = b'#615810BC07D12A5A#'
+
     def __init__(self, server):
         super().__init__()
         self.server = server
         self.client = None
-        self.buffer = ''
+        self.buffer = bytearray()
         self.ping_timeout = None
         logger.log_print = logger.log_print2 if self.server.in_test else logger.log_print
 
@@ -63,27 +68,31 @@ class AOProtocol(asyncio.Protocol):
 
         :param data: bytes of data
         """
+        if self.client is None: # Connection was refused
+            return
+
         buf = data
         if buf is None:
             buf = b''
-        # try to decode as utf-8, ignore any erroneous characters
-        self.buffer += buf.decode('utf-8', 'ignore')
-        self.buffer = self.buffer.translate({ord(c): None for c in '\0'})
+        # A message delimiter may have been split between the old and new data, so start looking
+        # for delimiters right before the new data
+        scan_from = max(len(self.buffer)-1, 0)
+        self.buffer += buf.replace(b'\0', b'')
 
-        if len(self.buffer) > 8192:
-            msg = self.buffer if len(self.buffer) < 512 else self.buffer[:512] + '...'
+        if len(self.buffer) > self.BUFFER_LIMIT:
+            msg = self.get_buffer_preview()
             logger.log_server('Terminated {} (packet too long): sent {} ({} bytes)'
                               .format(self.client.get_ipreal(), msg, len(self.buffer)))
             self.client.disconnect()
             return
 
         found_message = False
-        for msg in self.get_messages():
+        for msg in self.get_messages(scan_from=scan_from):
             found_message = True
             if len(msg) < 2:
                 # This immediatelly kills any client that does not even try to follow the proper
                 # client protocol
-                msg = self.buffer if len(self.buffer) < 512 else self.buffer[:512] + '...'
+                msg = self.get_buffer_preview()
                 logger.log_server('Terminated {} (packet too short): sent {} ({} bytes)'
                                   .format(self.client.get_ipreal(), msg, len(self.buffer)))
                 self.client.disconnect()
@@ -104,7 +113,7 @@ class AOProtocol(asyncio.Protocol):
         if not found_message:
             # This immediatelly kills any client that does not even try to follow the proper
             # client protocol
-            msg = self.buffer if len(self.buffer) < 512 else self.buffer[:512] + '...'
+            msg = self.get_buffer_preview()
             logger.log_server('Terminated {} (packet syntax unrecognized): sent {} ({} bytes)'
                               .format(self.client.get_ipreal(), msg, len(self.buffer)))
             self.client.disconnect()
@@ -115,6 +124,13 @@ class AOProtocol(asyncio.Protocol):
         :param transport: the transport object
         """
         self.client = self.server.new_client(transport, my_protocol=my_protocol)
+        if self.client is None:
+            # Connecting too often, so drop the connection before spending anything else on it
+            transport.close()
+            return
+        if transport is not None: # Test clients have no transport
+            transport.set_write_buffer_limits(high=self.client.OUTPUT_HIGH_WATER,
+                                              low=self.client.OUTPUT_LOW_WATER)
         self.ping_timeout = asyncio.get_event_loop().call_later(self.server.config['timeout'], self.client.disconnect)
         self.client.send_command('decryptor', 34)  # just fantacrypt things
 
@@ -123,23 +139,53 @@ class AOProtocol(asyncio.Protocol):
 
         :param exc: reason
         """
+        if self.client is None: # Connection was refused
+            return
         self.server.remove_client(self.client)
         self.ping_timeout.cancel()
 
-    def get_messages(self):
-        """ Parses out full messages from the buffer.
+    def pause_writing(self):
+        """ Called when the transport buffer of the client goes over the high watermark.
+        """
+        self.client.pause_output()
 
-        :return: yields messages
+    def resume_writing(self):
+        """ Called when the transport buffer of the client drains down to the low watermark.
         """
-        while '#%' in self.buffer:
-            spl = self.buffer.split('#%', 1)
-            self.buffer = spl[1]
-            yield spl[0]
+        self.client.resume_output()
+
+    def get_messages(self, scan_from=0):
+        """ Parses out full messages from the buffer, and removes them from it.
+
+        Each message is decoded as UTF-8 once, ignoring any erroneous characters.
+
+        :param scan_from: position of the buffer to start looking for message delimiters from.
+        There must be no delimiters before it.
+        :return: list of messages
+        """
+        messages = list()
+        start = 0
+        with memoryview(self.buffer) as view:
+            end = self.buffer.find(b'#%', scan_from)
+            while end != -1:
+                messages.append(str(view[start:end], 'utf-8', 'ignore'))
+                start = end + 2
+                end = self.buffer.find(b'#%', start)
+        del self.buffer[:start]
+
         # exception because bad netcode
-        askchar2 = '#615810BC07D12A5A#'
-        if self.buffer == askchar2:
-            self.buffer = ''
-            yield askchar2
+        if self.buffer == self.ASKCHAR2:
+            self.buffer.clear()
+            messages.append(self.ASKCHAR2.decode('utf-8'))
+        return messages
+
+    def get_buffer_preview(self):
+        """ Returns the start of the buffer, for logging purposes.
+
+        :return: decoded buffer, cut to at most 512 characters
+        """
+        msg = self.buffer.decode('utf-8', 'ignore')
+        return msg if len(msg) < 512 else msg[:512] + '...'
 
     def validate_net_cmd(self, args, *types, needs_auth=True):
         """ Makes sure the net command's arguments match expectations.
@@ -164,19 +210,27 @@ class AOProtocol(asyncio.Protocol):
         return True
 
     def process_arguments(self, identifier, args, needs_auth=True, fallback_protocols=None):
-        if fallback_protocols is None:
-            fallback_protocols = list()
+        """ Parses the net command's arguments according to the client protocol.
 
-        packet_type = '{}_INBOUND'.format(identifier.upper())
-        for protocol in [self.client.packet_handler]+fallback_protocols:
-            expected_pairs = protocol[packet_type].value
-            expected_argument_names = [x[0] for x in expected_pairs]
-            expected_types = [x[1] for x in expected_pairs]
-            if not self.validate_net_cmd(args, *expected_types, needs_auth=needs_auth):
-                continue
+        :param identifier: ID of the net command, such as MS
+        :param args: actual arguments to the net command, which are left unchanged
+        :param needs_auth: whether you need to have chosen a character
+        :param fallback_protocols: protocols to try in order if the arguments do not match the
+        client protocol
+        :return: arguments by name, converted to their expected types, or None if they do not
+        match any of the protocols
+        """
+        if needs_auth and self.client.char_id == -1:
+            return None
 
-            return dict(zip(expected_argument_names, args))
-        return None
+        identifier = identifier.upper()
+        pargs = Clients.INBOUND_SCHEMAS[self.client.packet_handler][identifier].parse(args)
+        if pargs is None and fallback_protocols:
+            for protocol in fallback_protocols:
+                pargs = Clients.INBOUND_SCHEMAS[protocol][identifier].parse(args)
+                if pargs is not None:
+                    break
+        return pargs
 
     def net_cmd_hi(self, args):
         """ Handshake.
@@ -188,24 +242,26 @@ class AOProtocol(asyncio.Protocol):
         if not self.validate_net_cmd(args, ArgType.STR, needs_auth=False):
             return
 
+        self.client.join_started = perf_counter()
+
         # Record new HDID and IPID if needed
         self.client.hdid = args[0]
-        if self.client.hdid not in self.client.server.hdid_list:
-            self.client.server.hdid_list[self.client.hdid] = []
-        if self.client.ipid not in self.client.server.hdid_list[self.client.hdid]:
-            self.client.server.hdid_list[self.client.hdid].append(self.client.ipid)
-            self.client.server.dump_hdids()
+        if self.client.ipid not in self.client.server.hdid_list.get(self.client.hdid, []):
+            self.client.server.hdid_store.add(self.client.hdid, self.client.ipid)
 
         # Check if the client is banned
-        for ipid in self.client.server.hdid_list[self.client.hdid]:
-            if self.server.ban_manager.is_banned(ipid):
-                self.client.send_ooc_others('Banned client with HDID {} and IPID {} attempted to '
-                                            'join the server but was refused entrance.'
-                                            .format(self.client.hdid, self.client.ipid),
-                                            is_officer=True)
-                self.client.send_command('BD')
-                self.client.disconnect()
-                return
+        ban_manager = self.server.ban_manager
+        is_banned = (ban_manager.is_hdid_banned(self.client.hdid) or
+                     any(ban_manager.is_banned(ipid)
+                         for ipid in self.client.server.hdid_list[self.client.hdid]))
+        if is_banned:
+            self.client.send_ooc_others('Banned client with HDID {} and IPID {} attempted to '
+                                        'join the server but was refused entrance.'
+                                        .format(self.client.hdid, self.client.ipid),
+                                        is_officer=True)
+            self.client.send_command('BD')
+            self.client.disconnect()
+            return
 
         if self.client.hdid != 'ms2-prober' or self.server.config['show_ms2-prober']:
             logger.log_server('Connected. HDID: {}.'.format(self.client.hdid), self.client)
@@ -318,7 +374,7 @@ class AOProtocol(asyncio.Protocol):
         # Make sure there is enough room for the client
         char_cnt = len(self.server.char_list)
         evi_cnt = 0
-        music_cnt = sum([len(x) for x in self.server.music_pages_ao1])
+        music_cnt = self.server.music_count_ao1
         self.client.send_command('SI', char_cnt, evi_cnt, music_cnt)
 
     def net_cmd_askchar2(self, _):
@@ -381,12 +437,10 @@ class AOProtocol(asyncio.Protocol):
         AM#%
 
         """
-        # Force the server to rebuild the music list, so that clients who just join get the correct
-        # music list (as well as every time they request an updated music list directly).
+        # Send the full area and music list of the server, so that clients who just join get the
+        # correct music list (as well as every time they request an updated music list directly).
 
-        full_music_list = self.server.build_music_list_ao2(include_areas=True,
-                                                           include_music=True)
-        self.client.send_command('SM', *full_music_list)
+        self.client.send_encoded_command('SM', *self.server.get_music_list_packet('SM'))
 
     def net_cmd_rd(self, _):
         """ Asks for server metadata(charscheck, motd etc.) and a DONE#% signal(also best packet)
@@ -619,10 +673,12 @@ class AOProtocol(asyncio.Protocol):
                 pargs['offset_pair'] = 0
                 pargs['charid_pair_pair_order'] = -1
 
+        template = self.server.client_manager.ICTemplate(params=pargs)
         for area_id in area_range:
             target_area = self.server.area_manager.get_area_by_id(area_id)
-            for c in target_area.clients:
-                c.send_ic(params=pargs, sender=self.client, gag_replaced=gag_replaced)
+            with self.server.packet_cache:
+                for c in target_area.clients:
+                    c.send_ic(sender=self.client, gag_replaced=gag_replaced, template=template)
 
             target_area.set_next_msg_delay(len(msg))
 
@@ -635,6 +691,7 @@ class AOProtocol(asyncio.Protocol):
         logger.log_server('[IC][{}][{}]{}'
                           .format(self.client.area.id, self.client.get_char_name(), msg),
                           self.client)
+        self.server.chat_archive.record('IC', self.client, self.client.area, msg)
 
         # Sending IC messages reveals sneaked players
         if not self.client.is_staff() and not self.client.is_visible:
@@ -644,9 +701,8 @@ class AOProtocol(asyncio.Protocol):
                                                 self.client.area.id),
                                         is_zstaff=True)
 
-        self.server.tasker.create_task(self.client,
-                                       ['as_afk_kick', self.client.area.afk_delay,
-                                        self.client.area.afk_sendto])
+        self.server.tasker.set_afk_kick(self.client, self.client.area.afk_delay,
+                                        self.client.area.afk_sendto)
         if self.client.area.is_recording:
             self.client.area.recorded_messages.append(args)
 
@@ -725,6 +781,7 @@ class AOProtocol(asyncio.Protocol):
             logger.log_server('[OOC][{}][{}][{}]{}'
                               .format(self.client.area.id, self.client.get_char_name(),
                                       self.client.name, args[1]), self.client)
+            self.server.chat_archive.record('OOC', self.client, self.client.area, args[1])
         self.client.last_active = Constants.get_time()
 
     def net_cmd_mc(self, args):
@@ -24,6 +24,7 @@ all necessary actions in order to simulate different rooms.
 """
 
 import asyncio
+import collections
 import time
 
 from server import logger
@@ -31,6 +32,16 @@ from server.constants import Constants
 from server.exceptions import AreaError, ServerError
 from server.evidence import EvidenceList
 
+def _iter_bits(bits):
+    """
+    Yield the positions of the set bits of a non-negative integer, lowest first.
+    """
+
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
 class AreaManager:
     """
     Create a new manager for the areas in a server.
@@ -57,6 +68,7 @@ class AreaManager:
             self.clients = set()
             self.invite_list = {}
             self.id = area_id
+            self.parameters = parameters # As given by the area list, with defaults filled in
             self.server = server
             self.music_looper = None
             self.next_message_time = 0
@@ -64,8 +76,8 @@ class AreaManager:
             self.hp_pro = 10
             self.doc = 'No document.'
             self.status = 'IDLE'
-            self.judgelog = []
-            self.shoutlog = []
+            self.judgelog = collections.deque(maxlen=20)
+            self.shoutlog = collections.deque(maxlen=20)
             self.current_music = ''
             self.current_music_player = ''
             self.evi_list = EvidenceList()
@@ -81,8 +93,9 @@ class AreaManager:
             self.lights = True
             self.last_ic_messages = list()
             self.parties = set()
-            self.dicelog = list()
+            self.dicelog = collections.deque(maxlen=20)
             self._in_zone = None
+            self._passages = None # Cached by AreaManager.get_passages
 
             self.name = parameters['area']
             self.background = parameters['background']
@@ -185,8 +198,9 @@ class AreaManager:
                 Packet arguments.
             """
 
-            for c in self.clients:
-                c.send_command(cmd, *args)
+            with self.server.packet_cache:
+                for c in self.clients:
+                    c.send_command(cmd, *args)
 
         def broadcast_ooc(self, msg):
             """
@@ -338,12 +352,10 @@ class AreaManager:
                 Dice log to record.
             """
 
-            if len(self.dicelog) >= 20:
-                self.dicelog = self.dicelog[1:]
-
             info = '{} | [{}] {} ({}) {}'.format(Constants.get_time(), client.id,
                                                  client.displayname, client.get_ip(), msg)
             self.dicelog.append(info)
+            self.server.chat_archive.record('DICE', client, self, msg)
 
         def get_dicelog(self):
             """
@@ -451,10 +463,7 @@ class AreaManager:
 
             if '..' in anim1 or '..' in anim2:
                 return True
-            for char_link in self.server.allowed_iniswaps:
-                if client.get_char_name() in char_link and char in char_link:
-                    return False
-            return True
+            return char not in self.server.iniswap_table.get(client.get_char_name(), ())
 
         def add_to_judgelog(self, client, msg):
             """
@@ -468,12 +477,10 @@ class AreaManager:
                 Judge action to record.
             """
 
-            if len(self.judgelog) >= 20:
-                self.judgelog = self.judgelog[1:]
-
             info = '{} | [{}] {} ({}) {}'.format(Constants.get_time(), client.id,
                                                  client.displayname, client.get_ip(), msg)
             self.judgelog.append(info)
+            self.server.chat_archive.record('JUDGE', client, self, msg)
 
         def get_judgelog(self):
             """
@@ -706,12 +713,10 @@ class AreaManager:
                 Shout message to record.
             """
 
-            if len(self.shoutlog) >= 20:
-                self.shoutlog = self.shoutlog[1:]
-
             info = '{} | [{}] {} ({}) {}'.format(Constants.get_time(), client.id,
                                                  client.displayname, client.get_ip(), msg)
             self.shoutlog.append(info)
+            self.server.chat_archive.record('SHOUT', client, self, msg)
 
         def add_party(self, party):
             """
@@ -850,6 +855,33 @@ class AreaManager:
 
             self._in_zone = new_zone_value
 
+        @property
+        def reachable_areas(self):
+            """
+            Declarator for a public reachable_areas attribute, the set of names of the areas
+            reachable from this area, or {'<ALL>'} if every area is.
+
+            The set must be assigned again after being modified in place, so that the cached
+            passages of the area are rebuilt.
+            """
+
+            return self._reachable_areas
+
+        @reachable_areas.setter
+        def reachable_areas(self, new_reachable_areas):
+            """
+            Set the reachable_areas parameter to the given one, and discard the cached passages
+            of the area.
+
+            Parameters
+            ----------
+            new_reachable_areas: set of str
+                Names of the areas now reachable from this area, or {'<ALL>'}.
+            """
+
+            self._reachable_areas = new_reachable_areas
+            self._passages = None
+
         def __repr__(self):
             """
             Return a string representation of the area.
@@ -872,16 +904,30 @@ class AreaManager:
         self.server = server
         self.areas = []
         self.area_names = set()
+        # Maps of area name/ID to area, rebuilt whenever an area list is loaded
+        self.areas_by_name = dict()
+        self.areas_by_id = dict()
         self.load_areas()
 
-    def load_areas(self, area_list_file='config/areas.yaml'):
+    def load_areas(self, area_list_file='config/areas.yaml', incremental=False):
         """
         Load an area list.
 
+        By default, every area is created anew, all zones, day cycles and global IC settings are
+        removed, and every client is moved to the new version of their area.
+
+        If loading incrementally, areas of the current area list whose name and parameters are
+        unchanged in the new one are kept as they are (only their ID is updated to their new
+        position), along with their clients, parties and ongoing state. Zones made up only of kept
+        areas are kept, and so are day cycles and global IC settings whose area range is still
+        made up of the same areas. Only clients of areas that changed or no longer exist are moved.
+
         Parameters
         ----------
         area_list_file: str, optional
             Location of the area list to load. Defaults to 'config/areas.yaml'.
+        incremental: bool, optional
+            If True, load the area list incrementally as described above. Defaults to False.
 
         Raises
         ------
@@ -904,8 +950,7 @@ class AreaManager:
         temp_reachable_area_names = set()
 
         # Check if valid area list file
-        with Constants.fopen(area_list_file, 'r') as chars:
-            areas = Constants.yaml_load(chars)
+        areas = self.server.config_store.load(area_list_file)
 
         def_param = {
             'afk_delay': 0,
@@ -933,6 +978,7 @@ class AreaManager:
 
         # Create the areas
         for item in areas:
+            item = dict(item) # The parsed area list is shared, so fill in defaults on a copy
             # Check required parameters
             if 'area' not in item:
                 info = 'Area {} has no name.'.format(current_area_id)
@@ -969,9 +1015,13 @@ class AreaManager:
                             'again.'.format(parameter, item['area']))
                     raise AreaError(info)
 
-            temp_areas.append(self.Area(current_area_id, self.server, item))
+            old_area = self.areas_by_name.get(item['area']) if incremental else None
+            if old_area is not None and old_area.parameters == item:
+                temp_areas.append(old_area)
+            else:
+                temp_areas.append(self.Area(current_area_id, self.server, item))
             temp_area_names.add(item['area'])
-            temp_reachable_area_names |= temp_areas[-1].reachable_areas
+            temp_reachable_area_names |= temp_areas[-1].default_reachable_areas
             current_area_id += 1
 
         # Check if a reachable area is not an area name
@@ -986,27 +1036,37 @@ class AreaManager:
 
         # Only once all areas have been created, actually set the corresponding values
         # Helps avoiding junk area lists if there was an error
-        # But first, remove all zones
+        old_areas = self.areas
+        kept_areas = set(temp_areas).intersection(old_areas)
+        # IDs of areas that are kept with the same ID
+        kept_ids = {area_id for (area_id, area) in enumerate(temp_areas)
+                    if area in kept_areas and area.id == area_id}
 
+        def keeps_range(area_1, area_2):
+            return all(area_id in kept_ids for area_id in range(area_1, area_2+1))
+
+        # But first, remove all zones that contain areas that are not kept
         backup_zones = self.server.zone_manager.get_zones()
         for (zone_id, zone) in backup_zones.items():
+            if zone.get_areas() <= kept_areas:
+                continue
             self.server.zone_manager.delete_zone(zone_id)
             for client in zone.get_watchers():
                 client.send_ooc('Your zone has been automatically deleted.')
 
-        old_areas = self.areas
-        self.areas = temp_areas
-        self.area_names = temp_area_names
-
-        # And cancel all existing day cycles
+        # And cancel all day cycles over areas that are not kept
         for client in self.server.client_manager.clients:
             try:
-                client.server.tasker.remove_task(client, ['as_day_cycle'])
+                day_cycle_args = client.server.tasker.get_task_args(client, ['as_day_cycle'])
             except KeyError:
-                pass
+                continue
+            if not keeps_range(day_cycle_args[1], day_cycle_args[2]):
+                client.server.tasker.remove_task(client, ['as_day_cycle'])
 
-        # And remove all global IC and global IC prefixes
+        # And remove all global IC and global IC prefixes over areas that are not kept
         for client in self.server.client_manager.clients:
+            if client.multi_ic and keeps_range(client.multi_ic[0].id, client.multi_ic[1].id):
+                continue
             if client.multi_ic:
                 client.send_ooc('Due to an area list reload, your global IC was turned off. You '
                                 'may turn it on again manually.')
@@ -1016,45 +1076,66 @@ class AreaManager:
                                 'You may set it again manually.')
                 client.multi_ic_pre = ''
 
+        area_names_changed = ([area.name for area in old_areas]
+                              != [area.name for area in temp_areas])
+        for (area_id, area) in enumerate(temp_areas):
+            area.id = area_id
+        self.areas = temp_areas
+        self.area_names = temp_area_names
+        self.areas_by_name = {area.name: area for area in temp_areas}
+        self.areas_by_id = {area.id: area for area in temp_areas}
+        # Cached passages refer to areas by ID, which may have changed
+        for area in temp_areas:
+            area._passages = None
+
         # If the default area ID is now past the number of available areas, reset it back to zero
         if self.server.default_area >= len(self.areas):
             self.server.default_area = 0
 
-        for area in old_areas:
-            # Decide whether the area still exists or not
-            try:
-                new_area = self.get_area_by_name(area.name)
-                remains = True
-            except AreaError:
-                new_area = self.default_area()
-                remains = False
-
-            # Move existing clients to new corresponding area (or to default area if their previous
-            # area no longer exists).
-            for client in area.clients.copy():
-                # Check if current char is available
-                if new_area.is_char_available(client.char_id):
-                    new_char_id = client.char_id
-                else:
-                    try:
-                        new_char_id = new_area.get_rand_avail_char_id()
-                    except AreaError:
-                        new_char_id = -1
+        # Many of the clients moved to the same area get the same packets, so encode those once
+        with self.server.packet_cache:
+            for area in old_areas:
+                if area in kept_areas:
+                    # Clients stay, but they may need to see the new area names
+                    if area_names_changed:
+                        for client in area.clients:
+                            client.reload_music_list()
+                    continue
+
+                # Decide whether the area still exists or not
+                try:
+                    new_area = self.get_area_by_name(area.name)
+                    remains = True
+                except AreaError:
+                    new_area = self.default_area()
+                    remains = False
+
+                # Move existing clients to new corresponding area (or to default area if their
+                # previous area no longer exists).
+                for client in area.clients.copy():
+                    # Check if current char is available
+                    if new_area.is_char_available(client.char_id):
+                        new_char_id = client.char_id
+                    else:
+                        try:
+                            new_char_id = new_area.get_rand_avail_char_id()
+                        except AreaError:
+                            new_char_id = -1
 
-                if remains:
-                    message = 'Area list reload. Moving you to the new {}.'
-                else:
-                    message = ('Area list reload. Your previous area no longer exists. Moving you '
-                               'to the server default area {}.')
+                    if remains:
+                        message = 'Area list reload. Moving you to the new {}.'
+                    else:
+                        message = ('Area list reload. Your previous area no longer exists. Moving '
+                                   'you to the server default area {}.')
 
-                client.send_ooc(message.format(new_area.name))
-                client.change_area(new_area, ignore_checks=True, change_to=new_char_id,
-                                   ignore_notifications=True)
+                    client.send_ooc(message.format(new_area.name))
+                    client.change_area(new_area, ignore_checks=True, change_to=new_char_id,
+                                       ignore_notifications=True)
 
-            # Move parties (independently)
-            for party in area.parties.copy():
-                party.area = new_area
-                new_area.add_party(party)
+                # Move parties (independently)
+                for party in area.parties.copy():
+                    party.area = new_area
+                    new_area.add_party(party)
 
         # Update the server's area list only once everything is successful
         self.server.old_area_list = self.server.area_list
@@ -1082,10 +1163,10 @@ class AreaManager:
             If no area has the given name.
         """
 
-        for area in self.areas:
-            if area.name == name:
-                return area
-        raise AreaError('Area not found.')
+        try:
+            return self.areas_by_name[name]
+        except (KeyError, TypeError):
+            raise AreaError('Area not found.')
 
     def get_area_by_id(self, num):
         """
@@ -1102,10 +1183,141 @@ class AreaManager:
             If no area has the given ID.
         """
 
-        for area in self.areas:
-            if area.id == num:
-                return area
-        raise AreaError('Area not found.')
+        try:
+            return self.areas_by_id[num]
+        except (KeyError, TypeError):
+            raise AreaError('Area not found.')
+
+    def get_passages(self, area):
+        """
+        Return the passages that start in an area, as a bitset of the IDs of the areas they lead
+        to and the list of those areas.
+
+        Both are built from the reachable areas of the area the first time they are needed, and
+        kept until its reachable areas change or a new area list is loaded.
+
+        Parameters
+        ----------
+        area: self.Area
+            Area the passages start in.
+
+        Returns
+        -------
+        int
+            Bitset whose bit i is set if and only if there is a passage to the area with ID i.
+        tuple of self.Area or None
+            Areas reachable from `area` other than itself, sorted by ID, or None if every area
+            is reachable from it.
+        """
+
+        passages = area._passages
+        if passages is None:
+            reachable_areas = area.reachable_areas
+            if '<ALL>' in reachable_areas:
+                passages = ((1 << len(self.areas)) - 1, None)
+            else:
+                bits = 0
+                for name in reachable_areas:
+                    try:
+                        bits |= 1 << self.areas_by_name[name].id
+                    except KeyError:
+                        pass
+                neighbors = tuple(self.areas[i] for i in _iter_bits(bits) if i != area.id)
+                passages = (bits, neighbors)
+            area._passages = passages
+        return passages
+
+    def get_neighbors(self, area):
+        """
+        Return the areas reachable from an area by following one passage.
+
+        Parameters
+        ----------
+        area: self.Area
+            Area to start from.
+
+        Returns
+        -------
+        tuple of self.Area or None
+            Areas reachable from `area` other than itself, sorted by ID, or None if every area
+            is reachable from it.
+        """
+
+        return self.get_passages(area)[1]
+
+    def get_reachable_areas(self, area, max_steps=None):
+        """
+        Return the areas reachable from an area by following passages.
+
+        Parameters
+        ----------
+        area: self.Area
+            Area to start from.
+        max_steps: int, optional
+            Maximum number of passages to follow. Defaults to None (no limit).
+
+        Returns
+        -------
+        list of self.Area
+            Areas reachable from `area` other than itself, sorted by ID.
+        """
+
+        reached = 1 << area.id
+        frontier = reached
+        steps = 0
+        while frontier and (max_steps is None or steps < max_steps):
+            next_frontier = 0
+            for area_id in _iter_bits(frontier):
+                next_frontier |= self.get_passages(self.areas[area_id])[0]
+            frontier = next_frontier & ~reached
+            reached |= frontier
+            steps += 1
+
+        return [self.areas[i] for i in _iter_bits(reached) if i != area.id]
+
+    def get_shortest_path(self, origin, destination):
+        """
+        Return the shortest way to get from an area to another by following passages.
+
+        Parameters
+        ----------
+        origin: self.Area
+            Area to start from.
+        destination: self.Area
+            Area to get to.
+
+        Returns
+        -------
+        list of self.Area or None
+            Areas visited along the way, starting with `origin` and ending with `destination`, or
+            None if `destination` cannot be reached from `origin`.
+        """
+
+        if origin == destination:
+            return [origin]
+
+        previous = {origin.id: None} # Map of reached area ID to the ID of the area before it
+        visited = 1 << origin.id
+        frontier = [origin.id]
+        while frontier:
+            next_frontier = list()
+            for area_id in frontier:
+                new_bits = self.get_passages(self.areas[area_id])[0] & ~visited
+                visited |= new_bits
+                for new_id in _iter_bits(new_bits):
+                    previous[new_id] = area_id
+                    next_frontier.append(new_id)
+            if destination.id in previous:
+                path = list()
+                area_id = destination.id
+                while area_id is not None:
+                    path.append(self.areas[area_id])
+                    area_id = previous[area_id]
+                path.reverse()
+                return path
+            frontier = next_frontier
+
+        return None
 
     def get_areas_in_range(self, area1, area2):
         """
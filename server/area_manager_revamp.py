@@ -123,10 +123,7 @@ class AreaManager:
                 return False
             if '..' in anim1 or '..' in anim2:
                 return True
-            for char_link in self.server.allowed_iniswaps:
-                if client.get_char_name() in char_link and char in char_link:
-                    return False
-            return True
+            return char not in self.server.iniswap_table.get(client.get_char_name(), ())
 
         def play_music(self, name, cid, length=-1):
             self.send_command('MC', name, cid)
@@ -18,58 +18,318 @@
 
 import ipaddress
 import json
+import os
+import time
 
+from server import logger
 from server.constants import Constants
 from server.exceptions import ServerError
+from server.id_store import submit_write
 
 class BanManager:
-    def __init__(self, server):
-        self.bans = []
-        self.load_banlist()
+    # Seconds to wait after a ban list change before writing it, so that changes made in quick
+    # succession are written together
+    WRITE_DELAY = 1
+
+    def __init__(self, server, file='storage/banlist.json', imports=None):
+        # Maps of banned IPID/HDID to the time the ban expires at, or None if it never expires
+        self.ipid_bans = dict()
+        self.hdid_bans = dict()
+        self.file = file
+        self.imports = list() if imports is None else imports
+        self._write_handle = None
         self.server = server
+        self.load_banlist()
 
     def load_banlist(self):
+        """
+        Load the ban list from its file, and then merge the ban lists of every file in
+        BanManager.imports into it. Import files that are missing or invalid are skipped with a
+        warning.
+        """
+
+        self.ipid_bans.clear()
+        self.hdid_bans.clear()
         try:
-            with Constants.fopen('storage/banlist.json', 'r') as banlist_file:
-                self.bans = json.load(banlist_file)
+            with Constants.fopen(self.file, 'r') as banlist_file:
+                bans = json.load(banlist_file)
         except ServerError as ex:
-            if ex.code == 'FileNotFound':
-                return
-            raise
+            if ex.code != 'FileNotFound':
+                raise
+        else:
+            self.import_bans(bans)
+
+        for file in self.imports:
+            try:
+                added = self.import_banlist(file)
+            except ServerError as ex:
+                logger.log_pdebug('WARNING: Unable to import ban list {}.\n{}'.format(file, ex))
+            else:
+                logger.log_pdebug('Imported {} ban{} from {}.'
+                                  .format(added, 's' if added != 1 else '', file))
 
     def write_banlist(self):
-        with open('storage/banlist.json', 'w') as banlist_file:
-            json.dump(self.bans, banlist_file)
+        """
+        Schedule the ban list to be written to its file. If the server is running, the write is
+        delayed by BanManager.WRITE_DELAY seconds, and all changes made in the meantime are
+        written along with it.
+        """
+
+        loop = self.server.loop
+        if loop is None or not loop.is_running():
+            self.flush_banlist()
+            return
 
-    def add_ban(self, ip):
+        if self._write_handle is None:
+            self._write_handle = loop.call_later(self.WRITE_DELAY, self._write_banlist_now)
+
+    def flush_banlist(self):
+        """
+        Write the ban list to its file right away, including any changes whose write was delayed,
+        and wait for the write to finish.
+        """
+
+        if self._write_handle is not None:
+            self._write_handle.cancel()
+        self._write_banlist_now().result()
+
+    def _write_banlist_now(self):
+        self._write_handle = None
+        return submit_write(self._write_banlist_file, self.file, self.export_bans())
+
+    @staticmethod
+    def _write_banlist_file(file, bans):
+        temp_file = '{}.tmp'.format(file)
+        try:
+            with open(temp_file, 'w') as banlist_file:
+                json.dump(bans, banlist_file)
+            os.replace(temp_file, file)
+        except OSError as ex:
+            logger.log_pdebug('WARNING: Error writing to {}.\n{}: {}'
+                              .format(file, type(ex).__name__, ex))
+
+    def _get_ipid(self, ip):
         try:
             try:
-                int(ip)
+                return int(ip)
             except ValueError:
                 ipaddress.ip_address(ip)
-                ip = self.server.get_ipid(ip)
+                return self.server.get_ipid(ip)
         except ValueError:
             raise ServerError('Argument must be an IP address or IPID.')
-        if ip not in self.bans:
-            self.bans.append(ip)
-        else:
+
+    def add_ban(self, ip, expires=None):
+        """
+        Ban an IPID.
+
+        Parameters
+        ----------
+        ip: int or str
+            IPID, or IP address whose IPID will be banned.
+        expires: float, optional
+            Time, as returned by time.time(), the ban expires at. If None, the ban does not
+            expire. Defaults to None.
+
+        Raises
+        ------
+        ServerError
+            If `ip` is neither an IP address nor an IPID, or if the IPID is already banned.
+        """
+
+        ipid = self._get_ipid(ip)
+        if self.is_banned(ipid):
             raise ServerError('User is already banned.')
+        self.ipid_bans[ipid] = expires
         self.write_banlist()
 
     def remove_ban(self, ip):
-        try:
-            try:
-                int(ip)
-            except ValueError:
-                ipaddress.ip_address(ip)
-                ip = self.server.get_ipid(ip)
-        except ValueError:
-            raise ServerError('Argument must be an IP address or IPID.')
-        if ip in self.bans:
-            self.bans.remove(ip)
-        else:
+        """
+        Unban an IPID.
+
+        Parameters
+        ----------
+        ip: int or str
+            IPID, or IP address whose IPID will be unbanned.
+
+        Raises
+        ------
+        ServerError
+            If `ip` is neither an IP address nor an IPID, or if the IPID is not banned.
+        """
+
+        ipid = self._get_ipid(ip)
+        if not self.is_banned(ipid):
+            raise ServerError('User is already not banned.')
+        self.ipid_bans.pop(ipid)
+        self.write_banlist()
+
+    def add_hdid_ban(self, hdid, expires=None):
+        """
+        Ban an HDID.
+
+        Parameters
+        ----------
+        hdid: str
+            HDID to ban.
+        expires: float, optional
+            Time, as returned by time.time(), the ban expires at. If None, the ban does not
+            expire. Defaults to None.
+
+        Raises
+        ------
+        ServerError
+            If the HDID is already banned.
+        """
+
+        if self.is_hdid_banned(hdid):
+            raise ServerError('User is already banned.')
+        self.hdid_bans[hdid] = expires
+        self.write_banlist()
+
+    def remove_hdid_ban(self, hdid):
+        """
+        Unban an HDID.
+
+        Parameters
+        ----------
+        hdid: str
+            HDID to unban.
+
+        Raises
+        ------
+        ServerError
+            If the HDID is not banned.
+        """
+
+        if not self.is_hdid_banned(hdid):
             raise ServerError('User is already not banned.')
+        self.hdid_bans.pop(hdid)
         self.write_banlist()
 
+    def _check_ban(self, bans, identifier):
+        try:
+            expires = bans[identifier]
+        except KeyError:
+            return False
+
+        if expires is not None and expires <= time.time():
+            bans.pop(identifier)
+            self.write_banlist()
+            return False
+        return True
+
     def is_banned(self, ipid):
-        return ipid in self.bans
+        return self._check_ban(self.ipid_bans, ipid)
+
+    def is_hdid_banned(self, hdid):
+        return self._check_ban(self.hdid_bans, hdid)
+
+    def import_bans(self, bans):
+        """
+        Add bans, as exported by BanManager.export_bans (possibly from another server), to the
+        ban list. If an IPID or HDID is already banned, the ban that lasts longer is kept.
+        This does not write the ban list.
+
+        Parameters
+        ----------
+        bans: list
+            Bans to add. Each ban is either an IPID, which is banned permanently, or a dictionary
+            with either an `ipid` or an `hdid` key, and optionally an `expires` key with the time
+            the ban expires at.
+
+        Returns
+        -------
+        int
+            Number of IPIDs and HDIDs that were not banned before, or had a shorter ban.
+
+        Raises
+        ------
+        ServerError
+            If any ban is not in one of the recognized formats.
+        """
+
+        added = 0
+        for ban in bans:
+            if isinstance(ban, int):
+                target, identifier, expires = self.ipid_bans, ban, None
+            elif isinstance(ban, dict) and 'ipid' in ban:
+                target, identifier, expires = self.ipid_bans, int(ban['ipid']), ban.get('expires')
+            elif isinstance(ban, dict) and 'hdid' in ban:
+                target, identifier, expires = self.hdid_bans, ban['hdid'], ban.get('expires')
+            else:
+                raise ServerError('Invalid ban list entry: {}'.format(ban))
+
+            if identifier in target:
+                current = target[identifier]
+                if current is None or (expires is not None and expires <= current):
+                    continue
+            target[identifier] = expires
+            added += 1
+        return added
+
+    def export_bans(self):
+        """
+        Return the ban list in the format BanManager.import_bans takes.
+
+        Returns
+        -------
+        list
+            Bans. Permanent IPID bans are listed as the IPID, and every other ban as a dictionary.
+        """
+
+        bans = list()
+        for (ipid, expires) in self.ipid_bans.items():
+            if expires is None:
+                bans.append(ipid)
+            else:
+                bans.append({'ipid': ipid, 'expires': expires})
+        for (hdid, expires) in self.hdid_bans.items():
+            if expires is None:
+                bans.append({'hdid': hdid})
+            else:
+                bans.append({'hdid': hdid, 'expires': expires})
+        return bans
+
+    def import_banlist(self, file):
+        """
+        Merge the bans of a ban list file, such as the storage/banlist.json of another server,
+        into the ban list.
+
+        Parameters
+        ----------
+        file: str
+            Path to the ban list file.
+
+        Returns
+        -------
+        int
+            Number of IPIDs and HDIDs that were not banned before, or had a shorter ban.
+
+        Raises
+        ------
+        ServerError
+            If the file could not be opened, or has entries in an unrecognized format.
+        """
+
+        with Constants.fopen(file, 'r') as banlist_file:
+            try:
+                bans = json.load(banlist_file)
+            except ValueError as ex:
+                raise ServerError('Invalid ban list file {}: {}'.format(file, ex))
+
+        added = self.import_bans(bans)
+        if added:
+            self.write_banlist()
+        return added
+
+    def export_banlist(self, file):
+        """
+        Write the ban list to a file that other servers may import.
+
+        Parameters
+        ----------
+        file: str
+            Path to the file.
+        """
+
+        submit_write(self._write_banlist_file, file, self.export_bans()).result()
@@ -0,0 +1,232 @@
+# TsuserverDR, a Danganronpa Online server based on tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com> (original tsuserver3)
+# Current project leader: 2018-19 Chrezm/Iuvee <thechrezm@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import array
+import concurrent.futures
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+
+from server import logger
+
+# Single worker, so archive writes and searches run one at a time away from the event loop, and
+# neither waits behind (nor delays) writes to the other storage files
+_ARCHIVE_WORKER = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+class ChatArchive:
+    """
+    Append-only archive of chat activity (IC and OOC messages, shouts, dice rolls and judge
+    actions), kept as one JSON lines segment per (UTC) month.
+
+    Next to each segment there is an index file listing, for every archived entry, the IPID of
+    the client that caused it and the byte offset of the entry in the segment. The index files
+    are read once, on the first search, into a map of each IPID to the offsets of its entries,
+    which is then kept up to date as entries are written. Looking up the history of a player thus
+    only reads the entries of that player, instead of every entry ever archived.
+
+    Entries are written, and searches are run, in a background thread of the archive's own, so
+    neither blocks the server.
+    """
+
+    def __init__(self, directory, enabled=True):
+        """
+        Parameters
+        ----------
+        directory: str
+            Directory the segments and their indexes are stored in. It is created if needed.
+        enabled: bool, optional
+            If False, nothing is recorded. Defaults to True.
+        """
+
+        self.directory = directory
+        self.enabled = enabled
+        self._pending = list()
+        self._pending_lock = threading.Lock()
+        self._write_scheduled = False
+        # Map of IPID to map of segment to offsets of the entries of the IPID in the segment.
+        # Only used in the archive thread, and None until the first search.
+        self._offsets = None
+
+    def record(self, entry_type, client, area, text):
+        """
+        Archive an entry.
+
+        Parameters
+        ----------
+        entry_type: str
+            Type of entry, such as 'IC', 'OOC', 'SHOUT', 'DICE' or 'JUDGE'.
+        client: ClientManager.Client
+            Client that caused the entry.
+        area: AreaManager.Area
+            Area the entry took place in.
+        text: str
+            Contents of the entry.
+        """
+
+        if not self.enabled:
+            return
+
+        entry = {
+            'time': round(time.time(), 3),
+            'type': entry_type,
+            'area': area.id,
+            'ipid': client.ipid,
+            'cid': client.id,
+            'char': client.get_char_name(),
+            'name': client.name,
+            'text': text,
+            }
+
+        with self._pending_lock:
+            self._pending.append(entry)
+            if self._write_scheduled:
+                return
+            self._write_scheduled = True
+        _ARCHIVE_WORKER.submit(self._write_pending)
+
+    def flush(self):
+        """
+        Write all pending entries, waiting for the write to complete.
+        """
+
+        _ARCHIVE_WORKER.submit(self._write_pending).result()
+
+    def search(self, ipid, text=None, limit=20):
+        """
+        Look up the most recent archived entries of a player, from oldest to newest, in the
+        archive thread. Entries recorded before the search are included.
+
+        Parameters
+        ----------
+        ipid: int
+            IPID of the player.
+        text: str, optional
+            If given, only entries whose text contains this (ignoring case) are returned.
+            Defaults to None.
+        limit: int, optional
+            Maximum number of entries to return. Defaults to 20.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the list of matching entries, each a dict of str to Any.
+        """
+
+        return _ARCHIVE_WORKER.submit(self._search, ipid, text, limit)
+
+    def _search(self, ipid, text, limit):
+        # Run pending writes first, so that their entries are found
+        self._write_pending()
+        if self._offsets is None:
+            self._load_offsets()
+        if text is not None:
+            text = text.lower()
+
+        matches = list()
+        segments = self._offsets.get(ipid, dict())
+        # Segment names sort chronologically, so go through them newest first
+        for segment in sorted(segments, reverse=True):
+            offsets = segments[segment]
+            segment_matches = list()
+            segment_file_name = os.path.join(self.directory, '{}.jsonl'.format(segment))
+            with open(segment_file_name, 'rb') as segment_file:
+                for offset in reversed(offsets):
+                    segment_file.seek(offset)
+                    entry = json.loads(segment_file.readline())
+                    if text is None or text in entry['text'].lower():
+                        segment_matches.append(entry)
+                        if len(matches) + len(segment_matches) >= limit:
+                            break
+            matches.extend(segment_matches)
+            if len(matches) >= limit:
+                break
+
+        matches.reverse()
+        return matches
+
+    @staticmethod
+    def format_entry(entry):
+        """
+        Return a human readable line describing an archived entry. Times are given in UTC, same
+        as the segments are named in.
+
+        Parameters
+        ----------
+        entry: dict of str to Any
+            Entry to describe.
+
+        Returns
+        -------
+        str
+            Description of the entry.
+        """
+
+        moment = datetime.datetime.fromtimestamp(entry['time'], datetime.timezone.utc)
+        return ('{} UTC | [{}][{}] [{}] {} ({}): {}'
+                .format(moment.strftime('%Y-%m-%d %H:%M:%S'), entry['type'], entry['area'], entry['cid'], entry['char'],
+                        entry['name'], entry['text']))
+
+    def _load_offsets(self):
+        self._offsets = dict()
+        for index_file in glob.glob(os.path.join(self.directory, '*.idx')):
+            segment = os.path.basename(index_file)[:-len('.idx')]
+            with open(index_file, 'r', encoding='utf-8') as index:
+                for line in index:
+                    entry_ipid, offset = line.split()
+                    self._add_offset(int(entry_ipid), segment, int(offset))
+
+    def _add_offset(self, ipid, segment, offset):
+        segments = self._offsets.setdefault(ipid, dict())
+        segments.setdefault(segment, array.array('q')).append(offset)
+
+    def _write_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, list()
+            self._write_scheduled = False
+        if not pending:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            by_segment = dict()
+            for entry in pending:
+                moment = datetime.datetime.fromtimestamp(entry['time'], datetime.timezone.utc)
+                segment = moment.strftime('%Y-%m')
+                by_segment.setdefault(segment, list()).append(entry)
+
+            for (segment, entries) in by_segment.items():
+                segment_file = os.path.join(self.directory, '{}.jsonl'.format(segment))
+                index_file = os.path.join(self.directory, '{}.idx'.format(segment))
+                index_lines = list()
+                with open(segment_file, 'ab') as archive:
+                    offset = archive.tell()
+                    for entry in entries:
+                        line = json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n'
+                        archive.write(line)
+                        index_lines.append('{} {}\n'.format(entry['ipid'], offset))
+                        if self._offsets is not None:
+                            self._add_offset(entry['ipid'], segment, offset)
+                        offset += len(line)
+                with open(index_file, 'a', encoding='utf-8') as index:
+                    index.writelines(index_lines)
+        except OSError as ex:
+            logger.log_pdebug('Unable to write to the chat archive: {}: {}'
+                              .format(type(ex).__name__, ex))
@@ -84,19 +84,15 @@ class ClientChangeArea:
                 area.name in client.area.reachable_areas or '<ALL>' in client.area.reachable_areas):
             info = ('Selected area cannot be reached from your area without authorization. '
                     'Try one of the following areas instead: ')
-            if client.area.reachable_areas == {client.area.name}:
+            neighbors = client.server.area_manager.get_neighbors(client.area)
+            if neighbors is None:
+                #When would you ever execute this piece of code is beyond me, but meh
+                info += '\r\n<ALL>'
+            elif not neighbors:
                 info += '\r\n*No areas available.'
             else:
-                get_name = client.server.area_manager.get_area_by_name
-                try:
-                    sorted_areas = sorted(client.area.reachable_areas, key=lambda x: get_name(x).id)
-                    for reachable_area in sorted_areas:
-                        if reachable_area != client.area.name:
-                            area_id = client.server.area_manager.get_area_by_name(reachable_area).id
-                            info += '\r\n*({}) {}'.format(area_id, reachable_area)
-                except AreaError:
-                    #When would you ever execute this piece of code is beyond me, but meh
-                    info += '\r\n<ALL>'
+                for reachable_area in neighbors:
+                    info += '\r\n*({}) {}'.format(reachable_area.id, reachable_area.name)
             raise ClientError(info, code='ChArUnreachable')
 
         # Check if current character is taken in the new area
@@ -573,7 +569,7 @@ class ClientChangeArea:
                 c.follow_area(area)
 
         client.reload_music_list() # Update music list to include new area's reachable areas
-        client.server.tasker.create_task(client, ['as_afk_kick', area.afk_delay, area.afk_sendto])
+        client.server.tasker.set_afk_kick(client, area.afk_delay, area.afk_sendto)
         # Try and restart handicap if needed
         try:
             _, length, name, announce_if_over = client.server.tasker.get_task_args(client,
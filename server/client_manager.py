@@ -16,22 +16,443 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+import collections
 import datetime
+import heapq
+import operator
 import time
 import warnings
 
 from server import client_changearea
-from server import fantacrypt
 from server import logger
 from server.exceptions import AreaError, ClientError, PartyError
 from server.constants import TargetType, Constants, Clients
 
+def _indexed_attribute(name):
+    """
+    Create a property for a client attribute whose holders are tracked by the client manager, so
+    that they can be looked up without scanning every client.
+
+    Parameters
+    ----------
+    name: str
+        Name of the attribute. Its value is stored in a private attribute of the same name
+        preceded by an underscore.
+
+    Returns
+    -------
+    property
+        Property to assign to the attribute name.
+    """
+
+    private_name = '_{}'.format(name)
+
+    def setter(self, value):
+        setattr(self, private_name, value)
+        self.server.client_manager.update_index(self, name, value)
+
+    return property(operator.attrgetter(private_name), setter,
+                    doc='Declarator for a public {} attribute, indexed by the client manager.'
+                    .format(name))
+
+def _target_attribute(name, target_type, get_key=None):
+    """
+    Create a property for a client attribute that clients may be targeted by, so that the client
+    manager keeps its target index up to date whenever the attribute changes.
+
+    Parameters
+    ----------
+    name: str
+        Name of the attribute. Its value is stored in a private attribute of the same name
+        preceded by an underscore.
+    target_type: TargetType
+        Target type whose index is updated.
+    get_key: Callable[[ClientManager.Client, Any], Any], optional
+        Function that takes the client and the new attribute value, and returns the key to index
+        the client by. Defaults to None, which indexes the client by the attribute value itself.
+
+    Returns
+    -------
+    property
+        Property to assign to the attribute name.
+    """
+
+    private_name = '_{}'.format(name)
+
+    def setter(self, value):
+        setattr(self, private_name, value)
+        key = value if get_key is None else get_key(self, value)
+        self.server.client_manager.update_target_index(self, target_type, key)
+
+    return property(operator.attrgetter(private_name), setter,
+                    doc='Declarator for a public {} attribute, indexed by the client manager.'
+                    .format(name))
+
+def _lazy_attribute(name, factory, sources=()):
+    """
+    Create a property for a client attribute whose value is only built the first time it is
+    accessed, so that connections that never use it (such as the many that disconnect before
+    finishing the handshake) do not pay for it. If the value is built from other attributes of
+    the client, it is built again the first time it is accessed after any of them changed.
+
+    Parameters
+    ----------
+    name: str
+        Name of the attribute. Its value is stored in a private attribute of the same name
+        preceded by an underscore, along with the values of `sources` it was built or set with.
+    factory: Callable[[ClientManager.Client], Any]
+        Function that takes the client and returns the initial value of the attribute.
+    sources: tuple of str, optional
+        Names of the client attributes `factory` builds the value from. Defaults to no
+        attributes.
+
+    Returns
+    -------
+    property
+        Property to assign to the attribute name.
+    """
+
+    private_name = '_{}'.format(name)
+
+    def get_key(self):
+        return tuple([getattr(self, source) for source in sources])
+
+    def getter(self):
+        key = get_key(self)
+        try:
+            built_key, value = getattr(self, private_name)
+        except AttributeError:
+            pass
+        else:
+            if built_key == key:
+                return value
+
+        value = factory(self)
+        setattr(self, private_name, (key, value))
+        return value
+
+    def setter(self, value):
+        setattr(self, private_name, (get_key(self), value))
+
+    return property(getter, setter,
+                    doc='Declarator for a public {} attribute, built on first access.'
+                    .format(name))
+
+class _TargetIndex:
+    """
+    Map of keys to the clients that have them, where each client has at most one key.
+    """
+
+    __slots__ = ('_holders', '_keys')
+
+    def __init__(self):
+        self._holders = dict() # Key -> set of clients with that key
+        self._keys = dict() # Client -> their key
+
+    def set(self, client, key):
+        self.discard(client)
+        self._keys[client] = key
+        try:
+            self._holders[key].add(client)
+        except KeyError:
+            self._holders[key] = {client}
+            self._new_key(key)
+
+    def discard(self, client):
+        try:
+            key = self._keys.pop(client)
+        except KeyError:
+            return
+        holders = self._holders[key]
+        holders.discard(client)
+        if not holders:
+            del self._holders[key]
+            self._removed_key(key)
+
+    def find(self, key):
+        return list(self._holders.get(key, ()))
+
+    def get_holders(self, key):
+        return self._holders.get(key, frozenset())
+
+    def _new_key(self, key):
+        pass
+
+    def _removed_key(self, key):
+        pass
+
+class _PrefixTargetIndex(_TargetIndex):
+    """
+    Target index of case-insensitive strings that can also be searched by prefix. Distinct keys
+    are kept sorted, so all keys with some prefix are contiguous from the first key not smaller
+    than the prefix.
+    """
+
+    __slots__ = ('_sorted_keys',)
+
+    def __init__(self):
+        super().__init__()
+        self._sorted_keys = list()
+
+    def set(self, client, key):
+        super().set(client, key.lower())
+
+    def find(self, key):
+        return super().find(key.lower())
+
+    def find_prefix(self, prefix):
+        prefix = prefix.lower()
+        keys = self._sorted_keys
+        matches = list()
+        for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix):
+                break
+            matches.extend(self._holders[keys[i]])
+        return matches
+
+    def _new_key(self, key):
+        bisect.insort(self._sorted_keys, key)
+
+    def _removed_key(self, key):
+        del self._sorted_keys[bisect.bisect_left(self._sorted_keys, key)]
+
+class _ConnectionLimiter:
+    """
+    Token buckets limiting how often each IP address may open new connections.
+
+    Every IP address may connect `capacity` times in a burst, and then regains the right to
+    connect once every `interval`/`capacity` seconds, up to `capacity` connections.
+    """
+
+    # Number of tracked IP addresses at which buckets that refilled are dropped
+    PRUNE_SIZE = 1024
+
+    def __init__(self):
+        self._buckets = dict() # IP -> (available connections, time they were last updated)
+        self._prune_at = self.PRUNE_SIZE
+
+    def admit(self, ip, capacity, interval):
+        """
+        Decide whether a new connection from an IP address is accepted, and if so, account for it.
+
+        Parameters
+        ----------
+        ip: str
+            IP address of the connection.
+        capacity: int
+            Number of connections an IP address may open in a burst.
+        interval: float
+            Time in seconds it takes for an IP address to regain `capacity` connections. If not
+            positive, every connection is accepted.
+
+        Returns
+        -------
+        bool
+            True if the connection is accepted, False otherwise.
+        """
+
+        if interval <= 0 or capacity <= 0:
+            return True
+
+        now = time.monotonic()
+        rate = capacity / interval
+        available, last_update = self._buckets.get(ip, (capacity, now))
+        available = min(capacity, available + (now-last_update)*rate)
+        if available < 1:
+            self._buckets[ip] = (available, now)
+            return False
+
+        self._buckets[ip] = (available-1, now)
+        if len(self._buckets) >= self._prune_at:
+            # Forget IP addresses that would have regained all their connections by now anyway
+            self._buckets = {bucket_ip: (bucket_available, bucket_update)
+                             for (bucket_ip, (bucket_available, bucket_update))
+                             in self._buckets.items()
+                             if bucket_available + (now-bucket_update)*rate < capacity}
+            self._prune_at = max(self.PRUNE_SIZE, 2*len(self._buckets))
+        return True
+
 class ClientManager:
+    # Client attributes whose holders (clients with a truthy value) are indexed
+    INDEXED_ATTRIBUTES = ('is_mod', 'is_cm', 'is_gm', 'is_muted', 'is_ooc_muted')
+    # Target types matched by exact value, and target types matched by case-insensitive prefix
+    EXACT_TARGET_TYPES = (TargetType.ID, TargetType.IPID, TargetType.HDID)
+    PREFIX_TARGET_TYPES = (TargetType.IP, TargetType.OOC_NAME, TargetType.CHAR_NAME,
+                           TargetType.SHOWNAME, TargetType.CHAR_FOLDER)
+
+    class ICTemplate:
+        """
+        Packet arguments of an IC message that is about to be sent to several clients.
+
+        The default-filled arguments, and the argument vector in the order each client protocol
+        expects, are computed once per protocol and shared by all recipients of that protocol.
+        Recipients that need receiver-specific changes (such as being blind, deaf or in first
+        person mode) work on a copy of the shared arguments instead.
+        """
+
+        __slots__ = ('params', 'msg', 'pos', 'cid', 'ding', 'color', 'showname', '_pargs',
+                     '_prepared')
+
+        def __init__(self, params=None, msg=None, pos=None, cid=None, ding=None, color=None,
+                     showname=None):
+            """
+            Parameters
+            ----------
+            params: dict of str to Any, optional
+                Packet arguments of the message. If None, only the remaining parameters are
+                used, and every other argument takes its protocol default value. Defaults to
+                None.
+            msg: str, optional
+                Message. If not None, it takes precedence over any message in `params`.
+                Defaults to None.
+            pos: str, optional
+                Position. Only used if `params` is None. Defaults to None.
+            cid: int, optional
+                Character ID. Only used if `params` is None. Defaults to None.
+            ding: int, optional
+                Ding. Only used if `params` is None. Defaults to None.
+            color: int, optional
+                Text color. Only used if `params` is None. Defaults to None.
+            showname: str, optional
+                Showname. Only used if `params` is None. Defaults to None.
+            """
+
+            self.params = params
+            self.msg = msg
+            self.pos = pos
+            self.cid = cid
+            self.ding = ding
+            self.color = color
+            self.showname = showname
+            # Maps of client protocol to computed arguments
+            self._pargs = dict()
+            self._prepared = dict()
+
+        def get_pargs(self, client):
+            """
+            Return the packet arguments of the message for the protocol of `client`, with
+            defaults filled in and None values removed. The returned map is shared by all
+            recipients, so it must not be modified.
+
+            Parameters
+            ----------
+            client: ClientManager.Client
+                Recipient of the message.
+
+            Returns
+            -------
+            dict of str to Any
+                Packet arguments. Map is of argument name to argument value.
+            """
+
+            try:
+                return self._pargs[client.packet_handler]
+            except KeyError:
+                pass
+
+            schema = Clients.OUTBOUND_SCHEMAS[client.packet_handler]['MS']
+            pargs = dict(zip(schema.names, schema.defaults))
+            if self.params is None:
+                pargs['msg'] = self.msg
+                pargs['pos'] = self.pos
+                pargs['cid'] = self.cid
+                pargs['ding'] = self.ding
+                pargs['color'] = self.color
+                pargs['showname'] = self.showname
+            else:
+                for key in self.params:
+                    pargs[key] = self.params[key]
+                if self.msg is not None:
+                    pargs['msg'] = self.msg
+
+            # Remove None values from pargs, which could have happened while setting default
+            # values from the function call
+            pargs = {key: value for (key, value) in pargs.items() if value is not None}
+            self._pargs[client.packet_handler] = pargs
+            return pargs
+
+        def get_prepared(self, client):
+            """
+            Return the result of preparing the unmodified packet arguments of the message for the
+            protocol of `client`. The returned values are shared by all recipients, so they must
+            not be modified.
+
+            Parameters
+            ----------
+            client: ClientManager.Client
+                Recipient of the message.
+
+            Returns
+            -------
+            final_pargs : dict of str to Any
+                Packet arguments the client protocol recognizes. Map is of argument name to
+                argument value.
+            to_send : tuple of str
+                Packet argument values listed in the order the client protocol expects.
+            """
+
+            try:
+                return self._prepared[client.packet_handler]
+            except KeyError:
+                pass
+
+            final_pargs, to_send = client.prepare_command('ms', self.get_pargs(client))
+            prepared = (final_pargs, tuple(to_send))
+            self._prepared[client.packet_handler] = prepared
+            return prepared
+
     class Client:
+        is_mod = _indexed_attribute('is_mod')
+        is_cm = _indexed_attribute('is_cm')
+        is_gm = _indexed_attribute('is_gm')
+        is_muted = _indexed_attribute('is_muted')
+        is_ooc_muted = _indexed_attribute('is_ooc_muted')
+        id = _target_attribute('id', TargetType.ID)
+        ipid = _target_attribute('ipid', TargetType.IPID)
+        hdid = _target_attribute('hdid', TargetType.HDID)
+        name = _target_attribute('name', TargetType.OOC_NAME)
+        showname = _target_attribute('showname', TargetType.SHOWNAME)
+        char_folder = _target_attribute('char_folder', TargetType.CHAR_FOLDER)
+        char_id = _target_attribute('char_id', TargetType.CHAR_NAME,
+                                    get_key=lambda client, char_id: client.get_char_name(char_id))
+        area_changer = _lazy_attribute('area_changer', client_changearea.ClientChangeArea)
+        evi_list = _lazy_attribute('evi_list', lambda client: list())
+        followedby = _lazy_attribute('followedby', lambda client: set())
+        showname_history = _lazy_attribute('showname_history', lambda client: list())
+        dicelog = _lazy_attribute('dicelog', lambda client: collections.deque(maxlen=20))
+        mus_change_time = _lazy_attribute('mus_change_time',
+                                          lambda client: [x * client.mflood_interval
+                                                          for x in range(client.mflood_times)],
+                                          sources=('mflood_interval', 'mflood_times'))
+
+        # Client state lives in slots rather than in a per-instance dictionary, which makes each
+        # connection smaller and attribute access faster. A dictionary is still available for
+        # attributes other code may add.
+        __slots__ = (
+            '__dict__', 'server', 'transport', 'can_join', 'can_askchaa', 'version',
+            'packet_handler', 'bad_version', 'fake_name', 'pos', 'joined', 'join_started',
+            'join_duration', 'last_active', 'area', 'party', 'is_dj', 'pm_mute', 'mod_call_time',
+            'in_rp', 'autopass', 'disemvowel', 'disemconsonant', 'remove_h', 'gimp',
+            'is_visible', 'multi_ic', 'multi_ic_pre', 'following', 'music_list',
+            'music_list_index', 'is_transient', 'handicap_backup', 'is_movement_handicapped',
+            'show_shownames', 'is_bleeding', 'get_foreign_rolls', 'last_sent_clock',
+            'last_ic_message', 'last_ooc_message', 'first_person', 'last_ic_notme', 'is_blind',
+            'is_deaf', 'is_gagged', 'send_deaf_space', 'files', 'get_nonautopass_autopass',
+            'charid_pair', 'offset_pair', 'last_sprite', 'flip', 'claimed_folder',
+            'last_ic_raw_message', 'last_ic_char', 'last_ic_received_mine', 'mus_counter',
+            'mute_time', 'mflood_interval', 'mflood_times', 'mflood_mutelength',
+            'bytes_sent', 'is_output_paused', '_output', '_output_size', '_output_scheduled',
+            'muted_global', 'muted_adverts',
+            # Indexed, target and lazy attributes
+            '_is_mod', '_is_cm', '_is_gm', '_is_muted', '_is_ooc_muted', '_id', '_ipid', '_hdid',
+            '_name', '_showname', '_char_folder', '_char_id', '_zone_watched', '_area_changer',
+            '_evi_list', '_followedby', '_showname_history', '_dicelog', '_mus_change_time',
+            )
+
         def __init__(self, server, transport, user_id, ipid, my_protocol=None, ip=None):
             self.server = server
             self.transport = transport
-            self.area_changer = client_changearea.ClientChangeArea(self)
             self.can_join = 0 # Needs to be 2 to actually connect
             self.can_askchaa = True # Needs to be true to process an askchaa packet
             self.version = ('Undefined', 'Undefined') # AO version used, established through ID pack
@@ -48,6 +469,8 @@ class ClientManager:
             self.pos = ''
             self.showname = ''
             self.joined = time.time()
+            self.join_started = None # Time the handshake started, while it is in progress
+            self.join_duration = None # Time the handshake took in seconds, once finished
             self.last_active = Constants.get_time()
 
             self.area = server.area_manager.default_area()
@@ -60,7 +483,6 @@ class ClientManager:
             self.is_ooc_muted = False
             self.pm_mute = False
             self.mod_call_time = 0
-            self.evi_list = []
             self.muted_adverts = False
             self.muted_global = False
             self.pm_mute = False
@@ -75,9 +497,8 @@ class ClientManager:
             self.multi_ic = None
             self.multi_ic_pre = ''
             self.following = None
-            self.followedby = set()
             self.music_list = None
-            self.showname_history = list()
+            self.music_list_index = None # Pair of music list and its index, see get_music_index
             self.is_transient = False
             self.handicap_backup = None # Use if custom handicap is overwritten with a server one
             self.is_movement_handicapped = False
@@ -93,7 +514,6 @@ class ClientManager:
             self.is_deaf = False
             self.is_gagged = False
             self.send_deaf_space = False
-            self.dicelog = list()
             self._zone_watched = None
             self.files = None
             self.get_nonautopass_autopass = False
@@ -119,24 +539,126 @@ class ClientManager:
             self.mflood_interval = self.server.config['music_change_floodguard']['interval_length']
             self.mflood_times = self.server.config['music_change_floodguard']['times_per_interval']
             self.mflood_mutelength = self.server.config['music_change_floodguard']['mute_length']
-            self.mus_change_time = [x * self.mflood_interval for x in range(self.mflood_times)]
+
+            # Outbound data
+            self.bytes_sent = 0 # Bytes handed over to the transport so far
+            self.is_output_paused = False # True while the transport asks to stop writing to it
+            self._output = list() # Data waiting to be handed over to the transport
+            self._output_size = 0
+            self._output_scheduled = False
+
+        # Limits to the data waiting to be sent to a client, in bytes. The transport asks to stop
+        # writing to it once it holds more than OUTPUT_HIGH_WATER bytes, and to resume once it
+        # holds at most OUTPUT_LOW_WATER bytes. Clients that have more than OUTPUT_BACKLOG_LIMIT
+        # bytes waiting while writing is stopped are disconnected.
+        OUTPUT_HIGH_WATER = 64 * 1024
+        OUTPUT_LOW_WATER = 16 * 1024
+        OUTPUT_BACKLOG_LIMIT = 1024 * 1024
+
+        @property
+        def queued_bytes(self):
+            """
+            Number of bytes waiting to be sent to the client, both those not yet handed over to the
+            transport and those the transport still buffers.
+            """
+
+            return self._output_size + self.transport.get_write_buffer_size()
+
+        def queue_output(self, data):
+            """
+            Queue encoded data to be sent to the client. All data queued during an iteration of
+            the event loop is handed over to the transport in a single write at the end of it,
+            so that bursts of packets do not each become a write of their own.
+
+            Parameters
+            ----------
+            data: bytes
+                Data to send.
+            """
+
+            if self.transport.is_closing():
+                # Nothing queued now could be sent anymore, such as after the client was
+                # disconnected for not keeping up
+                return
+
+            self._output.append(data)
+            self._output_size += len(data)
+            if self.is_output_paused:
+                if self._output_size > self.OUTPUT_BACKLOG_LIMIT:
+                    logger.log_server('Disconnected for not keeping up with the data sent to it '
+                                      '({} bytes waiting).'.format(self.queued_bytes), self)
+                    self._output.clear()
+                    self._output_size = 0
+                    self.transport.abort()
+            elif not self._output_scheduled:
+                self._output_scheduled = True
+                self.server.loop.call_soon(self.flush_output)
+
+        def flush_output(self):
+            """
+            Hand over all queued data to the transport, unless the transport asked to stop
+            writing to it.
+            """
+
+            self._output_scheduled = False
+            if self.is_output_paused or not self._output:
+                return
+
+            data = self._output[0] if len(self._output) == 1 else b''.join(self._output)
+            self._output.clear()
+            self._output_size = 0
+            self.bytes_sent += len(data)
+            self.transport.write(data)
+
+        def pause_output(self):
+            """
+            Stop handing over data to the transport until `resume_output` is called. Data sent
+            in the meantime is held back.
+            """
+
+            self.is_output_paused = True
+
+        def resume_output(self):
+            """
+            Resume handing over data to the transport, starting with any data held back.
+            """
+
+            self.is_output_paused = False
+            self.flush_output()
 
         def send_raw_message(self, msg):
             # print(f'< {self.id}: {msg}')
-            self.transport.write(msg.encode('utf-8'))
+            self.queue_output(msg.encode('utf-8'))
 
         def send_command(self, command, *args):
-            if args:
-                if command == 'MS':
-                    for evi_num in range(len(self.evi_list)):
-                        if self.evi_list[evi_num] == args[11]:
-                            lst = list(args)
-                            lst[11] = evi_num
-                            args = tuple(lst)
-                            break
-                self.send_raw_message('{}#{}#%'.format(command, '#'.join([str(x) for x in args])))
+            if command == 'MS' and args:
+                # Evidence is sent as its index in the client's evidence list, so patch it in
+                # for this client alone
+                evidence = args[11]
+                for evi_num in range(len(self.evi_list)):
+                    if self.evi_list[evi_num] == evidence:
+                        evidence = evi_num
+                        break
+                head, tail = self.server.packet_cache.encode_split(command, args, 11)
+                self.queue_output(b''.join([head, str(evidence).encode('utf-8'), tail]))
             else:
-                self.send_raw_message('{}#%'.format(command))
+                self.queue_output(self.server.packet_cache.encode(command, args))
+
+        def send_encoded_command(self, command, args, data):
+            """
+            Send a packet whose encoding is already known.
+
+            Parameters
+            ----------
+            command: str
+                ID of the packet.
+            args: tuple
+                Packet arguments.
+            data: bytes
+                Encoding of the packet with ID `command` and arguments `args`.
+            """
+
+            self.queue_output(data)
 
         def prepare_command(self, identifier, pargs):
             """
@@ -159,18 +681,11 @@ class ClientManager:
 
             """
 
-            final_pargs = dict()
-            to_send = list()
-
-            outbound_args = self.packet_handler['{}_OUTBOUND'.format(identifier.upper())].value
-
-            for (field, default_value) in outbound_args:
-                try:
-                    value = pargs[field]
-                except KeyError: # If the key was popped/is missing, use defaults then
-                    value = default_value
-                to_send.append(value)
-                final_pargs[field] = value
+            schema = Clients.OUTBOUND_SCHEMAS[self.packet_handler][identifier.upper()]
+            # If a key was popped/is missing, use defaults then
+            to_send = [pargs.get(field, default_value)
+                       for (field, default_value) in zip(schema.names, schema.defaults)]
+            final_pargs = dict(zip(schema.names, to_send))
 
             return final_pargs, to_send
 
@@ -195,8 +710,6 @@ class ClientManager:
             if not allow_empty and not msg:
                 return
 
-            if pred is None:
-                pred = lambda x: True
             if not_to is None:
                 not_to = set()
             if username is None:
@@ -213,44 +726,38 @@ class ClientManager:
         def send_ic(self, ic_params=None, params=None, sender=None, pred=None, not_to=None,
                     gag_replaced=False, is_staff=None, in_area=None, to_blind=None, to_deaf=None,
                     bypass_replace=False, bypass_deafened_starters=False,
-                    msg=None, pos=None, cid=None, ding=None, color=None, showname=None):
+                    msg=None, pos=None, cid=None, ding=None, color=None, showname=None,
+                    template=None):
 
             # sender is the client who sent the IC message
             # self is who is receiving the IC message at this particular moment
-
-            # Assert correct call to the function
-            if ic_params is None and params is None and msg is None:
-                raise ValueError('Expected message.')
-
-            if ic_params is not None and params is not None:
-                raise ValueError('Conflicting ic_params and params')
-
-            if ic_params is not None:
-                self.ic_params_deprecation_warning()
-                params = {self.packet_handler.MS_OUTBOUND.value[i][0]: ic_params[i]
-                          for i in range(len(ic_params))}
-
-            # Fill in defaults
-            # Expected behavior is as follows:
-            #  If ic_params is None, then the sent IC message will only include custom details
-            #  about the ding and the message, everything else is fixed. However, sender details
-            #  are considered when replacing the parameters based on sender/receiver's properties
-            #  If ic_params is not None, then the sent IC message will use the parameters given in
-            #  ic_params, and use the properties of sender to replace the parameters if needed.
-
-            pargs = {x: y for (x, y) in self.packet_handler.MS_OUTBOUND.value}
-            if params is None:
-                pargs['msg'] = msg
-                pargs['pos'] = pos
-                pargs['cid'] = cid
-                pargs['ding'] = ding
-                pargs['color'] = color
-                pargs['showname'] = showname
-            else:
-                for key in params:
-                    pargs[key] = params[key]
-                if msg is not None:
-                    pargs['msg'] = msg
+            # template, if given, is a ClientManager.ICTemplate shared by all recipients of the
+            # message, and takes the place of ic_params, params and the message details
+
+            if template is None:
+                # Assert correct call to the function
+                if ic_params is None and params is None and msg is None:
+                    raise ValueError('Expected message.')
+
+                if ic_params is not None and params is not None:
+                    raise ValueError('Conflicting ic_params and params')
+
+                if ic_params is not None:
+                    self.ic_params_deprecation_warning()
+                    params = {self.packet_handler.MS_OUTBOUND.value[i][0]: ic_params[i]
+                              for i in range(len(ic_params))}
+
+                # Fill in defaults
+                # Expected behavior is as follows:
+                #  If ic_params is None, then the sent IC message will only include custom details
+                #  about the ding and the message, everything else is fixed. However, sender
+                #  details are considered when replacing the parameters based on sender/receiver's
+                #  properties
+                #  If ic_params is not None, then the sent IC message will use the parameters given
+                #  in ic_params, and use the properties of sender to replace the parameters if
+                #  needed.
+                template = ClientManager.ICTemplate(params=params, msg=msg, pos=pos, cid=cid,
+                                                    ding=ding, color=color, showname=showname)
 
             # Check if receiver is actually meant to receive the message. Bail out early if not.
             cond = Constants.build_cond(self, is_staff=is_staff, in_area=in_area, not_to=not_to,
@@ -258,21 +765,21 @@ class ClientManager:
             if not cond(self):
                 return
 
-            # Remove None values from pargs, which could have happened while setting default values
-            # from the function call
-            to_pop = list()
-            for (key, value) in pargs.items():
-                if pargs[key] is None:
-                    to_pop.append(key)
-            for key in to_pop:
-                pargs.pop(key)
+            # Arguments shared with all other recipients of the message. They are only copied if
+            # this receiver's properties require changing them.
+            shared_pargs = template.get_pargs(self)
+            pargs = shared_pargs
 
             def pop_if_there(dictionary, argument):
                 if argument in dictionary:
                     dictionary.pop(argument)
 
             # Change the message to account for receiver's properties
-            if not bypass_replace:
+            if not bypass_replace and (self.is_blind or self.is_deaf or self.first_person or
+                                       (self.show_shownames and sender) or
+                                       (sender and sender.multi_ic_pre and self != sender)):
+                pargs = shared_pargs.copy()
+
                 # Change "character" parts of IC port
                 if self.is_blind:
                     pargs['anim'] = '../../misc/blank'
@@ -345,8 +852,12 @@ class ClientManager:
             # Now send it
 
             # This step also takes care of filtering out the packet arguments that the client
-            # cannot parse, and also make sure they are in the correct order.
-            final_pargs, to_send = self.prepare_command('ms', pargs)
+            # cannot parse, and also make sure they are in the correct order. Unchanged arguments
+            # only need to be prepared once per client protocol.
+            if pargs is shared_pargs:
+                final_pargs, to_send = template.get_prepared(self)
+            else:
+                final_pargs, to_send = self.prepare_command('ms', pargs)
 
             # Keep track of packet details in case this was sent by someone else
             # This is used, for example, for first person mode
@@ -368,11 +879,17 @@ class ClientManager:
             else:
                 not_to = not_to.union({self})
 
-            for c in self.server.client_manager.clients:
-                c.send_ic(ic_params=None, params=None, sender=sender, bypass_replace=bypass_replace,
-                          pred=pred, not_to=not_to, gag_replaced=gag_replaced, is_staff=is_staff,
-                          in_area=in_area, to_blind=to_blind, to_deaf=to_deaf,
-                          msg=msg, pos=pos, cid=cid, ding=ding, color=color, showname=showname)
+            # Compile the recipient condition once rather than once per recipient
+            cond = Constants.build_cond(self, is_staff=is_staff, in_area=in_area, not_to=not_to,
+                                        to_blind=to_blind, to_deaf=to_deaf, pred=pred)
+            template = ClientManager.ICTemplate(msg=msg, pos=pos, cid=cid, ding=ding,
+                                                color=color, showname=showname)
+            with self.server.packet_cache:
+                for c in self.server.get_candidate_clients(cond):
+                    if not cond(c):
+                        continue
+                    c.send_ic(sender=sender, bypass_replace=bypass_replace,
+                              gag_replaced=gag_replaced, template=template)
 
         def send_ic_blankpost(self):
             if self.packet_handler == Clients.ClientDRO1d0d0:
@@ -411,6 +928,10 @@ class ClientManager:
             self.send_command('BN', *to_send)
 
         def disconnect(self):
+            # Hand over held back data as well, as the transport sends everything it holds before
+            # closing
+            self.is_output_paused = False
+            self.flush_output()
             self.transport.close()
 
         def send_motd(self):
@@ -452,8 +973,7 @@ class ClientManager:
 
             if self.char_id < 0 and char_id >= 0: # No longer spectator?
                 # Now bound by AFK rules
-                self.server.tasker.create_task(self, ['as_afk_kick', self.area.afk_delay,
-                                                      self.area.afk_sendto])
+                self.server.tasker.set_afk_kick(self, self.area.afk_delay, self.area.afk_sendto)
 
             old_char = self.get_char_name()
             self.char_id = char_id
@@ -504,22 +1024,20 @@ class ClientManager:
 
             # KFO deals with music lists differently than other clients
             # They want the area lists and music lists separate, so they will have it like that
+            # The packets are only built and encoded again if the areas reachable from the area or
+            # the music list changed
+            get_packet = self.server.get_music_list_packet
             if self.packet_handler not in [Clients.ClientAO2d8d4, Clients.ClientKFO2d8]:
-                reloaded_music_list = self.server.build_music_list_ao2(from_area=self.area, c=self,
-                                                                       music_list=raw_music_list)
-
-                # KEEP THE ASTERISK, unless you want a very weird single area comprised
-                # of all areas back to back forming a black hole area of doom and despair
-                # that crashes all clients that dare attempt join this area.
-                self.send_command('FM', *reloaded_music_list)
+                self.send_encoded_command('FM', *get_packet('FM', from_area=self.area, c=self,
+                                                            music_list=raw_music_list))
             else:
-                area_list = self.server.build_music_list_ao2(from_area=self.area, c=self,
-                                                             include_areas=True,
-                                                             include_music=False)
-                self.send_command('FA', *area_list)
-                music_list = self.server.prepare_music_list(c=self,
-                                                            specific_music_list=raw_music_list)
-                self.send_command('FM', *music_list)
+                self.send_encoded_command('FA', *get_packet('FA', from_area=self.area, c=self,
+                                                            include_areas=True,
+                                                            include_music=False))
+                self.send_encoded_command('FM', *get_packet('FM', c=self,
+                                                            music_list=raw_music_list,
+                                                            include_areas=False,
+                                                            include_music=True))
 
             # Update the new music list of the client once everything is done, if a new music list
             # was indeed loaded. Doing this only now prevents setting the music list to something
@@ -789,6 +1307,8 @@ class ClientManager:
             area = self.server.area_manager.get_area_by_id(area_id)
             info = '== Area {}: {} =='.format(area.id, area.name)
             sorted_clients = []
+            if only_my_multiclients:
+                my_multiclients = self.server.client_manager.get_multiclients(self)
 
             for c in area.clients:
                 # Conditions to print out a client in /getarea(s)
@@ -804,7 +1324,7 @@ class ClientManager:
                 if c.char_id is not None:
                     cond = (c == self or self.is_staff() or as_mod or c.is_visible
                             or (mods and c.is_mod))
-                    multiclient_cond = not only_my_multiclients or c in self.get_multiclients()
+                    multiclient_cond = not only_my_multiclients or c in my_multiclients
 
                     if cond and multiclient_cond:
                         sorted_clients.append(c)
@@ -815,7 +1335,7 @@ class ClientManager:
                 info += '\r\n[{}] {}'.format(c.id, c.get_char_name())
                 if include_shownames and c.showname != '':
                     info += ' ({})'.format(c.showname)
-                if len(c.get_multiclients()) > 1 and as_mod:
+                if as_mod and self.server.client_manager.is_multiclienting(c):
                     # If client is multiclienting add (MC) for officers
                     info += ' (MC)'
                 if not c.is_visible:
@@ -949,11 +1469,16 @@ class ClientManager:
             self.send_background(name=self.area.background)
             self.send_command('LE', *self.area.get_evidence_list(self))
             self.send_command('MM', 1)
-            self.send_command('OPPASS', fantacrypt.fanta_encrypt(self.server.config['guardpass']))
+            self.send_command('OPPASS', self.server.guardpass_encrypted)
             if self.char_id is None:
                 self.char_id = -1 # Set to a valid ID if still needed
             self.send_command('DONE')
 
+            if self.join_started is not None:
+                self.join_duration = time.perf_counter() - self.join_started
+                self.join_started = None
+                logger.log_debug('Joined in {:.2f} ms.'.format(self.join_duration*1000), self)
+
             if self.bad_version:
                 self.send_ooc(f'Unknown client detected {self.version}. '
                               f'Assuming standard DRO client protocol.')
@@ -968,9 +1493,6 @@ class ClientManager:
             return self.party
 
         def add_to_dicelog(self, msg):
-            if len(self.dicelog) >= 20:
-                self.dicelog = self.dicelog[1:]
-
             info = '{} | {} {}'.format(Constants.get_time(), self.displayname, msg)
             self.dicelog.append(info)
 
@@ -1087,8 +1609,7 @@ class ClientManager:
 
             # Update the music list to show reachable areas and activate the AFK timer
             self.reload_music_list()
-            self.server.tasker.create_task(self, ['as_afk_kick', self.area.afk_delay,
-                                                  self.area.afk_sendto])
+            self.server.tasker.set_afk_kick(self, self.area.afk_delay, self.area.afk_sendto)
 
             # If using a character restricted in the area, switch out
             if self.get_char_name() in self.area.restricted_chars:
@@ -1180,9 +1701,7 @@ class ClientManager:
             return (time.time() * 1000.0 - self.mod_call_time) > 0
 
         def get_multiclients(self):
-            ipid = self.server.client_manager.get_targets(self, TargetType.IPID, self.ipid, False)
-            hdid = self.server.client_manager.get_targets(self, TargetType.HDID, self.hdid, False)
-            return list(set(ipid + hdid))
+            return list(self.server.client_manager.get_multiclients(self))
 
         def get_info(self, as_mod=False, as_cm=False, identifier=None):
             if identifier is None:
@@ -1274,35 +1793,56 @@ class ClientManager:
 
         self.clients = set()
         self.server = server
-        self.cur_id = [False] * self.server.config['playerlimit']
+        # Client IDs are handed out lowest first. IDs from _next_id onwards were never handed out,
+        # and those below it that are free again are kept in the _free_ids heap.
+        self._free_ids = list()
+        self._next_id = 0
+        self._connection_limiter = _ConnectionLimiter()
         self.client_obj = client_obj
+        self._indexes = {attribute: set() for attribute in self.INDEXED_ATTRIBUTES}
+        # Clients logged in as moderators or community managers, and those plus game masters
+        self._officers = set()
+        self._staff = set()
+        self._target_indexes = {target_type: _TargetIndex()
+                                for target_type in self.EXACT_TARGET_TYPES}
+        self._target_indexes.update({target_type: _PrefixTargetIndex()
+                                     for target_type in self.PREFIX_TARGET_TYPES})
 
     def new_client(self, transport, client_obj=None, my_protocol=None, ip=None):
         if ip is None:
             ip = transport.get_extra_info('peername')[0]
+
+        # Refuse connections from IP addresses that connect too often before doing any work
+        floodguard = self.server.config['connection_floodguard']
+        if not self._connection_limiter.admit(ip, floodguard['times_per_interval'],
+                                              floodguard['interval_length']):
+            return None
         ipid = self.server.get_ipid(ip)
 
         if client_obj is None:
             client_obj = self.Client
 
-        cur_id = -1
-        for i in range(self.server.config['playerlimit']):
-            if not self.cur_id[i]:
-                cur_id = i
-                break
+        cur_id = self._take_id()
         c = client_obj(self.server, transport, cur_id, ipid, my_protocol=my_protocol)
         self.clients.add(c)
+        self.update_target_index(c, TargetType.IP, ip)
 
         # Check if server is full, and if so, send number of players and disconnect
         if cur_id == -1:
             c.send_command('PN', self.server.get_player_count(),
                            self.server.config['playerlimit'])
             c.disconnect()
-            return c
-        self.cur_id[cur_id] = True
-        self.server.tasker.client_tasks[cur_id] = dict()
         return c
 
+    def _take_id(self):
+        playerlimit = self.server.config['playerlimit']
+        if self._free_ids and self._free_ids[0] < playerlimit:
+            return heapq.heappop(self._free_ids)
+        if self._next_id < playerlimit:
+            self._next_id += 1
+            return self._next_id - 1
+        return -1 # Server is full
+
     def remove_client(self, client):
         # Clients who are following the now leaving client should no longer follow them
         if client.followedby:
@@ -1316,10 +1856,12 @@ class ClientManager:
             client.following.followedby.remove(client)
 
         if client.id >= 0: # Avoid having pre-clients do this (before they are granted a cID)
-            self.cur_id[client.id] = False
-            # Cancel client's pending tasks
-            for task_id in self.server.tasker.client_tasks[client.id].copy():
+            heapq.heappush(self._free_ids, client.id)
+            # Cancel client's pending tasks and deadlines
+            for task_id in self.server.tasker.client_tasks.get(client.id, dict()).copy():
                 self.server.tasker.remove_task(client, [task_id])
+            self.server.tasker.client_tasks.pop(client.id, None)
+            self.server.tasker.cancel_deadline(client, 'as_afk_kick')
 
         # If the client was part of a party, remove them from the party
         if client.party:
@@ -1346,60 +1888,190 @@ class ClientManager:
                                    .format(client.displayname, client.id, client.area.id),
                                    is_zstaff=True)
 
+        for index in self._indexes.values():
+            index.discard(client)
+        self._officers.discard(client)
+        self._staff.discard(client)
+        for index in self._target_indexes.values():
+            index.discard(client)
         self.clients.remove(client)
 
-    def get_targets(self, client, key, value, local=False):
-        #possible keys: ip, OOC, id, cname, ipid, hdid, showname
-        areas = None
-        if local:
-            areas = [client.area]
+    def update_index(self, client, attribute, value):
+        """
+        Update the index of `attribute` so it reflects `client` now having value `value` for it.
+
+        Parameters
+        ----------
+        client: ClientManager.Client
+            Client whose attribute changed.
+        attribute: str
+            Attribute name. Must be one of ClientManager.INDEXED_ATTRIBUTES.
+        value: Any
+            New value of the attribute.
+        """
+
+        if value:
+            self._indexes[attribute].add(client)
         else:
-            areas = client.server.area_manager.areas
-        targets = []
+            self._indexes[attribute].discard(client)
+
+        if attribute in ('is_mod', 'is_cm', 'is_gm'):
+            is_officer = client in self._indexes['is_mod'] or client in self._indexes['is_cm']
+            is_staff = is_officer or client in self._indexes['is_gm']
+            for (staff, is_member) in ((self._officers, is_officer), (self._staff, is_staff)):
+                if is_member:
+                    staff.add(client)
+                else:
+                    staff.discard(client)
+
+    def get_clients_with(self, attribute):
+        """
+        Return all clients with a truthy value for `attribute`.
+
+        Parameters
+        ----------
+        attribute: str
+            Attribute name. Must be one of ClientManager.INDEXED_ATTRIBUTES.
+
+        Returns
+        -------
+        set of ClientManager.Client
+            Matching clients. This is the index itself, so it must not be modified.
+        """
+
+        return self._indexes[attribute]
+
+    def get_staff(self, officers_only=False):
+        """
+        Return all clients logged in as a staff member.
+
+        Parameters
+        ----------
+        officers_only: bool, optional
+            If True, only include moderators and community managers. Defaults to False.
+
+        Returns
+        -------
+        set of ClientManager.Client
+            Matching clients. This is kept up to date as clients log in and out, so it must not be
+            modified.
+        """
+
+        return self._officers if officers_only else self._staff
+
+    def update_target_index(self, client, target_type, key):
+        """
+        Update the index of `target_type` so that `client` is now found by key `key`.
+
+        Parameters
+        ----------
+        client: ClientManager.Client
+            Client whose key changed.
+        target_type: TargetType
+            Target type. Must be one of ClientManager.EXACT_TARGET_TYPES or
+            ClientManager.PREFIX_TARGET_TYPES.
+        key: Any
+            New key of the client.
+        """
+
+        self._target_indexes[target_type].set(client, key)
+
+    def refresh_char_names(self):
+        """
+        Reindex the character names of all clients. This must be called whenever the server
+        character list changes, as a client's character name is derived from it.
+        """
+
+        index = self._target_indexes[TargetType.CHAR_NAME]
+        for client in self.clients:
+            index.set(client, client.get_char_name())
+
+    def get_multiclients(self, client):
+        """
+        Return all clients that share an IPID or HDID with `client`, including `client` itself.
+        Same as the other target lookups, this includes clients that have connected but not yet
+        finished joining the server, as they are already in the default area.
+
+        Parameters
+        ----------
+        client: ClientManager.Client
+            Client to check.
+
+        Returns
+        -------
+        set of ClientManager.Client
+            Clients opened by the same person as `client`.
+        """
+
+        ipid_holders = self._target_indexes[TargetType.IPID].get_holders(client.ipid)
+        hdid_holders = self._target_indexes[TargetType.HDID].get_holders(client.hdid)
+        return ipid_holders | hdid_holders
+
+    def is_multiclienting(self, client):
+        """
+        Return whether some client other than `client` shares an IPID or HDID with `client`.
+
+        Parameters
+        ----------
+        client: ClientManager.Client
+            Client to check.
+
+        Returns
+        -------
+        bool
+            True if `client` is multiclienting, False otherwise.
+        """
+
+        # The client is itself part of the groups of their own IPID and HDID
+        return (len(self._target_indexes[TargetType.IPID].get_holders(client.ipid)) > 1
+                or len(self._target_indexes[TargetType.HDID].get_holders(client.hdid)) > 1)
+
+    def get_targets(self, client, key, value, local=False):
+        """
+        Return all clients that match `value` for target type `key`. Client IDs, IPIDs and HDIDs
+        must match exactly, while IPs and names (OOC name, character name, character folder and
+        showname) need only start with `value`, ignoring case. Clients that have connected but not
+        yet finished joining the server are in the default area already, so they are returned as
+        well.
+
+        Parameters
+        ----------
+        client: ClientManager.Client
+            Client performing the search.
+        key: TargetType
+            Target type to match. If TargetType.ALL, all target types except character folder are
+            searched, and the results of each are concatenated.
+        value: Any
+            Value to match.
+        local: bool, optional
+            If True, only clients in the same area as `client` are returned. Defaults to False.
+
+        Returns
+        -------
+        list of ClientManager.Client
+            Matching clients.
+        """
+
         if key == TargetType.ALL:
-            for nkey in range(7):
+            targets = list()
+            for nkey in (TargetType.IP, TargetType.OOC_NAME, TargetType.ID, TargetType.CHAR_NAME,
+                         TargetType.IPID, TargetType.HDID, TargetType.SHOWNAME):
                 targets += self.get_targets(client, nkey, value, local)
-        for area in areas:
-            for target in area.clients:
-                if key == TargetType.IP:
-                    if target.get_ipreal().lower().startswith(value.lower()):
-                        targets.append(target)
-                elif key == TargetType.OOC_NAME:
-                    if target.name.lower().startswith(value.lower()):
-                        targets.append(target)
-                elif key == TargetType.CHAR_NAME:
-                    if target.get_char_name().lower().startswith(value.lower()):
-                        targets.append(target)
-                elif key == TargetType.CHAR_FOLDER:
-                    if target.char_folder.lower().startswith(value.lower()):
-                        targets.append(target)
-                elif key == TargetType.ID:
-                    if target.id == value:
-                        targets.append(target)
-                elif key == TargetType.IPID:
-                    if target.ipid == value:
-                        targets.append(target)
-                elif key == TargetType.HDID:
-                    if target.hdid == value:
-                        targets.append(target)
-                elif key == TargetType.SHOWNAME:
-                    if target.showname.lower().startswith(value.lower()):
-                        targets.append(target)
+            return targets
+
+        if key in self.PREFIX_TARGET_TYPES:
+            targets = self._target_indexes[key].find_prefix(value)
+        else:
+            targets = self._target_indexes[key].find(value)
+        if local:
+            targets = [target for target in targets if target.area == client.area]
         return targets
 
     def get_muted_clients(self):
-        clients = []
-        for client in self.clients:
-            if client.is_muted:
-                clients.append(client)
-        return clients
+        return list(self._indexes['is_muted'])
 
     def get_ooc_muted_clients(self):
-        clients = []
-        for client in self.clients:
-            if client.is_ooc_muted:
-                clients.append(client)
-        return clients
+        return list(self._indexes['is_ooc_muted'])
 
     def get_target_public(self, client, identifier, only_in_area=False):
         """
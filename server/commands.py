@@ -18,6 +18,7 @@
 
 # possible keys: ip, OOC, id, cname, ipid, hdid
 
+import asyncio
 import datetime
 import random
 import hashlib
@@ -176,6 +177,8 @@ def ooc_cmd_area_list(client: ClientManager.Client, arg: str):
     be accessed with /area_lists. Clients that do not process 'SM' packets can be in servers that
     use this command without crashing, but they will continue to only see the areas they could see
     when joining.
+    Areas whose name and properties are the same in both area lists are kept as they are, along
+    with their players, locks, zones and day cycles.
     Returns an error if the given area list was not found.
 
     SYNTAX
@@ -195,7 +198,7 @@ def ooc_cmd_area_list(client: ClientManager.Client, arg: str):
     old_locked_areas = [area.name for area in client.server.area_manager.areas if area.is_locked]
 
     if not arg:
-        client.server.area_manager.load_areas()
+        client.server.area_manager.load_areas(incremental=True)
         client.send_ooc('You have restored the original area list of the server.')
         client.send_ooc_others('The original area list of the server has been restored.',
                                is_officer=False)
@@ -204,7 +207,7 @@ def ooc_cmd_area_list(client: ClientManager.Client, arg: str):
     else:
         try:
             new_area_file = 'config/area_lists/{}.yaml'.format(arg)
-            client.server.area_manager.load_areas(area_list_file=new_area_file)
+            client.server.area_manager.load_areas(area_list_file=new_area_file, incremental=True)
         except ServerError as exc:
             try:
                 code = exc.code
@@ -227,10 +230,13 @@ def ooc_cmd_area_list(client: ClientManager.Client, arg: str):
                                .format(client.name, client.id, arg),
                                is_officer=True)
 
-    # Every area that was locked before the reload gets warned that their areas were unlocked.
+    # Every area that was locked before the reload and was not kept gets warned that their areas
+    # were unlocked.
     for area_name in old_locked_areas:
         try:
             area = client.server.area_manager.get_area_by_name(area_name)
+            if area.is_locked:
+                continue
             area.broadcast_ooc('This area became unlocked after the area reload. Relock it using '
 			                   '/lock.')
         # if no area is found with that name, then an old locked area does not exist anymore, so
@@ -292,24 +298,35 @@ def ooc_cmd_autopass(client: ClientManager.Client, arg: str):
 def ooc_cmd_ban(client: ClientManager.Client, arg: str):
     """ (MOD ONLY)
     Kicks given user from the server and prevents them from rejoining. The user can be identified
-    by either their IPID or IP address. Requires /unban to undo.
+    by either their IPID or IP address. If a length is given, the ban is lifted once that much
+    time has passed. Otherwise, it requires /unban to undo.
     Returns an error if given identifier does not correspond to a user.
 
     SYNTAX
-    /ban <client_ipid>
-    /ban <client_ip>
+    /ban <client_ipid> {length}
+    /ban <client_ip> {length}
 
     PARAMETERS
     <client_ipid>: IPID for the client (number in parentheses in /getarea)
     <client_ip>: user IP
 
+    OPTIONAL PARAMETERS
+    {length}: Length of the ban, as a number followed by m (minutes), h (hours) or d (days)
+
     EXAMPLES
     /ban 1234567890             :: Bans the user whose IPID is 1234567890
     /ban 127.0.0.1              :: Bans the user whose IP is 127.0.0.1
+    /ban 1234567890 7d          :: Bans the user whose IPID is 1234567890 for 7 days
     """
 
     arg = arg.strip()
-    Constants.assert_command(client, arg, parameters='>0', is_mod=True)
+    Constants.assert_command(client, arg, parameters='&1-2', is_mod=True)
+    args = arg.split(' ')
+    arg = args[0]
+    expires, length_text = None, ''
+    if len(args) == 2:
+        expires = time.time() + Constants.parse_ban_length(args[1])
+        length_text = ' for {}'.format(args[1])
 
     # Guesses that any number is an IPID
     # and that any non-numerical entry is an IP address.
@@ -323,7 +340,7 @@ def ooc_cmd_ban(client: ClientManager.Client, arg: str):
         targets = client.server.client_manager.get_targets(client, TargetType.IP, idnt, False)
 
     # Try and add the user to the ban list based on the given identifier
-    client.server.ban_manager.add_ban(idnt)
+    client.server.ban_manager.add_ban(idnt, expires=expires)
 
     # Kick+ban all clients opened by the targeted user.
     if targets:
@@ -337,48 +354,62 @@ def ooc_cmd_ban(client: ClientManager.Client, arg: str):
             c.disconnect()
 
     plural = 's were' if len(targets) != 1 else ' was'
-    client.send_ooc('You banned `{}`. As a result, {} client{} kicked as well.'
-                    .format(idnt, len(targets), plural))
-    client.send_ooc_others('{} banned `{}`. As a result, {} client{} kicked as well.'
-                           .format(client.name, idnt, len(targets), plural), is_officer=True)
-    logger.log_server('Banned {}.'.format(idnt), client)
+    client.send_ooc('You banned `{}`{}. As a result, {} client{} kicked as well.'
+                    .format(idnt, length_text, len(targets), plural))
+    client.send_ooc_others('{} banned `{}`{}. As a result, {} client{} kicked as well.'
+                           .format(client.name, idnt, length_text, len(targets), plural),
+                           is_officer=True)
+    logger.log_server('Banned {}{}.'.format(idnt, length_text), client)
 
 def ooc_cmd_banhdid(client: ClientManager.Client, arg: str):
     """ (MOD ONLY)
     Similar to /ban (kicks given user from the server if they are there and prevents them from
     rejoining), but the identifier must be an HDID. It does not require the player to be online.
-    Requires /unbanhdid to undo.
+    If a length is given, the ban is lifted once that much time has passed. Otherwise, it requires
+    /unbanhdid to undo.
     Returns an error if given identifier does not correspond to a user, or if the user is already
     banned.
 
     SYNTAX
-    /banhdid <client_hdid>
+    /banhdid <client_hdid> {length}
 
     PARAMETERS
     <client_hdid>: User HDID (available in server logs and through a mod /whois)
 
+    OPTIONAL PARAMETERS
+    {length}: Length of the ban, as a number followed by m (minutes), h (hours) or d (days)
+
     EXAMPLES
     /banhdid abcd1234             :: Bans the user whose HDID is abcd1234
+    /banhdid abcd1234 12h         :: Bans the user whose HDID is abcd1234 for 12 hours
     """
 
-    Constants.assert_command(client, arg, parameters='=1', is_mod=True)
+    Constants.assert_command(client, arg, parameters='&1-2', is_mod=True)
+    args = arg.split(' ')
+    arg = args[0]
+    expires, length_text = None, ''
+    if len(args) == 2:
+        expires = time.time() + Constants.parse_ban_length(args[1])
+        length_text = ' for {}'.format(args[1])
 
     if not arg in client.server.hdid_list:
         raise ClientError('Unrecognized HDID {}.'.format(arg))
 
-    # This works by banning one of the IPIDs the player is associated with. The way ban handling
-    # works is that the server keeps track of all the IPIDs a player has logged in with their HDID
-    # and checks on joining if any of those IPIDs was banned in the past. If that is the case,
-    # then the server assumes that player is banned, even if they have changed IPIDs in the meantime
-
-    # Thus, banning one IPID is sufficient, so check if any associated IPID is already banned.
+    # The server checks on joining both if the HDID was banned and if any of the IPIDs the player
+    # has logged in with their HDID was banned in the past. If either is the case, then the server
+    # assumes the player is banned, even if they have changed IPIDs in the meantime.
+    # Thus, check if the HDID or any associated IPID is already banned.
+    if client.server.ban_manager.is_hdid_banned(arg):
+        raise ClientError('Player is already banned.')
     for ipid in client.server.hdid_list[arg]:
         if client.server.ban_manager.is_banned(ipid):
             raise ClientError('Player is already banned.')
 
-    identifier = random.choice(client.server.hdid_list[arg])
-    # Try and add the user to the ban list based on the given identifier
-    client.server.ban_manager.add_ban(identifier)
+    # Ban every IPID the player is associated with, so that the player stays banned if they change
+    # HDIDs, and the HDID itself, so that the player stays banned if they change IPIDs.
+    for ipid in set(client.server.hdid_list[arg]):
+        client.server.ban_manager.add_ban(ipid, expires=expires)
+    client.server.ban_manager.add_hdid_ban(arg, expires=expires)
 
     # Try and kick the user from the server, as well as announce their ban.
     targets = client.server.client_manager.get_targets(client, TargetType.HDID, arg, False)
@@ -395,12 +426,13 @@ def ooc_cmd_banhdid(client: ClientManager.Client, arg: str):
             c.disconnect()
 
     plural = 's were' if len(targets) != 1 else ' was'
-    client.send_ooc('You banned HDID `{}`. As a result, {} client{} kicked as well.'
-                    .format(arg, len(targets), plural))
-    client.send_ooc_others('{} [{}] banned HDID `{}`. As a result, {} client{} kicked as well.'
-                           .format(client.name, client.id, arg, len(targets), plural),
+    client.send_ooc('You banned HDID `{}`{}. As a result, {} client{} kicked as well.'
+                    .format(arg, length_text, len(targets), plural))
+    client.send_ooc_others('{} [{}] banned HDID `{}`{}. As a result, {} client{} kicked as well.'
+                           .format(client.name, client.id, arg, length_text, len(targets),
+                                   plural),
                            is_officer=True)
-    logger.log_server('HDID-banned {}.'.format(identifier), client)
+    logger.log_server('HDID-banned {}{}.'.format(arg, length_text), client)
 
 def ooc_cmd_bg(client: ClientManager.Client, arg: str):
     """
@@ -1174,6 +1206,53 @@ def ooc_cmd_chars_restricted(client: ClientManager.Client, arg: str):
 
     client.send_ooc(info)
 
+def ooc_cmd_chat_history(client: ClientManager.Client, arg: str):
+    """ (MOD ONLY)
+    Returns the last 20 archived IC messages, OOC messages, shouts, dice rolls and judge actions
+    of the user with the given IPID, across all months kept in the chat archive. If also given
+    some text, only entries containing that text (ignoring case) are returned.
+    Returns an error if the given IPID is not a number.
+
+    SYNTAX
+    /chat_history <client_ipid> {text}
+
+    PARAMETERS
+    <client_ipid>: IPID for the client (number in parentheses in /getarea)
+
+    OPTIONAL PARAMETERS
+    {text}: Text the returned entries must contain
+
+    EXAMPLES
+    /chat_history 1234567890        :: Returns the last 20 entries of the user with IPID 1234567890
+    /chat_history 1234567890 hello  :: Returns the last 20 entries of that user containing "hello"
+    """
+
+    Constants.assert_command(client, arg, is_mod=True, parameters='>0')
+
+    ipid, _, text = arg.partition(' ')
+    if not ipid.isdigit():
+        raise ArgumentError('Expected IPID.')
+
+    def send_history(search):
+        try:
+            entries = search.result()
+        except Exception as ex:
+            logger.log_pdebug('Unable to search the chat archive: {}: {}'
+                              .format(type(ex).__name__, ex))
+            client.send_ooc('Unable to look up the chat history of IPID {}.'.format(ipid))
+            return
+
+        info = '== Chat history of IPID {} =='.format(ipid)
+        if not entries:
+            info += '\r\nNo matching entries were archived.'
+        for entry in entries:
+            info += '\r\n*{}'.format(client.server.chat_archive.format_entry(entry))
+        client.send_ooc(info)
+
+    # Searching reads the archive files, so do it in the background and reply once done
+    search = client.server.chat_archive.search(int(ipid), text=text if text else None)
+    asyncio.wrap_future(search, loop=client.server.loop).add_done_callback(send_history)
+
 def ooc_cmd_cleardoc(client: ClientManager.Client, arg: str):
     """
     Clears the current area's doc.
@@ -2983,22 +3062,19 @@ def ooc_cmd_minimap(client: ClientManager.Client, arg: str):
     Constants.assert_command(client, arg, parameters='=0')
 
     info = '== Areas reachable from {} =='.format(client.area.name)
-    try:
-        # Get all reachable areas and sort them by area ID
-        sorted_areas = sorted(client.area.reachable_areas,
-                              key=lambda area_name: client.server.area_manager.get_area_by_name(area_name).id)
-
-        # No areas found or just the current area found means there are no reachable areas.
-        if len(sorted_areas) == 0 or sorted_areas == [client.area.name]:
-            info += '\r\n*No areas available.'
-        # Otherwise, build the list of all reachable areas
-        else:
-            for area in sorted_areas:
-                if area != client.area.name:
-                    info += '\r\n*{}-{}'.format(client.server.area_manager.get_area_by_name(area).id, area)
-    except AreaError:
-        # In case no passages are set, send '<ALL>' as default answer.
+    # Get all reachable areas, sorted by area ID
+    neighbors = client.server.area_manager.get_neighbors(client.area)
+
+    # In case no passages are set, send '<ALL>' as default answer.
+    if neighbors is None:
         info += '\r\n<ALL>'
+    # No areas found means there are no reachable areas.
+    elif not neighbors:
+        info += '\r\n*No areas available.'
+    # Otherwise, build the list of all reachable areas
+    else:
+        for area in neighbors:
+            info += '\r\n*{}-{}'.format(area.id, area.name)
 
     client.send_ooc(info)
 
@@ -5340,10 +5416,13 @@ def ooc_cmd_unbanhdid(client: ClientManager.Client, arg: str):
     if not arg in client.server.hdid_list:
         raise ClientError('Unrecognized HDID {}.'.format(arg))
 
-    # The server checks for any associated banned IPID for a player, so in order to unban by HDID
-    # all the associated IPIDs must be unbanned.
+    # The server checks for the HDID and any associated banned IPID for a player, so in order to
+    # unban by HDID, the HDID and all the associated IPIDs must be unbanned.
 
     found_banned = False
+    if client.server.ban_manager.is_hdid_banned(arg):
+        client.server.ban_manager.remove_hdid_ban(arg)
+        found_banned = True
     for ipid in client.server.hdid_list[arg]:
         if client.server.ban_manager.is_banned(ipid):
             client.server.ban_manager.remove_ban(ipid)
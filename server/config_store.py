@@ -0,0 +1,83 @@
+# TsuserverDR, a Danganronpa Online server based on tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com> (original tsuserver3)
+# Current project leader: 2018-19 Chrezm/Iuvee <thechrezm@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from server.constants import Constants
+from server.exceptions import ServerError
+
+class ConfigStore:
+    """
+    Cache of parsed YAML configuration files.
+
+    A file is only parsed again if its modification time or size changed since it was last
+    loaded. Otherwise, the very same parsed document is returned, so callers can tell a file
+    did not change by checking whether they got the same object they already had, and many users
+    of the same file (such as clients that picked the same music list) share one document.
+
+    As documents are shared, they must be treated as read-only. Callers that need to modify a
+    document must work on a copy of it.
+    """
+
+    def __init__(self):
+        self._documents = dict() # Path -> ((modification time, size), document)
+
+    def load(self, path):
+        """
+        Return the parsed contents of a YAML file, parsing it only if it changed since the last
+        time it was loaded.
+
+        Parameters
+        ----------
+        path: str
+            Path to the file.
+
+        Returns
+        -------
+        Any
+            Parsed document.
+
+        Raises
+        ------
+        ServerError.FileNotFound
+            If the file could not be found.
+        ServerError.YAMLInvalidError
+            If the file is not valid YAML.
+        """
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            info = 'File not found: {}'.format(path)
+            raise ServerError(info, code="FileNotFound")
+        except OSError as ex:
+            raise ServerError(str(ex), code="OSError")
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        try:
+            cached_version, document = self._documents[path]
+        except KeyError:
+            pass
+        else:
+            if cached_version == version:
+                return document
+
+        with Constants.fopen(path, 'r', encoding='utf-8') as file:
+            document = Constants.yaml_load(file)
+        self._documents[path] = (version, document)
+        return document
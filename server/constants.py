@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import functools
 import random
 import re
 import time
@@ -25,6 +26,9 @@ import yaml
 from enum import Enum
 from server.exceptions import ClientError, ServerError, ArgumentError, AreaError
 
+# Use the libyaml based loader if PyYAML was built with it, as it is much faster
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 class ArgType(Enum):
     STR = 1
     STR_OR_EMPTY = 2
@@ -63,6 +67,70 @@ class Effects(Enum):
     def async_name(self):
         return 'as_effect_{}'.format(self.name.lower())
 
+class PacketSchema:
+    """
+    Compiled form of the arguments of a packet in a client protocol, as listed by one of the
+    *_INBOUND or *_OUTBOUND members of the protocols in Clients.
+
+    The schemas of every protocol are compiled once, when this module is imported, and can be
+    found in Clients.INBOUND_SCHEMAS and Clients.OUTBOUND_SCHEMAS.
+    """
+
+    __slots__ = ('names', 'arity', 'converters', 'allows_empty', 'defaults')
+
+    def __init__(self, fields, inbound):
+        """
+        Parameters
+        ----------
+        fields: list of tuple of (str, Any)
+            Name of each argument, in order, paired with its ArgType if `inbound` is True, or its
+            default value otherwise.
+        inbound: bool
+            Whether the packet is sent by clients (True) or to clients (False).
+        """
+
+        self.names = tuple(name for (name, _) in fields)
+        self.arity = len(fields)
+        if inbound:
+            self.converters = tuple(int if arg_type == ArgType.INT else None
+                                    for (_, arg_type) in fields)
+            self.allows_empty = tuple(arg_type == ArgType.STR_OR_EMPTY for (_, arg_type) in fields)
+            self.defaults = None
+        else:
+            self.converters = None
+            self.allows_empty = None
+            self.defaults = tuple(default for (_, default) in fields)
+
+    def parse(self, args):
+        """
+        Return the arguments of an inbound packet by name, converted to their expected types.
+
+        Parameters
+        ----------
+        args: list of str
+            Packet arguments, in order. It is not modified.
+
+        Returns
+        -------
+        dict of str to Any or None
+            Packet arguments by name if they match the schema, None otherwise.
+        """
+
+        if len(args) != self.arity:
+            return None
+
+        values = list()
+        for (arg, converter, allows_empty) in zip(args, self.converters, self.allows_empty):
+            if not arg and not allows_empty:
+                return None
+            if converter is not None:
+                try:
+                    arg = converter(arg)
+                except ValueError:
+                    return None
+            values.append(arg)
+        return dict(zip(self.names, values))
+
 class Clients():
     class ClientDRO1d0d0(Enum):
         MS_INBOUND = [
@@ -397,6 +465,237 @@ class Clients():
     ClientCC22 = Enum('ClientCC22', [(m.name, m.value) for m in ClientAO2d6])
     ClientCC24 = Enum('ClientCC24', [(m.name, m.value) for m in ClientAO2d8d4])
 
+    # Map of protocol to a map of packet ID to the schema of the packet in that protocol, for
+    # packets received from (INBOUND) and sent to (OUTBOUND) clients of that protocol
+    INBOUND_SCHEMAS = dict()
+    OUTBOUND_SCHEMAS = dict()
+
+for _protocol in vars(Clients).values():
+    if not isinstance(_protocol, type) or not issubclass(_protocol, Enum):
+        continue
+    Clients.INBOUND_SCHEMAS[_protocol] = dict()
+    Clients.OUTBOUND_SCHEMAS[_protocol] = dict()
+    for _member in _protocol:
+        _identifier, _, _direction = _member.name.rpartition('_')
+        if _direction == 'INBOUND':
+            Clients.INBOUND_SCHEMAS[_protocol][_identifier] = PacketSchema(_member.value, True)
+        elif _direction == 'OUTBOUND':
+            Clients.OUTBOUND_SCHEMAS[_protocol][_identifier] = PacketSchema(_member.value, False)
+
+class RecipientCondition:
+    """
+    A compiled recipient predicate, as returned by Constants.build_cond.
+
+    Calling it on a client evaluates every condition in order, stopping at the first one that
+    fails, without allocating any intermediate structures. Broadcast helpers may additionally use
+    get_candidates to avoid looking at clients that could never satisfy the condition.
+    """
+
+    __slots__ = ('checks', 'sources', 'never')
+
+    def __init__(self, checks, sources=tuple(), never=False):
+        """
+        Parameters
+        ----------
+        checks: tuple of Callable[[ClientManager.Client], bool]
+            Checks a client must all pass.
+        sources: tuple of Collection[ClientManager.Client], optional
+            Collections of clients such that every client that satisfies the condition is in each
+            one of them (e.g. the clients of the target area, or the staff members). Defaults to
+            the empty tuple (no restrictions known).
+        never: bool, optional
+            If True, no client may satisfy the condition. Defaults to False.
+        """
+
+        self.checks = checks
+        self.sources = sources
+        self.never = never
+
+    def __call__(self, client):
+        if self.never:
+            return False
+        for check in self.checks:
+            if not check(client):
+                return False
+        return True
+
+    def get_candidates(self, clients):
+        """
+        Return a collection of clients that contains every client in `clients` that may satisfy
+        the condition. This is the smallest known collection among `clients` and the condition
+        sources. Clients in the returned collection still need to be checked individually.
+
+        The sources are live sets (such as the clients of an area or the watchers of a zone), so a
+        copy is returned, and callers may freely change memberships while going through it.
+
+        Parameters
+        ----------
+        clients: set of ClientManager.Client
+            Clients to filter.
+
+        Returns
+        -------
+        tuple of ClientManager.Client
+            Candidate recipients.
+        """
+
+        if self.never:
+            return ()
+
+        candidates = clients
+        for source in self.sources:
+            if len(source) < len(candidates):
+                candidates = source
+        return tuple(candidates)
+
+RecipientCondition.ALWAYS = RecipientCondition(tuple())
+
+class PacketCache:
+    """
+    Serializer for outbound packets that, while a broadcast is in progress, builds and encodes
+    every distinct packet only once and hands out the same bytes object to all recipients.
+
+    A broadcast is delimited with a `with` statement on the cache; broadcasts may be nested, and
+    the last BROADCAST_PACKETS distinct packets are kept until the outermost one finishes.
+    Outside a broadcast, packets are encoded normally and nothing is cached. Packets are told
+    apart by the text of their arguments, which is what gets sent, so arguments that compare
+    equal but are written differently (such as 1 and True) are never confused.
+
+    Additionally, the encodings of the last few distinct packets of each of PERSISTENT_COMMANDS
+    are kept regardless of broadcasts, up to the number of packets given for each of them. These
+    are large packets that are sent with the same arguments over and over again, such as the area
+    and music lists clients get as they move between areas, and the character list, character
+    and music list pages and guard password every client gets while joining. As their arguments
+    only change when the server configuration is reloaded, their encoding is effectively only
+    redone then.
+    """
+
+    __slots__ = ('_depth', '_packets', '_split_packets', '_persistent')
+
+    # Number of distinct packets kept while a broadcast is in progress, so that broadcasts that
+    # alternate between a few packets (such as the HP packets of both sides) keep all of them
+    BROADCAST_PACKETS = 32
+
+    PERSISTENT_COMMANDS = {
+        'FA': 16,
+        'FM': 16,
+        'SM': 16,
+        'SC': 4,
+        'CI': 1024, # One per page of 10 characters
+        'EM': 1024, # One per page of 10 areas or music list entries
+        'OPPASS': 4,
+        }
+
+    def __init__(self):
+        self._depth = 0
+        # Maps of packet ID and argument texts (and split position) to the encoding of the packet
+        # with them, oldest first
+        self._packets = dict()
+        self._split_packets = dict()
+        # Map of packet ID to a map of recent argument texts to their encoding, oldest first, and
+        # the maximum number of encodings kept
+        self._persistent = {command: (dict(), size)
+                            for (command, size) in self.PERSISTENT_COMMANDS.items()}
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if not self._depth:
+            self._packets.clear()
+            self._split_packets.clear()
+
+    @staticmethod
+    def _join(command, texts):
+        if not texts:
+            return '{}#%'.format(command)
+        return '{}#{}#%'.format(command, '#'.join(texts))
+
+    @staticmethod
+    def _remember(cache, size, key, value):
+        if len(cache) >= size:
+            del cache[next(iter(cache))]
+        cache[key] = value
+
+    def encode(self, command, args):
+        """
+        Return the UTF-8 encoding of the packet with ID `command` and arguments `args`.
+
+        Parameters
+        ----------
+        command: str
+            ID of the packet.
+        args: tuple
+            Packet arguments.
+
+        Returns
+        -------
+        bytes
+            Encoded packet.
+        """
+
+        texts = tuple([str(x) for x in args])
+        persistent, size = self._persistent.get(command, (None, 0))
+        if persistent is not None:
+            try:
+                return persistent[texts]
+            except KeyError:
+                data = self._join(command, texts).encode('utf-8')
+                self._remember(persistent, size, texts, data)
+                return data
+
+        if not self._depth:
+            return self._join(command, texts).encode('utf-8')
+
+        key = (command, texts)
+        try:
+            return self._packets[key]
+        except KeyError:
+            data = self._join(command, texts).encode('utf-8')
+            self._remember(self._packets, self.BROADCAST_PACKETS, key, data)
+            return data
+
+    def encode_split(self, command, args, index):
+        """
+        Return the UTF-8 encoding of the packet with ID `command` and arguments `args`, split
+        around the argument at position `index`, so that callers may substitute their own value
+        for that argument without re-encoding the rest of the packet.
+
+        Parameters
+        ----------
+        command: str
+            ID of the packet.
+        args: tuple
+            Packet arguments. Must have more than `index` elements.
+        index: int
+            Position of the argument to leave out.
+
+        Returns
+        -------
+        tuple of (bytes, bytes)
+            Encoded packet up to and including the separator before the argument, and encoded
+            packet from the separator after the argument onwards.
+        """
+
+        texts = tuple([str(x) for x in args])
+        if self._depth:
+            key = (command, index, texts)
+            try:
+                return self._split_packets[key]
+            except KeyError:
+                pass
+
+        head = '{}#{}'.format(command, ''.join(['{}#'.format(x) for x in texts[:index]]))
+        tail = ''.join(['#{}'.format(x) for x in texts[index+1:]]) + '#%'
+        parts = (head.encode('utf-8'), tail.encode('utf-8'))
+
+        if self._depth:
+            self._remember(self._split_packets, self.BROADCAST_PACKETS, key, parts)
+        return parts
+
+
 class Constants():
     @staticmethod
     def fopen(file, *args, **kwargs):
@@ -412,7 +711,7 @@ class Constants():
     @staticmethod
     def yaml_load(file):
         try:
-            return yaml.safe_load(file)
+            return yaml.load(file, Loader=YAML_LOADER)
         except yaml.YAMLError as exc:
             # Extract the name of the yaml
             separator = max(file.name.rfind('\\'), file.name.rfind('/'))
@@ -579,6 +878,46 @@ class Constants():
             if error:
                 raise ArgumentError(error[0].format(error[1], 's' if error[1] != 1 else ''))
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _compile_flag_check(is_staff, is_officer, is_mod, to_blind, to_deaf):
+        """
+        Compile the rank and sense conditions of build_cond into a single check. As there are only
+        a handful of valid combinations, results are cached.
+
+        Returns
+        -------
+        Callable[[ClientManager.Client], bool] or None
+            The combined check, or None if no check is needed.
+        """
+
+        checks = list()
+        for (name, value, check) in [
+                ('is_staff', is_staff, lambda c: c.is_staff()),
+                ('is_officer', is_officer, lambda c: c.is_cm or c.is_mod),
+                ('is_mod', is_mod, lambda c: c.is_mod),
+                ('to_blind', to_blind, lambda c: c.is_blind),
+                ('to_deaf', to_deaf, lambda c: c.is_deaf)]:
+            if value is True:
+                checks.append(check)
+            elif value is False:
+                checks.append(lambda c, check=check: not check(c))
+            elif value is not None:
+                raise KeyError('Invalid argument for build_cond {}: {}'.format(name, value))
+
+        if not checks:
+            return None
+        if len(checks) == 1:
+            return checks[0]
+
+        checks = tuple(checks)
+        def flag_check(c):
+            for check in checks:
+                if not check(c):
+                    return False
+            return True
+        return flag_check
+
     @staticmethod
     def build_cond(sender, is_staff=None, is_officer=None, is_mod=None, in_area=None, pred=None,
                    part_of=None, not_to=None, to_blind=None, to_deaf=None, is_zstaff=None,
@@ -600,72 +939,52 @@ class Constants():
              sender's area is in, or the area that is given, or both the target's watched zone
              and the zone the sender's/given area is in are both None for its True and area cases.
             pred: If target satisfies some custom condition
+
+        Returns a RecipientCondition, which can be called on a client like any other predicate.
         """
-        conditions = list()
 
-        if is_staff is True:
-            conditions.append(lambda c: c.is_staff())
-        elif is_staff is False:
-            conditions.append(lambda c: not c.is_staff())
-        elif is_staff is None:
-            pass
-        else:
-            raise KeyError('Invalid argument for build_cond is_staff: {}'.format(is_staff))
+        # Checks are ordered roughly from cheapest/most selective to most expensive, so that
+        # evaluation can stop as soon as possible.
+        conditions = list()
+        sources = list()
+        client_manager = sender.server.client_manager
 
-        if is_officer is True:
-            conditions.append(lambda c: c.is_cm or c.is_mod)
-        elif is_officer is False:
-            conditions.append(lambda c: not (c.is_cm or c.is_mod))
-        elif is_officer is None:
-            pass
-        else:
-            raise KeyError('Invalid argument for build_cond is_officer: {}'.format(is_officer))
-
-        if is_mod is True:
-            conditions.append(lambda c: c.is_mod)
-        elif is_mod is False:
-            conditions.append(lambda c: not c.is_mod)
-        elif is_mod is None:
-            pass
-        else:
-            raise KeyError('Invalid argument for build_cond is_mod: {}'.format(is_mod))
+        flag_check = Constants._compile_flag_check(is_staff, is_officer, is_mod, to_blind,
+                                                   to_deaf)
 
         if in_area is True:
-            conditions.append(lambda c: c.area == sender.area)
+            target_area = sender.area
+            sources.append(target_area.clients)
+            conditions.append(lambda c: c.area == target_area)
         elif in_area is False:
-            conditions.append(lambda c: c.area != sender.area)
+            target_area = sender.area
+            conditions.append(lambda c: c.area != target_area)
         elif isinstance(in_area, type(sender.area)): # Lazy way of finding if in_area is an area obj
+            sources.append(in_area.clients)
             conditions.append(lambda c: c.area == in_area)
         elif isinstance(in_area, set):
+            sources.append([c for area in in_area for c in area.clients])
             conditions.append(lambda c: c.area in in_area)
         elif in_area is None:
             pass
         else:
             raise KeyError('Invalid argument for build_cond in_area: {}'.format(in_area))
 
-        if part_of is not None:
-            conditions.append(lambda c: c in part_of)
-
         if not_to is not None:
             conditions.append(lambda c: c not in not_to)
 
-        if to_blind is True:
-            conditions.append(lambda c: c.is_blind)
-        elif to_blind is False:
-            conditions.append(lambda c: not c.is_blind)
-        elif to_blind is None:
-            pass
-        else:
-            raise KeyError('Invalid argument for build_cond to_blind: {}'.format(to_blind))
+        if part_of is not None:
+            sources.append(part_of)
+            conditions.append(lambda c: c in part_of)
 
-        if to_deaf is True:
-            conditions.append(lambda c: c.is_deaf)
-        elif to_deaf is False:
-            conditions.append(lambda c: not c.is_deaf)
-        elif to_deaf is None:
-            pass
-        else:
-            raise KeyError('Invalid argument for build_cond to_deaf: {}'.format(to_deaf))
+        if flag_check is not None:
+            conditions.append(flag_check)
+        if is_mod is True:
+            sources.append(client_manager.get_clients_with('is_mod'))
+        elif is_officer is True:
+            sources.append(client_manager.get_staff(officers_only=True))
+        elif is_staff is True:
+            sources.append(client_manager.get_staff())
 
         # This is a strict parameter.
         # To be precise, is_zstaff expects the sender to be watching a zone or be in a zone, or
@@ -674,28 +993,24 @@ class Constants():
             # Only staff members who are watching the sender's zone will receive it, PROVIDED that
             # the sender is watching a zone, or in an area part of a zone. If neither is true,
             # NO notification is sent.
-            conditions.append(lambda c: c.is_staff() and c.zone_watched)
-            if sender.zone_watched:
-                conditions.append(lambda c: (c.zone_watched == sender.zone_watched))
-            elif sender.area.in_zone:
-                conditions.append(lambda c: (c.zone_watched == sender.area.in_zone))
-            else:
-                conditions.append(lambda c: False)
+            target_zone = sender.zone_watched if sender.zone_watched else sender.area.in_zone
+            if not target_zone:
+                return RecipientCondition(tuple(), never=True)
+            sources.append(target_zone.get_watcher_set())
+            conditions.append(lambda c: c.zone_watched == target_zone and c.is_staff())
         elif is_zstaff is False:
-            if sender.zone_watched:
-                conditions.append(lambda c: (c.zone_watched != sender.zone_watched))
-            elif sender.area.in_zone:
-                conditions.append(lambda c: (c.zone_watched != sender.area.in_zone))
-            else:
-                conditions.append(lambda c: False)
+            target_zone = sender.zone_watched if sender.zone_watched else sender.area.in_zone
+            if not target_zone:
+                return RecipientCondition(tuple(), never=True)
+            conditions.append(lambda c: c.zone_watched != target_zone)
         elif isinstance(is_zstaff, sender.server.area_manager.Area):
             # Only staff members who are watching the area's zone will receive it, PROVIDED the area
             # is part of a zone. Otherwise, NO notification is sent.
             target_zone = is_zstaff.in_zone
-            if target_zone:
-                conditions.append(lambda c: c.is_staff() and c.zone_watched == target_zone)
-            else:
-                conditions.append(lambda c: False)
+            if not target_zone:
+                return RecipientCondition(tuple(), never=True)
+            sources.append(target_zone.get_watcher_set())
+            conditions.append(lambda c: c.zone_watched == target_zone and c.is_staff())
         elif is_zstaff is None:
             pass
         else:
@@ -712,24 +1027,28 @@ class Constants():
             # Only staff members who are watching the sender's zone will receive it, PROVIDED that
             # the sender is watching a zone, or in an area part of a zone. If neither is true,
             # NO notification is sent.
-            conditions.append(lambda c: c.is_staff())
-            if sender.zone_watched:
-                conditions.append(lambda c: (c.zone_watched == sender.zone_watched))
-            elif sender.area.in_zone:
-                conditions.append(lambda c: (c.zone_watched == sender.area.in_zone))
+            target_zone = sender.zone_watched if sender.zone_watched else sender.area.in_zone
+            if target_zone:
+                sources.append(target_zone.get_watcher_set())
+                conditions.append(lambda c: c.zone_watched == target_zone and c.is_staff())
+            else:
+                sources.append(client_manager.get_staff())
+                conditions.append(lambda c: c.is_staff())
         elif is_zstaff_flex is False:
-            if sender.zone_watched:
-                condition1 = lambda c: (c.zone_watched != sender.zone_watched)
-            elif sender.area.in_zone:
-                condition1 = lambda c: (c.zone_watched != sender.area.in_zone)
+            target_zone = sender.zone_watched if sender.zone_watched else sender.area.in_zone
+            if target_zone:
+                conditions.append(lambda c: c.zone_watched != target_zone or not c.is_staff())
             else:
-                condition1 = lambda c: False
-            conditions.append(lambda c: condition1(c) or not c.is_staff())
+                conditions.append(lambda c: not c.is_staff())
         elif isinstance(is_zstaff_flex, sender.server.area_manager.Area):
             # Only staff members who are watching the area's zone will receive it, PROVIDED the area
             # is part of a zone. Otherwise, NO notification is sent.
             target_zone = is_zstaff_flex.in_zone
-            conditions.append(lambda c: c.is_staff() and c.zone_watched == target_zone)
+            if target_zone:
+                sources.append(target_zone.get_watcher_set())
+            else:
+                sources.append(client_manager.get_staff())
+            conditions.append(lambda c: c.zone_watched == target_zone and c.is_staff())
         elif is_zstaff_flex is None:
             pass
         else:
@@ -739,9 +1058,9 @@ class Constants():
         if pred is not None:
             conditions.append(pred)
 
-        cond = lambda c: all([cond(c) for cond in conditions])
-
-        return cond
+        if not conditions:
+            return RecipientCondition.ALWAYS
+        return RecipientCondition(tuple(conditions), sources=tuple(sources))
 
     @staticmethod
     def dice_roll(arg, command_type, server):
@@ -1125,6 +1444,23 @@ class Constants():
             raise ClientError('Expected positive time length.')
         return length
 
+    @staticmethod
+    def parse_ban_length(ban_length):
+        """
+        Convert a ban length, given as a positive number followed by m (minutes), h (hours) or d
+        (days), into seconds.
+        """
+
+        units = {'m': 60, 'h': 3600, 'd': 86400}
+        try:
+            length = int(ban_length[:-1])*units[ban_length[-1:].lower()]
+        except (ValueError, KeyError):
+            raise ClientError('Expected ban length, such as 30m, 12h or 7d.')
+
+        if length <= 0:
+            raise ClientError('Expected positive ban length.')
+        return length
+
     @staticmethod
     def parse_two_area_names(client, raw_areas, area_duplicate=True, check_valid_range=True):
         """
@@ -0,0 +1,210 @@
+# TsuserverDR, a Danganronpa Online server based on tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com> (original tsuserver3)
+# Current project leader: 2018-19 Chrezm/Iuvee <thechrezm@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import json
+import os
+import threading
+
+from server import logger
+from server.constants import Constants
+
+# Single worker, so that writes to any storage file happen in the order they were requested
+_WRITER = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def submit_write(function, *args):
+    """
+    Schedule `function` to be called with arguments `args` in the background storage writer
+    thread. Functions scheduled this way are called one at a time, in the order they were
+    scheduled.
+
+    Parameters
+    ----------
+    function: Callable
+        Function that performs the write.
+    *args
+        Arguments to pass to the function.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Future of the result of the call.
+    """
+
+    return _WRITER.submit(function, *args)
+
+class IDStore:
+    """
+    Map of identifiers (IPs or HDIDs) to IPIDs, persisted to a JSON file.
+
+    New entries are not written by rewriting the whole JSON file. Instead, they are appended to a
+    journal file next to it, which is merged back into the JSON file once it grows large enough or
+    the store is closed. All disk writes happen in a background thread, so adding entries does not
+    block the server.
+    """
+
+    def __init__(self, file, multivalued=False, compact_every=1024):
+        """
+        Parameters
+        ----------
+        file: str
+            Path to the JSON file of the store. The journal file is this path followed by
+            `.journal`.
+        multivalued: bool, optional
+            If True, each identifier maps to a list of IPIDs, and adding an entry appends the IPID
+            to the list of the identifier. If False, each identifier maps to a single IPID.
+            Defaults to False.
+        compact_every: int, optional
+            Number of journal entries after which the journal is merged into the JSON file.
+            Defaults to 1024.
+        """
+
+        self.file = file
+        self.journal_file = '{}.journal'.format(file)
+        self.multivalued = multivalued
+        self.compact_every = compact_every
+        self.data = dict()
+        self._journal_length = 0
+        # Held while self.data changes, and while the writer thread copies it
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the contents of the JSON file and replay its journal on top of it.
+
+        Returns
+        -------
+        dict
+            Contents of the store. This is the same object as self.data, and it is kept up to date
+            as entries are added.
+
+        Raises
+        ------
+        ServerError
+            If the JSON file could not be opened.
+        json.JSONDecodeError
+            If the JSON file is not valid JSON.
+        """
+
+        try:
+            with Constants.fopen(self.file, 'r', encoding='utf-8') as whole_list:
+                self.data.update(json.loads(whole_list.read()))
+        finally:
+            # Entries in the journal are kept even if the JSON file could not be read
+            self._replay_journal()
+
+        return self.data
+
+    def add(self, key, value):
+        """
+        Record that identifier `key` maps to IPID `value`, and schedule the change to be
+        persisted.
+
+        Parameters
+        ----------
+        key: str
+            Identifier.
+        value: int
+            IPID.
+        """
+
+        self._apply(key, value)
+        line = '{}\n'.format(json.dumps([key, value]))
+        submit_write(self._append, line)
+
+        self._journal_length += 1
+        if self._journal_length >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """
+        Schedule the JSON file to be rewritten with the contents of the store, and the journal
+        file to be emptied. The contents are copied in the background storage writer thread
+        right before writing them.
+        """
+
+        self._journal_length = 0
+        submit_write(self._write_snapshot)
+
+    def close(self):
+        """
+        Merge the journal into the JSON file and wait for all pending writes of the store to
+        finish.
+        """
+
+        self.compact()
+        submit_write(lambda: None).result()
+
+    def _replay_journal(self):
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        key, value = json.loads(line)
+                    except ValueError:
+                        # Entry was only partly written, likely because the server stopped midway
+                        continue
+                    self._apply(key, value)
+                    self._journal_length += 1
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, key, value):
+        with self._lock:
+            if not self.multivalued:
+                self.data[key] = value
+                return
+
+            try:
+                values = self.data[key]
+            except KeyError:
+                self.data[key] = [value]
+            else:
+                if value not in values:
+                    values.append(value)
+
+    def _snapshot(self):
+        # Entries added after the snapshot is taken have their journal writes scheduled after the
+        # snapshot write, so they stay in the journal after it is emptied
+        with self._lock:
+            if self.multivalued:
+                return {key: list(values) for (key, values) in self.data.items()}
+            return self.data.copy()
+
+    def _append(self, line):
+        try:
+            with open(self.journal_file, 'a', encoding='utf-8') as journal:
+                journal.write(line)
+        except OSError as ex:
+            logger.log_pdebug('WARNING: Error writing to {}.\n{}: {}'
+                              .format(self.journal_file, type(ex).__name__, ex))
+
+    def _write_snapshot(self):
+        snapshot = self._snapshot()
+        temp_file = '{}.tmp'.format(self.file)
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as whole_list:
+                json.dump(snapshot, whole_list)
+            os.replace(temp_file, self.file)
+            # Entries up to now are in the JSON file, so they can be dropped from the journal.
+            # Replaying them again would be harmless anyway.
+            with open(self.journal_file, 'w', encoding='utf-8'):
+                pass
+        except OSError as ex:
+            logger.log_pdebug('WARNING: Error writing to {}.\n{}: {}'
+                              .format(self.file, type(ex).__name__, ex))
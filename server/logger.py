@@ -16,15 +16,162 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import datetime
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
 import time
 import traceback
 
 from server.constants import Constants
 
-def setup_logger(debug):
+# Single worker, so error logs are generated one at a time away from the event loop
+_ERROR_WRITER = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    File handler that leaves flushing its written records to whoever owns it, rather than flushing
+    after every record.
+    """
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+class MonthlyFileHandler(BufferedFileHandler):
+    """
+    Buffered file handler that writes each record to the file for the month it was created in.
+    """
+
+    def __init__(self, filename_format, encoding=None):
+        """
+        Parameters
+        ----------
+        filename_format: str
+            Format of the file names, where {year} and {month} are replaced by the year and
+            (zero-padded) month number.
+        encoding: str, optional
+            File encoding. Defaults to None (platform default).
+        """
+
+        self.filename_format = filename_format
+        self.month = self._get_month(time.time())
+        super().__init__(self._get_filename(), encoding=encoding, delay=True)
+
+    def emit(self, record):
+        month = self._get_month(record.created)
+        if month != self.month:
+            self.month = month
+            self.close()
+            self.baseFilename = self._get_filename()
+        super().emit(record)
+
+    @staticmethod
+    def _get_month(timestamp):
+        date = datetime.date.fromtimestamp(timestamp)
+        return date.year, date.month
+
+    def _get_filename(self):
+        year, month = self.month
+        return self.filename_format.format(year=year, month='{:02d}'.format(month))
+
+class QueuedLogHandler(logging.handlers.QueueHandler):
+    """
+    Handler that passes records to a background thread, which formats them and writes them to a
+    target handler. The target is flushed at most every `flush_interval` seconds, so the thread
+    that logs never waits on the disk.
+
+    Once closed, the queue is drained and any further records are dropped, so that the closed
+    target is not reopened.
+    """
+
+    def __init__(self, target, flush_interval=1):
+        """
+        Parameters
+        ----------
+        target: logging.Handler
+            Handler that actually formats and writes records.
+        flush_interval: float, optional
+            Maximum seconds a written record may wait before the target is flushed. Defaults to 1.
+        """
+
+        super().__init__(queue.Queue())
+        self.target = target
+        self.flush_interval = flush_interval
+        self._writer = threading.Thread(target=self._write_records, name='log-writer', daemon=True)
+        self._writer.start()
+
+    def prepare(self, record):
+        # Formatting is left to the writer. Client details are already captured by value when
+        # logging (see ClientInfo), so the record arguments do not change in the meantime.
+        return record
+
+    def emit(self, record):
+        # Called with the handler lock held, same as close
+        if self._writer is not None:
+            super().emit(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self.queue.put(None)
+        finally:
+            self.release()
+
+        if writer is not None:
+            writer.join()
+        self.target.close()
+        super().close()
+
+    def _write_records(self):
+        flush_at = None
+        while True:
+            timeout = None if flush_at is None else max(flush_at - time.monotonic(), 0)
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+
+            if record:
+                self.target.handle(record)
+                if flush_at is None:
+                    flush_at = time.monotonic() + self.flush_interval
+            if flush_at is not None and time.monotonic() >= flush_at:
+                self.target.flush()
+                flush_at = None
+        self.target.flush()
+
+class ClientInfo:
+    """
+    Details of a client as they were when a record about them was logged. They are only turned
+    into text when the record is written.
+    """
+
+    __slots__ = ('ip', 'hdid', 'id', 'is_mod')
+
+    def __init__(self, client):
+        self.ip = client.get_ip()
+        self.hdid = client.get_hdid()
+        self.id = client.id
+        self.is_mod = client.is_mod
+
+    def __str__(self):
+        if self.is_mod:
+            return '[{:<15}][{}][{}][MOD]'.format(self.ip, self.hdid, self.id)
+        return '[{:<15}][{}][{}]'.format(self.ip, self.hdid, self.id)
+
+def setup_logger(debug, flush_interval=1):
     logging.Formatter.converter = time.gmtime
     debug_formatter = logging.Formatter('[%(asctime)s UTC]%(message)s')
     srv_formatter = logging.Formatter('[%(asctime)s UTC]%(message)s')
@@ -32,9 +179,10 @@ def setup_logger(debug):
     debug_log = logging.getLogger('debug')
     debug_log.setLevel(logging.DEBUG)
 
-    debug_handler = logging.FileHandler('logs/debug.log', encoding='utf-8')
+    debug_file_handler = BufferedFileHandler('logs/debug.log', encoding='utf-8')
+    debug_file_handler.setFormatter(debug_formatter)
+    debug_handler = QueuedLogHandler(debug_file_handler, flush_interval=flush_interval)
     debug_handler.setLevel(logging.DEBUG)
-    debug_handler.setFormatter(debug_formatter)
     debug_log.addHandler(debug_handler)
 
     if not debug:
@@ -43,11 +191,10 @@ def setup_logger(debug):
     server_log = logging.getLogger('server')
     server_log.setLevel(logging.INFO)
 
-    current_month = "{:02d}".format(datetime.date.today().month)
-    logfile_name = 'logs/server-{}-{}.log'.format(datetime.date.today().year, current_month)
-    server_handler = logging.FileHandler(logfile_name, encoding='utf-8')
+    server_file_handler = MonthlyFileHandler('logs/server-{year}-{month}.log', encoding='utf-8')
+    server_file_handler.setFormatter(srv_formatter)
+    server_handler = QueuedLogHandler(server_file_handler, flush_interval=flush_interval)
     server_handler.setLevel(logging.INFO)
-    server_handler.setFormatter(srv_formatter)
     server_log.addHandler(server_handler)
 
 #    rp_log = logging.getLogger('rp')
@@ -64,64 +211,138 @@ def setup_logger(debug):
     return (debug_log, debug_handler), (server_log, server_handler)
 
 def log_debug(msg, client=None):
-    msg = parse_client_info(client) + msg
-    logging.getLogger('debug').debug(msg)
+    if client is None:
+        logging.getLogger('debug').debug('%s', msg)
+    else:
+        logging.getLogger('debug').debug('%s%s', ClientInfo(client), msg)
 
-def log_error(msg, server, errortype='P'):
+def log_error(msg, server, errortype='P', wait=True):
     # errortype "C" if server raised an error as a result of a client packet.
     # errortype "P" if server raised an error for any other reason
-    error_log = logging.getLogger('error')
-
+    # A plain copy of the clients and areas is always taken right away, so the dumps show the
+    # state of the server when the error happened. If wait is False, formatting the dumps and
+    # writing the file are left to the background.
     moment = 'logs/{}{}.log'.format(Constants.get_time_iso(), errortype)
     moment = moment.replace(':', '')
-    error_handler = logging.FileHandler(moment, encoding='utf-8')
+    record = logging.LogRecord('error', logging.ERROR, __file__, 0, msg, None, None)
+    snapshot = _snapshot_server(server)
 
-    error_handler.setLevel(logging.ERROR)
-    error_handler.setFormatter(logging.Formatter('[%(asctime)s UTC]%(message)s'))
-    error_log.addHandler(error_handler)
+    if wait:
+        _write_error_log(moment, record, snapshot)
+    else:
+        _ERROR_WRITER.submit(_write_error_log, moment, record, snapshot)
 
-    if server:
-        # Add list of clients to error log
-        try:
-            msg += '\n\n\n= Client dump. ='
-            msg += '\n*Number of clients: {}'.format(len(server.client_manager.clients))
-            msg += '\n*Current clients'
-            clients = sorted(server.client_manager.clients, key=lambda c: c.id)
-            for c in clients:
-                msg += '\n\n{}'.format(c.get_info(as_mod=True))
-        except Exception:
-            etype, evalue, etraceback = sys.exc_info()
-            msg += '\nError generating client dump.'
-            msg += '\n{}'.format("".join(traceback.format_exception(etype, evalue, etraceback)))
+def _snapshot_server(server):
+    # Only copies plain data (ids, names, areas and flags), as this runs in the event loop.
+    if not server:
+        return None
 
-        # Add list of areas to error log
-        try:
-            msg += '\n\n\n= Area dump ='
-            msg += '\n*Current area list: {}'.format(server.area_list)
-            msg += '\n*Old area list: {}'.format(server.old_area_list)
-            msg += '\n*Current areas:'
-
-            for area in server.area_manager.areas:
-                msg += '\n**{}'.format(area)
-                for c in area.clients:
-                    msg += '\n***{}'.format(c)
-        except Exception:
-            etype, evalue, etraceback = sys.exc_info()
-            msg += '\nError generating area dump.'
-            msg += '\n{}'.format("".join(traceback.format_exception(etype, evalue, etraceback)))
-    else:
+    snapshot = dict()
+    try:
+        snapshot['clients'] = [{
+            'id': c.id,
+            'ipid': c.ipid,
+            'hdid': c.hdid,
+            'name': c.name,
+            'char_name': c.get_char_name(),
+            'char_folder': c.char_folder,
+            'showname': c.showname,
+            'area_id': c.area.id,
+            'area_name': c.area.name,
+            'is_gm': c.is_gm,
+            'is_cm': c.is_cm,
+            'is_mod': c.is_mod,
+            'is_visible': c.is_visible,
+            'is_muted': c.is_muted,
+            'is_ooc_muted': c.is_ooc_muted,
+            'version': tuple(c.version),
+            } for c in sorted(server.client_manager.clients, key=lambda c: c.id)]
+    except Exception:
+        snapshot['clients'] = ''.join(traceback.format_exception(*sys.exc_info()))
+
+    try:
+        snapshot['area_list'] = str(server.area_list)
+        snapshot['old_area_list'] = str(server.old_area_list)
+        snapshot['areas'] = [(area.id, area.name, [c.id for c in area.clients])
+                             for area in server.area_manager.areas]
+    except Exception:
+        snapshot['areas'] = ''.join(traceback.format_exception(*sys.exc_info()))
+
+    return snapshot
+
+def _format_client(client):
+    return ('C::{}:{}:{}:{}:{}:{}:{}'
+            .format(client['id'], client['ipid'], client['name'], client['char_name'],
+                    client['showname'], client['is_mod'] or client['is_cm'] or client['is_gm'],
+                    client['area_id']))
+
+def _format_error_dump(msg, snapshot):
+    if snapshot is None:
         # Case server was not initialized properly, so areas and clients are not set
         msg += '\nServer was not initialized, so client and area dumps could not be generated.'
+        return msg
+
+    # Add list of clients to error log
+    msg += '\n\n\n= Client dump. ='
+    clients = snapshot['clients']
+    if isinstance(clients, str):
+        msg += '\nError generating client dump.'
+        msg += '\n{}'.format(clients)
+        clients = list()
+    else:
+        msg += '\n*Number of clients: {}'.format(len(clients))
+        msg += '\n*Current clients'
+        for c in clients:
+            char_info = c['char_name']
+            if c['char_folder'] and c['char_folder'] != char_info: # Indicate iniswap if needed
+                char_info = '{} ({})'.format(char_info, c['char_folder'])
+            msg += '\n\n== Client information of {} =='.format(c['id'])
+            msg += '\n*CID: {}. IPID: {}. HDID: {}'.format(c['id'], c['ipid'], c['hdid'])
+            msg += ('\n*Character name: {}. Showname: {}. OOC username: {}'
+                    .format(char_info, c['showname'], c['name']))
+            msg += '\n*In area: {}-{}'.format(c['area_id'], c['area_name'])
+            msg += ('\n*Is GM? {}. Is CM? {}. Is mod? {}.'
+                    .format(c['is_gm'], c['is_cm'], c['is_mod']))
+            msg += '\n*Is sneaking? {}'.format(not c['is_visible'])
+            msg += '\n*Is muted? {}. Is OOC Muted? {}'.format(c['is_muted'], c['is_ooc_muted'])
+            msg += '\n*Is Using: {0[0]} {0[1]}'.format(c['version'])
+
+    # Add list of areas to error log
+    msg += '\n\n\n= Area dump ='
+    areas = snapshot['areas']
+    if isinstance(areas, str):
+        msg += '\nError generating area dump.'
+        msg += '\n{}'.format(areas)
+        return msg
+
+    clients_by_id = {c['id']: c for c in clients}
+    msg += '\n*Current area list: {}'.format(snapshot['area_list'])
+    msg += '\n*Old area list: {}'.format(snapshot['old_area_list'])
+    msg += '\n*Current areas:'
+    for area_id, area_name, client_ids in areas:
+        msg += '\n**A::{}:{}:{}'.format(area_id, area_name, len(client_ids))
+        for client_id in client_ids:
+            if client_id in clients_by_id:
+                msg += '\n***{}'.format(_format_client(clients_by_id[client_id]))
+            else:
+                msg += '\n***C::{}'.format(client_id)
 
-    # Write and log
-    error_log.error(msg)
-    error_log.removeHandler(error_handler)
+    return msg
+
+def _write_error_log(moment, record, snapshot):
+    record.msg = _format_error_dump(record.msg, snapshot)
+    error_handler = logging.FileHandler(moment, encoding='utf-8')
+    error_handler.setFormatter(logging.Formatter('[%(asctime)s UTC]%(message)s'))
+    error_handler.handle(record)
+    error_handler.close()
 
     log_pserver('Successfully created error log file {}'.format(moment))
 
 def log_server(msg, client=None):
-    msg = parse_client_info(client) + msg
-    logging.getLogger('server').info(msg)
+    if client is None:
+        logging.getLogger('server').info('%s', msg)
+    else:
+        logging.getLogger('server').info('%s%s', ClientInfo(client), msg)
 
 def log_server2(msg, client=None):
     pass
@@ -149,8 +370,4 @@ def log_pserver(msg, client=None):
 def parse_client_info(client):
     if client is None:
         return ''
-    info = client.get_ip()
-    hdid = client.get_hdid()
-    if client.is_mod:
-        return '[{:<15}][{}][{}][MOD]'.format(info, hdid, client.id)
-    return '[{:<15}][{}][{}]'.format(info, hdid, client.id)
+    return str(ClientInfo(client))
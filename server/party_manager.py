@@ -19,7 +19,6 @@
 # WARNING!
 # This class will be fully reworked for 4.3
 
-import asyncio
 import random
 
 from server.exceptions import AreaError, ClientError, PartyError
@@ -35,7 +34,6 @@ class PartyManager:
             self.leaders = leaders
             self.members = set()
             self.invite_list = set()
-            self.lights_timeout = None
 
             area.add_party(self)
 
@@ -148,16 +146,12 @@ class PartyManager:
         def check_lights(self):
             # Only call this when you are sure you want to cancel potential light timeout timers.
             # Restart light timer
-            if self.lights_timeout is not None:
-                self.server.tasker.cancel_task(self.lights_timeout)
-            self.lights_timeout = None
+            self.server.tasker.cancel_deadline(self, 'lights_timeout')
 
             if not self.area.lights:
-                async def _lights_timeout():
-                    await asyncio.sleep(self.server.config['party_lights_timeout'])
-                    self.check_lights_timeout()
-
-                self.lights_timeout = asyncio.ensure_future(_lights_timeout())
+                self.server.tasker.set_deadline(self, 'lights_timeout',
+                                                self.server.config['party_lights_timeout'],
+                                                self.check_lights_timeout)
 
         def check_lights_timeout(self):
             if not self.area.lights:
@@ -215,6 +209,7 @@ class PartyManager:
         for member in party.members:
             member.party = None
         party.area.remove_party(party)
+        self.server.tasker.cancel_deadline(party, 'lights_timeout')
         return pid, party.members.copy()
 
     def get_party(self, party):
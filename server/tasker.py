@@ -20,10 +20,39 @@
 # This class will be reworked for 4.3
 
 import asyncio
+import heapq
+import itertools
 import time
 
 from server.exceptions import ServerError
 
+class Deadline:
+    """
+    A callback due at some point in time, as scheduled by Tasker.set_deadline.
+    """
+
+    __slots__ = ('when', 'callback', 'args', 'queued_at', 'done')
+
+    def __init__(self, when, callback, args):
+        """
+        Parameters
+        ----------
+        when: float
+            Time, in the event loop's clock, the callback is due.
+        callback: Callable
+            Function to call once the deadline is reached.
+        args: tuple
+            Arguments to pass to the callback.
+        """
+
+        self.when = when
+        self.callback = callback
+        self.args = args
+        # Earliest time this deadline has an entry for in the deadline heap
+        self.queued_at = None
+        # True once the deadline fired or was canceled
+        self.done = False
+
 class Tasker:
     def __init__(self, server, loop):
         """
@@ -40,6 +69,13 @@ class Tasker:
         self.client_tasks = dict()
         self.active_timers = dict()
 
+        # Map of (owner, name) to their currently pending deadline
+        self.deadlines = dict()
+        self._deadline_heap = list()
+        self._deadline_counter = itertools.count()
+        self._deadline_handle = None
+        self._deadline_wakeup = None
+
     def create_task(self, client, args):
         """
         Create a new task for given client with given arguments.
@@ -63,7 +99,9 @@ class Tasker:
         # Start new task
         async_function = getattr(self, args[0])(client, args[1:])
         async_future = asyncio.ensure_future(async_function, loop=self.loop)
-        self.client_tasks[client.id][args[0]] = (async_future, args[1:], dict())
+        # Clients only get a task map once they get their first task
+        self.client_tasks.setdefault(client.id, dict())[args[0]] = (async_future, args[1:],
+                                                                    dict())
 
     def cancel_task(self, task):
         """
@@ -171,79 +209,236 @@ class Tasker:
 
         self.client_tasks[client.id][args[0]][2][attr] = value
 
+    def set_deadline(self, owner, name, delay, callback, *args):
+        """
+        Schedule `callback` to be called with arguments `args` after `delay` seconds, replacing
+        any pending deadline with the same owner and name.
 
-    ###
-    # CURRENTLY SUPPORTED TASKS
-    ###
+        Unlike tasks, deadlines do not create coroutines. If the new deadline is not earlier than
+        the one it replaces, rescheduling it only updates its due time, so deadlines that are
+        pushed back often (such as AFK kicks) are cheap to maintain. All deadlines due at the same
+        time are fired together by a single event loop callback.
 
-    async def await_cancellation(self, old_task):
-        # Wait until it is able to properly retrieve the cancellation exception
-        try:
-            await old_task
-        except asyncio.CancelledError:
-            pass
+        Parameters
+        ----------
+        owner: Any
+            Object the deadline is associated with (e.g. a client or a party).
+        name: str
+            Name of the deadline.
+        delay: float
+            Time, in seconds, until the callback is due.
+        callback: Callable
+            Function to call once the deadline is reached.
+        *args
+            Arguments to pass to the callback.
+        """
 
-    async def do_nothing(self):
-        while True:
+        when = self.loop.time() + delay
+        key = (owner, name)
+
+        deadline = self.deadlines.get(key)
+        if deadline is not None and deadline.callback == callback and deadline.args == args:
+            # Just push the existing deadline back or forward. If pushed back, its heap entry
+            # will be moved when it is reached
+            deadline.when = when
+        else:
+            if deadline is not None:
+                deadline.done = True
+            deadline = Deadline(when, callback, args)
+            self.deadlines[key] = deadline
+
+        if deadline.queued_at is None or when < deadline.queued_at:
+            self._queue_deadline(key, deadline)
+
+    def cancel_deadline(self, owner, name):
+        """
+        Cancel the pending deadline with the given owner and name, if any.
+
+        Parameters
+        ----------
+        owner: Any
+            Object the deadline is associated with.
+        name: str
+            Name of the deadline.
+
+        Returns
+        -------
+        bool
+            True if there was a pending deadline, False otherwise.
+        """
+
+        deadline = self.deadlines.pop((owner, name), None)
+        if deadline is None:
+            return False
+        deadline.done = True
+        return True
+
+    def get_deadline(self, owner, name):
+        """
+        Return the time left, in seconds, before the pending deadline with the given owner and
+        name is due.
+
+        Parameters
+        ----------
+        owner: Any
+            Object the deadline is associated with.
+        name: str
+            Name of the deadline.
+
+        Returns
+        -------
+        float
+            Time left, in seconds.
+
+        Raises
+        ------
+        KeyError
+            If there is no pending deadline with that owner and name.
+        """
+
+        return max(0, self.deadlines[(owner, name)].when - self.loop.time())
+
+    def _queue_deadline(self, key, deadline):
+        deadline.queued_at = deadline.when
+        heapq.heappush(self._deadline_heap,
+                       (deadline.when, next(self._deadline_counter), key, deadline))
+
+        # Wake up earlier if this is now the first deadline due
+        if self._deadline_wakeup is None or deadline.when < self._deadline_wakeup:
+            if self._deadline_handle is not None:
+                self._deadline_handle.cancel()
+            self._deadline_wakeup = deadline.when
+            self._deadline_handle = self.loop.call_at(deadline.when, self._fire_deadlines)
+
+    def _fire_deadlines(self):
+        self._deadline_handle = None
+        self._deadline_wakeup = None
+
+        now = self.loop.time()
+        heap = self._deadline_heap
+        due = list()
+        while heap and heap[0][0] <= now:
+            _, _, key, deadline = heapq.heappop(heap)
+            if deadline.done:
+                continue
+            if deadline.when > now:
+                # Deadline was pushed back since it was queued
+                deadline.queued_at = deadline.when
+                heapq.heappush(heap, (deadline.when, next(self._deadline_counter), key,
+                                      deadline))
+                continue
+            deadline.done = True
+            del self.deadlines[key]
+            due.append(deadline)
+
+        if heap:
+            self._deadline_wakeup = heap[0][0]
+            self._deadline_handle = self.loop.call_at(heap[0][0], self._fire_deadlines)
+
+        for deadline in due:
             try:
-                await asyncio.sleep(1)
-            except KeyboardInterrupt:
-                raise
+                deadline.callback(*deadline.args)
+            except Exception as exc:
+                self.loop.call_exception_handler({
+                    'message': 'Exception in deadline callback {}'.format(deadline.callback),
+                    'exception': exc,
+                    })
+
+    ###
+    # CURRENTLY SUPPORTED DEADLINES
+    ###
 
+    def set_afk_kick(self, client, afk_delay, afk_sendto):
+        """
+        Restart the AFK kick countdown of a client.
+
+        Parameters
+        ----------
+        client: ClientManager.Client
+            Client to possibly AFK kick.
+        afk_delay: int
+            Minutes of inactivity after which the client is kicked. If non-positive, the client
+            will not be AFK kicked.
+        afk_sendto: int
+            ID of the area the client will be kicked to.
+        """
 
-    async def as_afk_kick(self, client, args):
-        afk_delay, afk_sendto = args
         try:
             delay = int(afk_delay)*60 # afk_delay is in minutes, so convert to seconds
+        except (TypeError, ValueError):
+            # Report the invalid delay from the event loop, as a failing AFK kick task would
+            delay = 0
+        else:
+            if delay <= 0: # Assumes 0-minute delay means that AFK kicking is disabled
+                self.cancel_deadline(client, 'as_afk_kick')
+                return
+
+        self.set_deadline(client, 'as_afk_kick', delay, self.as_afk_kick, client,
+                          afk_delay, afk_sendto)
+
+    def as_afk_kick(self, client, afk_delay, afk_sendto):
+        try:
+            int(afk_delay)
         except (TypeError, ValueError):
             info = ('The area file contains an invalid AFK kick delay for area {}: {}'.
                     format(client.area.id, afk_delay))
             raise ServerError(info)
 
-        if delay <= 0: # Assumes 0-minute delay means that AFK kicking is disabled
+        try:
+            area = client.server.area_manager.get_area_by_id(int(afk_sendto))
+        except Exception:
+            info = ('The area file contains an invalid AFK kick destination area for area {}: '
+                    '{}'.format(client.area.id, afk_sendto))
+            raise ServerError(info)
+        if client.area.id == afk_sendto: # Don't try and kick back to same area
+            return
+        if client.char_id < 0: # Assumes spectators are exempted from AFK kicks
+            return
+        if client.is_staff(): # Assumes staff are exempted from AFK kicks
             return
 
         try:
-            await asyncio.sleep(delay)
-        except asyncio.CancelledError:
-            raise
+            original_area = client.area
+            original_name = client.displayname
+            client.change_area(area, override_passages=True, override_effects=True,
+                               ignore_bleeding=True)
+        except Exception:
+            pass # Server raised an error trying to perform the AFK kick, ignore AFK kick
         else:
-            try:
-                area = client.server.area_manager.get_area_by_id(int(afk_sendto))
-            except Exception:
-                info = ('The area file contains an invalid AFK kick destination area for area {}: '
-                        '{}'.format(client.area.id, afk_sendto))
-                raise ServerError(info)
-            if client.area.id == afk_sendto: # Don't try and kick back to same area
-                return
-            if client.char_id < 0: # Assumes spectators are exempted from AFK kicks
-                return
-            if client.is_staff(): # Assumes staff are exempted from AFK kicks
-                return
+            client.send_ooc('You were kicked from area {} to area {} for being inactive for '
+                            '{} minutes.'.format(original_area.id, afk_sendto, afk_delay))
+
+            if client.area.is_locked or client.area.is_modlocked:
+                try: # Try and remove the IPID from the area's invite list
+                    client.area.invite_list.pop(client.ipid)
+                except KeyError:
+                    pass # Would only happen if they joined the locked area through mod powers
+
+            if client.party:
+                p = client.party
+                client.party.remove_member(client)
+                client.send_ooc('You were also kicked off from your party.')
+                for c in p.get_members():
+                    c.send_ooc('{} was AFK kicked from your party.'.format(original_name))
+
+    ###
+    # CURRENTLY SUPPORTED TASKS
+    ###
 
+    async def await_cancellation(self, old_task):
+        # Wait until it is able to properly retrieve the cancellation exception
+        try:
+            await old_task
+        except asyncio.CancelledError:
+            pass
+
+    async def do_nothing(self):
+        while True:
             try:
-                original_area = client.area
-                original_name = client.displayname
-                client.change_area(area, override_passages=True, override_effects=True,
-                                   ignore_bleeding=True)
-            except Exception:
-                pass # Server raised an error trying to perform the AFK kick, ignore AFK kick
-            else:
-                client.send_ooc('You were kicked from area {} to area {} for being inactive for '
-                                '{} minutes.'.format(original_area.id, afk_sendto, afk_delay))
-
-                if client.area.is_locked or client.area.is_modlocked:
-                    try: # Try and remove the IPID from the area's invite list
-                        client.area.invite_list.pop(client.ipid)
-                    except KeyError:
-                        pass # Would only happen if they joined the locked area through mod powers
-
-                if client.party:
-                    p = client.party
-                    client.party.remove_member(client)
-                    client.send_ooc('You were also kicked off from your party.')
-                    for c in p.get_members():
-                        c.send_ooc('{} was AFK kicked from your party.'.format(original_name))
+                await asyncio.sleep(1)
+            except KeyboardInterrupt:
+                raise
+
 
     async def as_day_cycle(self, client, args):
         time_start, area_1, area_2, hour_length, hour_start, send_first_hour = args
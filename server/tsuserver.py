@@ -21,22 +21,26 @@
 
 import asyncio
 import importlib
-import json
 import random
 import ssl
 import sys
+import time
 import traceback
 import urllib.request, urllib.error
 import warnings
 
+from server import fantacrypt
 from server import logger
 from server.aoprotocol import AOProtocol
 from server.area_manager import AreaManager
 from server.ban_manager import BanManager
-from server.constants import Constants
+from server.chat_archive import ChatArchive
+from server.config_store import ConfigStore
+from server.constants import Constants, PacketCache, RecipientCondition
 from server.client_manager import ClientManager
 from server.districtclient import DistrictClient
 from server.exceptions import ServerError
+from server.id_store import IDStore
 from server.masterserverclient import MasterServerClient
 from server.party_manager import PartyManager
 from server.tasker import Tasker
@@ -70,11 +74,16 @@ class TsuserverDR:
         self.shutting_down = False
         self.loop = None
         self.last_error = None
+        self.error_reports = dict() # Error key -> (time of last full report, reports suppressed)
         self.allowed_iniswaps = None
+        self.iniswap_table = dict()
         self.area_list = None
         self.old_area_list = None
         self.default_area = 0
         self.all_passwords = list()
+        self.packet_cache = PacketCache()
+        self.chat_archive = ChatArchive('logs/chat', enabled=not self.in_test)
+        self.config_store = ConfigStore()
 
         self.load_config()
         self.load_iniswaps()
@@ -85,14 +94,25 @@ class TsuserverDR:
         self.client_manager = client_manager(self)
         self.zone_manager = ZoneManager(self)
         self.area_manager = AreaManager(self)
-        self.ban_manager = BanManager(self)
+        self.ban_manager = BanManager(self, imports=self.config['banlist_imports'])
         self.party_manager = PartyManager(self)
 
+        self.ipid_store = None
+        self.hdid_store = None
         self.ipid_list = {}
         self.hdid_list = {}
+        self.ipids_in_use = set()
         self.music_list = None
+        self.music_list_index = None # Pair of music list and its index, see get_music_index
         self._music_list_ao2 = None # Pending deprecation in 4.3
+        # Prepared area lists of the current area list by reachable area set, and prepared music
+        # lists by music list, see prepare_area_list and prepare_music_list
+        self._area_list_payloads = (None, dict())
+        self._music_list_payloads = dict()
+        # Encoded area and music list packets of the current area list, see get_music_list_packet
+        self._music_list_packets = (None, dict())
         self.music_pages_ao1 = None
+        self.music_count_ao1 = 0
         self.backgrounds = None
         self.load_music()
         self.load_backgrounds()
@@ -106,7 +126,8 @@ class TsuserverDR:
         self.showname_freeze = False
         self.commands = importlib.import_module('server.commands')
         self.commands_alt = importlib.import_module('server.commands_alt')
-        self.logger_handlers = logger.setup_logger(debug=self.config['debug'])
+        self.logger_handlers = logger.setup_logger(debug=self.config['debug'],
+                                                   flush_interval=self.config['log_flush_interval'])
 
         logger.log_print('Server configurations loaded successfully!')
 
@@ -216,6 +237,16 @@ class TsuserverDR:
         for client in self.client_manager.clients:
             client.disconnect()
 
+        # Write out IDs not yet merged into the ID files, and any delayed ban list changes
+        self.ipid_store.close()
+        self.hdid_store.close()
+        self.ban_manager.flush_banlist()
+        self.chat_archive.flush()
+
+        # Write out queued log records. Anything logged afterwards is written immediately
+        for (_, handler) in self.logger_handlers:
+            handler.close()
+
     def get_version_string(self):
         mes = '{}.{}.{}'.format(self.release, self.major_version, self.minor_version)
         if self.segment_version:
@@ -223,14 +254,18 @@ class TsuserverDR:
         return mes
 
     def reload(self):
-        with Constants.fopen('config/characters.yaml', 'r') as chars:
-            self.char_list = Constants.yaml_load(chars)
-        with Constants.fopen('config/music.yaml', 'r') as music:
-            self.music_list = Constants.yaml_load(music)
-        self.build_music_pages_ao1()
-        self.build_music_list_ao2()
-        with Constants.fopen('config/backgrounds.yaml', 'r') as bgs:
-            self.backgrounds = Constants.yaml_load(bgs)
+        # Only redo the work that depends on a file if the file actually changed
+        char_list = self.config_store.load('config/characters.yaml')
+        if char_list is not self.char_list:
+            self.char_list = char_list
+            self.build_char_pages_ao1()
+            self.client_manager.refresh_char_names()
+        music_list = self.config_store.load('config/music.yaml')
+        if music_list is not self.music_list:
+            self.music_list = music_list
+            self.build_music_pages_ao1()
+            self.build_music_list_ao2()
+        self.backgrounds = self.config_store.load('config/backgrounds.yaml')
 
     def reload_commands(self):
         try:
@@ -241,6 +276,8 @@ class TsuserverDR:
 
     def new_client(self, transport, ip=None, my_protocol=None):
         c = self.client_manager.new_client(transport, my_protocol=my_protocol)
+        if c is None: # Connection refused
+            return None
         if self.rp_mode:
             c.in_rp = True
         c.server = self
@@ -257,8 +294,7 @@ class TsuserverDR:
         return len([client for client in self.client_manager.clients if client.char_id is not None])
 
     def load_backgrounds(self):
-        with Constants.fopen('config/backgrounds.yaml', 'r', encoding='utf-8') as bgs:
-            self.backgrounds = Constants.yaml_load(bgs)
+        self.backgrounds = self.config_store.load('config/backgrounds.yaml')
 
     def load_config(self):
         with Constants.fopen('config/config.yaml', 'r', encoding='utf-8') as cfg:
@@ -301,12 +337,16 @@ class TsuserverDR:
             'default_area_description': 'No description.',
             'party_lights_timeout': 10,
             'show_ms2-prober': True,
+            'log_flush_interval': 1,
             'showname_max_length': 30,
             'sneak_handicap': 5,
             'spectator_name': 'SPECTATOR',
             'music_change_floodguard': {'times_per_interval': 1,
                                         'interval_length': 0,
-                                        'mute_length': 0}}
+                                        'mute_length': 0},
+            'connection_floodguard': {'times_per_interval': 1,
+                                      'interval_length': 0},
+            'banlist_imports': list()}
 
         for (tag, value) in defaults_for_tags.items():
             if tag not in self.config:
@@ -333,9 +373,11 @@ class TsuserverDR:
                             .format(password1, password2))
                     raise ServerError(info)
 
+        # Sent to every joining client, so only encrypt it once
+        self.guardpass_encrypted = fantacrypt.fanta_encrypt(self.config['guardpass'] or '')
+
     def load_characters(self):
-        with Constants.fopen('config/characters.yaml', 'r', encoding='utf-8') as chars:
-            self.char_list = Constants.yaml_load(chars)
+        self.char_list = self.config_store.load('config/characters.yaml')
         self.build_char_pages_ao1()
 
     def load_commandhelp(self):
@@ -410,13 +452,15 @@ class TsuserverDR:
             continue # Not really needed, but made explicit
 
     def load_ids(self):
-        self.ipid_list = {}
-        self.hdid_list = {}
+        self.ipid_store = IDStore('storage/ip_ids.json')
+        self.hdid_store = IDStore('storage/hd_ids.json', multivalued=True)
+        # These are updated by the stores as new IDs are added
+        self.ipid_list = self.ipid_store.data
+        self.hdid_list = self.hdid_store.data
 
         #load ipids
         try:
-            with Constants.fopen('storage/ip_ids.json', 'r', encoding='utf-8') as whole_list:
-                self.ipid_list = json.loads(whole_list.read())
+            self.ipid_store.load()
         except Exception as ex:
             message = 'WARNING: Error loading storage/ip_ids.json. Will assume empty values.\n'
             message += '{}: {}'.format(type(ex).__name__, ex)
@@ -425,27 +469,55 @@ class TsuserverDR:
 
         #load hdids
         try:
-            with Constants.fopen('storage/hd_ids.json', 'r', encoding='utf-8') as whole_list:
-                self.hdid_list = json.loads(whole_list.read())
+            self.hdid_store.load()
         except Exception as ex:
             message = 'WARNING: Error loading storage/hd_ids.json. Will assume empty values.\n'
             message += '{}: {}'.format(type(ex).__name__, ex)
 
             logger.log_pdebug(message)
 
+        # Reverse index of IPIDs, to check if a new IPID is already in use
+        self.ipids_in_use = set(self.ipid_list.values())
+
     def load_iniswaps(self):
         try:
-            with Constants.fopen('config/iniswaps.yaml', 'r', encoding='utf-8') as iniswaps:
-                self.allowed_iniswaps = Constants.yaml_load(iniswaps)
+            self.allowed_iniswaps = self.config_store.load('config/iniswaps.yaml')
         except Exception as ex:
             message = 'WARNING: Error loading config/iniswaps.yaml. Will assume empty values.\n'
             message += '{}: {}'.format(type(ex).__name__, ex)
 
             logger.log_pdebug(message)
+            self.allowed_iniswaps = list()
+
+        self.iniswap_table = self.build_iniswap_table(self.allowed_iniswaps or list())
+
+    @staticmethod
+    def build_iniswap_table(allowed_iniswaps):
+        """
+        Compile a list of allowed iniswap groups into a map of each character to the character
+        folders they may iniswap to. A character may iniswap to a folder if some group lists both.
+
+        Parameters
+        ----------
+        allowed_iniswaps: list of list of str
+            Groups of mutually permissible iniswaps.
+
+        Returns
+        -------
+        dict of str to set of str
+            Map of character name to allowed character folders.
+        """
+
+        table = dict()
+        for char_link in allowed_iniswaps:
+            for char in char_link:
+                table.setdefault(char, set()).update(char_link)
+        return table
 
     def load_music(self, music_list_file='config/music.yaml', server_music_list=True):
-        with Constants.fopen(music_list_file, 'r', encoding='utf-8') as music:
-            music_list = Constants.yaml_load(music)
+        # Music lists are shared by everyone who loads them (see ConfigStore), so they must not be
+        # modified
+        music_list = self.config_store.load(music_list_file)
 
         if server_music_list:
             self.music_list = music_list
@@ -455,21 +527,19 @@ class TsuserverDR:
         return music_list
 
     def dump_ipids(self):
-        with Constants.fopen('storage/ip_ids.json', 'w') as whole_list:
-            json.dump(self.ipid_list, whole_list)
+        self.ipid_store.compact()
 
     def dump_hdids(self):
-        with Constants.fopen('storage/hd_ids.json', 'w') as whole_list:
-            json.dump(self.hdid_list, whole_list)
+        self.hdid_store.compact()
 
     def get_ipid(self, ip):
         if not ip in self.ipid_list:
             while True:
                 ipid = random.randint(0, 10**10-1)
-                if ipid not in self.ipid_list.values():
+                if ipid not in self.ipids_in_use:
                     break
-            self.ipid_list[ip] = ipid
-            self.dump_ipids()
+            self.ipid_store.add(ip, ipid)
+            self.ipids_in_use.add(ipid)
         return self.ipid_list[ip]
 
     def build_char_pages_ao1(self):
@@ -501,6 +571,7 @@ class TsuserverDR:
                    .format(item))
             raise ServerError.MusicInvalid(msg)
 
+        self.music_count_ao1 = len(self.music_pages_ao1)
         self.music_pages_ao1 = [self.music_pages_ao1[x:x + 10] for x in range(0, len(self.music_pages_ao1), 10)]
 
     def build_music_list_ao2(self, from_area=None, c=None, music_list=None, include_areas=True,
@@ -518,6 +589,79 @@ class TsuserverDR:
         self._music_list_ao2 = built_music_list # Backwards compatibility
         return built_music_list
 
+    def get_music_list_packet(self, command, from_area=None, c=None, music_list=None,
+                              include_areas=True, include_music=True):
+        """
+        Return a packet with ID `command` whose arguments are the list build_music_list_ao2
+        builds with the same parameters, along with its encoding.
+
+        Packets are kept until a new area list is loaded. They are told apart by the set of
+        areas they include and the music list they include, so packets for changed reachable
+        areas or another music list are built anew.
+
+        Parameters
+        ----------
+        command: str
+            ID of the packet, such as 'FM', 'FA' or 'SM'.
+        from_area: AreaManager.Area, optional
+            Area from which the perspective will be considered. Defaults to None.
+        c: ClientManager.Client, optional
+            Client whose perspective will be taken into account. Defaults to None.
+        music_list: list of dictionaries with key sets {'category', 'songs'}, optional
+            Music list to use. Defaults to None.
+        include_areas: bool, optional
+            If True, the area list is included. Defaults to True.
+        include_music: bool, optional
+            If True, the music list is included. Defaults to True.
+
+        Returns
+        -------
+        tuple of str
+            Packet arguments.
+        bytes
+            Encoded packet.
+        """
+
+        areas = self.area_manager.areas
+        cached_areas, packets = self._music_list_packets
+        if cached_areas is not areas or len(packets) >= 256:
+            packets = dict()
+            self._music_list_packets = (areas, packets)
+
+        area_key = self._get_area_list_key(c, from_area) if include_areas else -1
+        music_list = self._get_music_list(c, music_list) if include_music else None
+        key = (command, area_key, id(music_list))
+        try:
+            cached_music_list, args, data = packets[key]
+        except KeyError:
+            pass
+        else:
+            if cached_music_list is music_list:
+                return args, data
+
+        args = tuple(self.build_music_list_ao2(from_area=from_area, c=c, music_list=music_list,
+                                               include_areas=include_areas,
+                                               include_music=include_music))
+        data = self.packet_cache.encode(command, args)
+        packets[key] = (music_list, args, data)
+        return args, data
+
+    def _get_area_list_key(self, c, from_area):
+        # Area lists are told apart by the set of areas they include, as a bitset of area IDs (see
+        # AreaManager.get_passages), or None if they include every area
+        if (from_area is None or '<ALL>' in from_area.reachable_areas
+            or (c is not None and (c.is_staff() or c.is_transient))):
+            return None
+        return self.area_manager.get_passages(from_area)[0]
+
+    def _get_music_list(self, c, specific_music_list):
+        if specific_music_list is not None:
+            return specific_music_list
+        # Clients may have a previous music list preference
+        if c and c.music_list is not None:
+            return c.music_list
+        return self.music_list
+
     def prepare_area_list(self, c=None, from_area=None):
         """
         Return the area list of the server. If given c and from_area, it will send an area list
@@ -536,16 +680,27 @@ class TsuserverDR:
             Area list that matches intended perspective.
         """
 
+        # Area lists are cached until a new area list is loaded, by the set of areas they include
+        areas = self.area_manager.areas
+        cached_areas, payloads = self._area_list_payloads
+        if cached_areas is not areas or len(payloads) >= 256:
+            payloads = dict()
+            self._area_list_payloads = (areas, payloads)
+        reachable_bits = self._get_area_list_key(c, from_area)
         # Determine whether to filter the areas in the results
-        need_to_check = (from_area is None or '<ALL>' in from_area.reachable_areas
-                         or (c is not None and (c.is_staff() or c.is_transient)))
+        need_to_check = reachable_bits is None
+        try:
+            return list(payloads[reachable_bits])
+        except KeyError:
+            pass
 
         # Now add areas
         prepared_area_list = list()
-        for area in self.area_manager.areas:
-            if need_to_check or area.name in from_area.reachable_areas:
+        for area in areas:
+            if need_to_check or reachable_bits >> area.id & 1:
                 prepared_area_list.append("{}-{}".format(area.id, area.name))
 
+        payloads[reachable_bits] = tuple(prepared_area_list)
         return prepared_area_list
 
     def prepare_music_list(self, c=None, specific_music_list=None):
@@ -568,13 +723,19 @@ class TsuserverDR:
             Music list ready to be sent to clients
         """
 
-        # If not provided a specific music list to overwrite
-        if specific_music_list is None:
-            specific_music_list = self.music_list # Default value
-            # But just in case, check if this came as a request of a client who had a
-            # previous music list preference
-            if c and c.music_list is not None:
-                specific_music_list = c.music_list
+        # If not provided a specific music list to overwrite, use the one of the client or the
+        # server
+        specific_music_list = self._get_music_list(c, specific_music_list)
+
+        # Music lists are not modified once loaded (see ConfigStore), so their prepared version
+        # can be reused for as long as they are in use
+        try:
+            cached_music_list, payload = self._music_list_payloads[id(specific_music_list)]
+        except KeyError:
+            pass
+        else:
+            if cached_music_list is specific_music_list:
+                return list(payload)
 
         prepared_music_list = list()
         try:
@@ -603,6 +764,10 @@ class TsuserverDR:
                    .format(item))
             raise ServerError.MusicInvalid(msg)
 
+        if len(self._music_list_payloads) >= 16:
+            del self._music_list_payloads[next(iter(self._music_list_payloads))]
+        self._music_list_payloads[id(specific_music_list)] = (specific_music_list,
+                                                              tuple(prepared_music_list))
         return prepared_music_list
 
     def is_valid_char_id(self, char_id):
@@ -619,36 +784,92 @@ class TsuserverDR:
     def get_song_data(self, music, c=None):
         # The client's personal music list should also be a valid place to search
         # so search in there too if possible
-        if c and c.music_list:
-            valid_music = self.music_list + c.music_list
-        else:
-            valid_music = self.music_list
+        owners = [self, c] if c and c.music_list else [self]
+        for owner in owners:
+            index = self.get_music_index(owner)
+            if music in index:
+                return index[music]
+        raise ServerError.MusicNotFoundError('Music not found.')
 
-        for item in valid_music:
-            if item['category'] == music:
-                return item['category'], -1
+    @staticmethod
+    def get_music_index(owner):
+        """
+        Return an index of the music list of `owner`, which maps each category and song name in
+        it to the pair that get_song_data returns for it. If several entries share a name, the
+        earliest one is indexed.
+
+        The index is stored in the music_list_index attribute of `owner` along with the music list
+        it was built for, and it is only rebuilt if `owner` has a different music list since.
+
+        Parameters
+        ----------
+        owner: TsuserverDR or ClientManager.Client
+            Server or client whose music_list attribute is the music list to index.
+
+        Returns
+        -------
+        dict of str to tuple of (str, int)
+            Index of the music list.
+        """
+
+        music_list = owner.music_list
+        if owner.music_list_index is not None:
+            indexed_list, index = owner.music_list_index
+            if indexed_list is music_list:
+                return index
+
+        index = dict()
+        for item in music_list:
+            index.setdefault(item['category'], (item['category'], -1))
             for song in item['songs']:
-                if song['name'] == music:
-                    try:
-                        return song['name'], song['length']
-                    except KeyError:
-                        return song['name'], -1
-        raise ServerError.MusicNotFoundError('Music not found.')
+                index.setdefault(song['name'], (song['name'], song.get('length', -1)))
+
+        owner.music_list_index = (music_list, index)
+        return index
+
+    def get_candidate_clients(self, pred):
+        """
+        Return the clients that should be checked against `pred` when broadcasting. If `pred` is a
+        compiled recipient condition, clients that cannot possibly satisfy it are skipped.
+
+        Parameters
+        ----------
+        pred: Callable[[ClientManager.Client], bool]
+            Recipient predicate.
+
+        Returns
+        -------
+        Iterable of ClientManager.Client
+            Clients to check.
+        """
+
+        if isinstance(pred, RecipientCondition):
+            return pred.get_candidates(self.client_manager.clients)
+        return self.client_manager.clients
 
     def send_all_cmd_pred(self, cmd, *args, pred=lambda x: True):
-        for client in self.client_manager.clients:
-            if pred(client):
-                client.send_command(cmd, *args)
+        with self.packet_cache:
+            for client in self.get_candidate_clients(pred):
+                if pred(client):
+                    client.send_command(cmd, *args)
 
     def make_all_clients_do(self, function, *args, pred=lambda x: True, **kwargs):
-        for client in self.client_manager.clients:
-            if pred(client):
-                getattr(client, function)(*args, **kwargs)
+        with self.packet_cache:
+            for client in self.get_candidate_clients(pred):
+                if pred(client):
+                    getattr(client, function)(*args, **kwargs)
+
+    # Minimum seconds between full reports of identical errors
+    ERROR_REPORT_INTERVAL = 60
 
     def send_error_report(self, client, cmd, args, ex):
         """
         In case of an error caused by a client packet, send error report to user, notify moderators
         and have full traceback available on console and through /lasterror
+
+        Errors of the same type, raised from the same place by the same packet type, are only
+        reported to moderators, the console and the error logs once every ERROR_REPORT_INTERVAL
+        seconds. Reports in between are just counted and mentioned in the next full report.
         """
 
         # Send basic logging information to user
@@ -671,22 +892,50 @@ class TsuserverDR:
         info += '\r\nYour help would be much appreciated.'
         info += '\r\n========='
         client.send_ooc(info)
+
+        # Keep complete traceback available through /lasterror, even if the error is not reported
+        header = 'TSUSERVERDR HAS ENCOUNTERED AN ERROR HANDLING A CLIENT PACKET'
+        details = '\r\n*Server time: {}'.format(current_time)
+        details += '\r\n*Packet details: {} {}'.format(cmd, args)
+        details += '\r\n*Client status: {}'.format(client)
+        details += '\r\n*Area status: {}'.format(client.area)
+        details += ('\r\n\r\n{}'
+                    .format("".join(traceback.format_exception(etype, evalue, etraceback))))
+        self.last_error = [header + details, etype, evalue, etraceback]
+
+        error_key = (type(ex).__name__, file, line_num, cmd)
+        now = time.monotonic()
+        last_report, suppressed = self.error_reports.get(error_key, (None, 0))
+        if last_report is not None and now - last_report < self.ERROR_REPORT_INTERVAL:
+            self.error_reports[error_key] = (last_report, suppressed+1)
+            if self.in_test:
+                raise
+            return
+
+        # Forget errors whose interval ran out, so the keys do not pile up
+        for key, (key_report, key_suppressed) in list(self.error_reports.items()):
+            if key != error_key and now - key_report >= self.ERROR_REPORT_INTERVAL:
+                del self.error_reports[key]
+                if key_suppressed:
+                    logger.log_print('{} identical error{} {} not reported since the last report'
+                                     .format(key_suppressed, 's' if key_suppressed != 1 else '',
+                                             key))
+        self.error_reports[error_key] = (now, 0)
+
         client.send_ooc_others('Client {} triggered a Python error through a client packet. '
                                'Do /lasterror to take a look at it.'.format(client.id),
                                pred=lambda c: c.is_mod)
 
         # Print complete traceback to console
-        info = 'TSUSERVERDR HAS ENCOUNTERED AN ERROR HANDLING A CLIENT PACKET'
-        info += '\r\n*Server time: {}'.format(current_time)
-        info += '\r\n*Packet details: {} {}'.format(cmd, args)
-        info += '\r\n*Client status: {}'.format(client)
-        info += '\r\n*Area status: {}'.format(client.area)
-        info += '\r\n\r\n{}'.format("".join(traceback.format_exception(etype, evalue, etraceback)))
+        info = header
+        if suppressed:
+            info += ('\r\n*{} identical error{} not reported since the last report'
+                     .format(suppressed, 's' if suppressed != 1 else ''))
+        info += details
         logger.log_print(info)
-        self.last_error = [info, etype, evalue, etraceback]
 
         # Log error to file
-        logger.log_error(info, server=self, errortype='C')
+        logger.log_error(info, server=self, errortype='C', wait=False)
 
         if self.in_test:
             raise
@@ -218,6 +218,18 @@ class ZoneManager:
 
             return self._watchers.copy()
 
+        def get_watcher_set(self):
+            """
+            Return the set of the zone's watchers itself, without copying it.
+
+            Returns
+            -------
+            set of ClientManager.Client
+                Watchers of the zone. This is the set the zone keeps, so it must not be modified.
+            """
+
+            return self._watchers
+
         def remove_watcher(self, watcher):
             """
             Remove a client from the zone watcher set if it was there.
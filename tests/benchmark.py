@@ -0,0 +1,311 @@
+"""
+Load-generation benchmark for the server packet handlers.
+
+Unlike the unit tests, which use a handful of clients whose outgoing packets are recorded for
+assertions, this connects many synthetic clients through AOProtocol with transports that just
+count written bytes, so the server goes through its regular serialization path. Clients use a mix
+of the supported client protocols and are spread across the areas of the area list. They then
+replay a random mix of IC messages, OOC messages, music changes, area moves and commands
+(/getareas, /scream, zone and party commands), and the time each packet handler takes is
+reported per packet type.
+
+Message and music pacing are disabled, so every packet reaches the full handler.
+
+Usage (from the repository root, with a config folder in place as for the tests):
+    python -m tests.benchmark
+    python -m tests.benchmark --clients 5000 --packets 50000 --memory
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from server.aoprotocol import AOProtocol
+from server.id_store import IDStore
+from server.tasker import Tasker
+from server.tsuserver import TsuserverDR
+
+# ID packet arguments of each simulated client version, with the protocol they select
+CLIENT_VERSIONS = [
+    ('DRO', '1.0.0'), # ClientDRO1d0d0
+    ('AO2', '2.4.8'), # ClientDROLegacy
+    ('AO2', '2.6.0'), # ClientAO2d6
+    ('AO2', '2.7.0'), # ClientAO2d7
+    ('AO2', '2.8.4'), # ClientAO2d8d4
+    ('AO2', 'CC - Update 22.0'), # ClientCC22
+    ('AO2', 'CC - Update 24.0'), # ClientCC24
+    ]
+
+# Relative frequency of each simulated action
+ACTIONS = [
+    ('MS', 40),
+    ('CT', 20),
+    ('MC', 10),
+    ('move', 10),
+    ('/getareas', 5),
+    ('/scream', 5),
+    ('zone', 5),
+    ('party', 5),
+    ]
+
+class _BenchTransport:
+    def __init__(self, ip):
+        self.ip = ip
+        self.protocol = None
+        self.bytes_written = 0
+        self.closed = False
+
+    def write(self, data):
+        self.bytes_written += len(data)
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.protocol.connection_lost(None)
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return (self.ip, 0)
+        return default
+
+class _BenchTsuserverDR(TsuserverDR):
+    def __init__(self, num_clients):
+        """ Overwrites tsuserver.TsuserverDR.__init__ """
+
+        super().__init__(in_test=True)
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.tasker = Tasker(self, self.loop)
+
+        # Make room for every synthetic client, and give each of them their own character so they
+        # can all talk in IC and move around freely
+        self.config['playerlimit'] = num_clients
+        self.config['connection_floodguard'] = {'times_per_interval': 1, 'interval_length': 0}
+        self.char_list = self.char_list + ['Bench {}'.format(i) for i in range(num_clients)]
+        for area in self.area_manager.areas:
+            area.can_send_message = lambda: True
+
+        # Keep synthetic IPIDs and HDIDs out of the server storage files
+        self.bench_storage = tempfile.mkdtemp()
+        self.ipid_store = IDStore(os.path.join(self.bench_storage, 'ip_ids.json'))
+        self.hdid_store = IDStore(os.path.join(self.bench_storage, 'hd_ids.json'),
+                                  multivalued=True)
+        self.ipid_list = self.ipid_store.data
+        self.hdid_list = self.hdid_store.data
+        self.ipids_in_use = set()
+
+class _BenchClient:
+    def __init__(self, server, number):
+        self.server = server
+        self.number = number
+        self.transport = _BenchTransport('10.{}.{}.{}'.format(number // 65536 % 256,
+                                                              number // 256 % 256, number % 256))
+        self.protocol = AOProtocol(server)
+        self.transport.protocol = self.protocol
+        self.protocol.connection_made(self.transport)
+        self.client = self.protocol.client
+        self.client.change_music_cd = lambda: 0
+
+    def send(self, packet):
+        self.protocol.data_received(packet.encode('utf-8'))
+        # Run one iteration of the event loop so that the output of every client is written
+        self.server.loop.call_soon(self.server.loop.stop)
+        self.server.loop.run_forever()
+
+    def join(self, version, char_id, area):
+        self.send('HI#BENCHHDID{}#%'.format(self.number))
+        self.send('ID#{}#{}#%'.format(*version))
+        for packet in ('askchaa#%', 'RC#%', 'RM#%', 'RD#%'):
+            self.send(packet)
+        self.send('CC#{}#{}#BENCHHDID{}#%'.format(self.client.id, char_id, self.number))
+        if area != self.client.area:
+            self.send('MC#{}-{}#{}#%'.format(area.id, area.name, self.client.char_id))
+
+    def ms_packet(self, message):
+        values = {
+            'msg_type': '1',
+            'pre': '-',
+            'folder': self.client.get_char_name(),
+            'anim': 'happy',
+            'text': message,
+            'pos': 'wit',
+            'sfx': '0',
+            'cid': self.client.char_id,
+            'charid_pair': -1,
+            'charid_pair_pair_order': '-1',
+            'effect': '-',
+            }
+        args = [values.get(field, 0 if arg_type.name == 'INT' else '')
+                for (field, arg_type) in self.client.packet_handler.MS_INBOUND.value]
+        return 'MS#{}#%'.format('#'.join(str(arg) for arg in args))
+
+    def action_packet(self, action, rng):
+        client = self.client
+        if action == 'MS':
+            return self.ms_packet('Message {}'.format(rng.randrange(10**6)))
+        if action == 'CT':
+            return 'CT#bench{}#Chat {}#%'.format(self.number, rng.randrange(10**6))
+        if action == 'MC':
+            category = rng.choice(self.server.music_list)
+            song = rng.choice(category['songs'])['name']
+            return 'MC#{}#{}#%'.format(song, client.char_id)
+        if action == 'move':
+            area = rng.choice(self.server.area_manager.areas)
+            return 'MC#{}-{}#{}#%'.format(area.id, area.name, client.char_id)
+        if action == '/getareas':
+            return 'CT#bench{}#/getareas#%'.format(self.number)
+        if action == '/scream':
+            return 'CT#bench{}#/scream Scream {}#%'.format(self.number, rng.randrange(10**6))
+        if action == 'zone':
+            if client.zone_watched:
+                command = '/zone_delete'
+            elif client.area.in_zone:
+                command = '/zone_watch {}'.format(client.area.in_zone.get_id())
+            else:
+                command = '/zone'
+            return 'CT#bench{}#{}#%'.format(self.number, command)
+        if action == 'party':
+            command = '/party_leave' if client.party else '/party'
+            return 'CT#bench{}#{}#%'.format(self.number, command)
+        raise ValueError(action)
+
+def percentile(samples, fraction):
+    return samples[min(len(samples)-1, int(len(samples)*fraction))]
+
+def run(num_clients=500, num_packets=20000, staff_ratio=0.02, seed=0, memory=False):
+    """
+    Run the benchmark and print a report.
+
+    Parameters
+    ----------
+    num_clients: int, optional
+        Number of synthetic clients. Defaults to 500.
+    num_packets: int, optional
+        Number of packets to replay once all clients joined. Defaults to 20000.
+    staff_ratio: float, optional
+        Fraction of the clients that log in as game masters (and thus may use zone commands).
+        Defaults to 0.02.
+    seed: int, optional
+        Random seed. Defaults to 0.
+    memory: bool, optional
+        If True, also trace memory allocations with tracemalloc, and report the peak traced
+        memory in use while handling each packet (above what was in use before it) and the bytes
+        sent for it. This slows down handlers considerably, so timings of such a run should not be
+        compared with those of runs without it. Defaults to False.
+
+    Returns
+    -------
+    dict of str to list of float
+        Handler latencies, in seconds, for each packet type.
+    """
+
+    rng = random.Random(seed)
+    server = _BenchTsuserverDR(num_clients)
+
+    start = time.perf_counter()
+    clients = list()
+    areas = server.area_manager.areas
+    for i in range(num_clients):
+        client = _BenchClient(server, i)
+        client.join(CLIENT_VERSIONS[i % len(CLIENT_VERSIONS)], len(server.char_list)-1-i,
+                    areas[i % len(areas)])
+        if rng.random() < staff_ratio:
+            client.send('CT#bench{}#/loginrp {}#%'.format(i, server.config['gmpass']))
+        clients.append(client)
+    join_time = time.perf_counter() - start
+    print('Connected {} clients in {:.2f} s ({:.2f} ms per client).'
+          .format(num_clients, join_time, join_time/num_clients*1000))
+    handshakes = sorted(c.client.join_duration for c in clients
+                        if c.client.join_duration is not None)
+    if handshakes:
+        print('Handshake (HI to DONE): p50 {:.1f} us, p99 {:.1f} us.'
+              .format(percentile(handshakes, 0.5)*10**6, percentile(handshakes, 0.99)*10**6))
+
+    actions = [action for (action, _) in ACTIONS]
+    weights = [weight for (_, weight) in ACTIONS]
+    latencies = collections.defaultdict(list)
+    peak_memory = collections.defaultdict(list)
+    written = collections.defaultdict(int)
+    if memory:
+        tracemalloc.start()
+
+    for action in rng.choices(actions, weights=weights, k=num_packets):
+        client = rng.choice(clients)
+        if client.transport.closed:
+            continue
+        packet = client.action_packet(action, rng)
+        bytes_before = sum(c.transport.bytes_written for c in clients) if memory else 0
+
+        if memory:
+            tracemalloc.reset_peak()
+            memory_before, _ = tracemalloc.get_traced_memory()
+        handler_start = time.perf_counter()
+        client.send(packet)
+        latencies[action].append(time.perf_counter() - handler_start)
+        if memory:
+            _, memory_peak = tracemalloc.get_traced_memory()
+            peak_memory[action].append(memory_peak - memory_before)
+            written[action] += sum(c.transport.bytes_written for c in clients) - bytes_before
+
+    if memory:
+        tracemalloc.stop()
+
+    header = '{:<10} {:>8} {:>12} {:>10} {:>10}'.format('Packet', 'Count', 'Packets/s',
+                                                         'p50 (us)', 'p99 (us)')
+    if memory:
+        header += ' {:>16} {:>14}'.format('Peak mem KiB/pkt', 'Out KiB/pkt')
+    print(header)
+    for action in actions:
+        samples = sorted(latencies[action])
+        if not samples:
+            continue
+        line = ('{:<10} {:>8} {:>12.0f} {:>10.1f} {:>10.1f}'
+                .format(action, len(samples), len(samples)/sum(samples),
+                        percentile(samples, 0.5)*10**6, percentile(samples, 0.99)*10**6))
+        if memory:
+            line += (' {:>16.1f} {:>14.1f}'
+                     .format(statistics.mean(peak_memory[action])/1024,
+                             written[action]/len(samples)/1024))
+        print(line)
+
+    for client in clients:
+        client.transport.close()
+    server.ipid_store.close()
+    server.hdid_store.close()
+    for (logger, handler) in server.logger_handlers:
+        handler.close()
+        logger.removeHandler(handler)
+    server.loop.close()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark server packet handlers under load.')
+    parser.add_argument('--clients', type=int, default=500, help='number of synthetic clients')
+    parser.add_argument('--packets', type=int, default=20000, help='number of packets to replay')
+    parser.add_argument('--staff-ratio', type=float, default=0.02,
+                        help='fraction of clients logged in as game masters')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--memory', action='store_true',
+                        help='also report peak traced memory and bytes sent per packet (slower)')
+    args = parser.parse_args()
+    run(num_clients=args.clients, num_packets=args.packets, staff_ratio=args.staff_ratio,
+        seed=args.seed, memory=args.memory)
+
+if __name__ == '__main__':
+    main()
@@ -214,6 +214,11 @@ class _TestClientManager(ClientManager):
 
             self.send_command_stc(command, *args)
 
+        def send_encoded_command(self, command, args, data):
+            """ Overwrites ClientManager.Client.send_encoded_command """
+
+            self.send_command_stc(command, *args)
+
         def send_command_stc(self, command_type, *args):
             if len(args) > 1 and isinstance(args[1], TsuserverException):
                 new_args = [args[0], args[1].message]
@@ -0,0 +1,172 @@
+import os
+import tempfile
+import time
+
+import yaml
+
+from .structures import _TestSituation4Mc1Gc2
+
+class _TestAreaListReload(_TestSituation4Mc1Gc2):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        with open('config/areas.yaml', 'r') as area_list_file:
+            cls.area_list = yaml.safe_load(area_list_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def load_areas(self, name, area_list):
+        file = os.path.join(self.directory.name, '{}.yaml'.format(name))
+        with open(file, 'w') as area_list_file:
+            yaml.safe_dump(area_list, area_list_file)
+        self.server.area_manager.load_areas(area_list_file=file, incremental=True)
+
+    def extended_area_list(self):
+        # Area 3 gets a new background and a new area is added after it, so areas 4 through 7 move
+        # down one ID
+        area_list = [dict(area) for area in self.area_list]
+        area_list[3]['background'] = 'NewBackground'
+        area_list.insert(4, {'area': 'Extra Area', 'background': 'NewBackground'})
+        return area_list
+
+class TestAreaListReload_01_KeptAreas(_TestAreaListReload):
+    def test_01_keepclientslockszones(self):
+        """
+        Situation: C1 is in area 3 and C3 in area 6. Areas 3 and 6 are locked, and area 6 is part of
+        a zone. An area list where area 3 changed and a new area follows it is loaded
+        incrementally. Areas 0 through 2 and 4 through 7 are kept, along with their clients, locks
+        and zones, and clients in kept areas get a new music list as area IDs shifted. C1 is moved
+        to the new area 3.
+        """
+
+        self.c1.move_area(3)
+        self.c3.move_area(6)
+        old_areas = list(self.server.area_manager.areas)
+        old_areas[3].is_locked = True
+        old_areas[6].is_locked = True
+        kept_zone = self.server.zone_manager.new_zone({old_areas[5], old_areas[6]}, {self.c3})
+        deleted_zone = self.server.zone_manager.new_zone({old_areas[2], old_areas[3]}, {self.c1})
+
+        self.load_areas('extended', self.extended_area_list())
+        areas = self.server.area_manager.areas
+
+        # Kept areas are the same objects, with updated IDs
+        self.assertEqual(areas[:3], old_areas[:3])
+        self.assertEqual(areas[5:], old_areas[4:])
+        self.assertEqual([area.id for area in areas], list(range(9)))
+        self.assertNotIn(old_areas[3], areas)
+        self.assertEqual(self.server.area_manager.get_area_by_id(7), old_areas[6])
+
+        # Kept areas keep their clients and locks, changed ones start anew
+        self.assertEqual(self.c0.area, areas[0])
+        self.assertEqual(self.c2.area, areas[0])
+        self.assertEqual(self.c3.area, old_areas[6])
+        self.assertTrue(old_areas[6].is_locked)
+        self.assertFalse(areas[3].is_locked)
+
+        # Only zones made up of kept areas are kept
+        zones = self.server.zone_manager.get_zones()
+        self.assertIn(kept_zone, zones)
+        self.assertNotIn(deleted_zone, zones)
+        self.assertEqual(self.c3.zone_watched, zones[kept_zone])
+        self.assertIsNone(self.c1.zone_watched)
+        self.c1.assert_ooc('Your zone has been automatically deleted.', ooc_over=False)
+
+        # Clients in changed areas are moved out
+        self.assertEqual(self.c1.area, areas[3])
+        self.c1.assert_ooc('Area list reload. Moving you to the new {}.'.format(areas[3].name),
+                           ooc_over=True)
+
+        # Clients in kept areas get new music lists with the shifted area IDs
+        for c in [self.c0, self.c2, self.c3]:
+            c.assert_packet('FM', None, somewhere=True, ooc_over=True)
+            c.assert_no_ooc()
+        self.c0.discard_all()
+        self.c1.discard_all()
+        self.c2.discard_all()
+        self.c3.discard_all()
+
+    def test_02_removedarea(self):
+        """
+        Situation: C2 moves to the new area 4. The original area list is loaded incrementally
+        again, so area 4 no longer exists and area 3 changed back. C1 and C2 are moved out, the
+        former to the new area 3 and the latter to the default area. C3 stays, and all of C0, C2
+        and C3 get a new music list.
+        """
+
+        self.c2.move_area(4)
+        old_areas = list(self.server.area_manager.areas)
+
+        self.load_areas('original', self.area_list)
+        areas = self.server.area_manager.areas
+
+        self.assertEqual(areas[:3], old_areas[:3])
+        self.assertEqual(areas[4:], old_areas[5:])
+        self.assertNotIn(old_areas[3], areas)
+        self.assertNotIn(old_areas[4], areas)
+        self.assertEqual(self.c1.area, areas[3])
+        self.assertEqual(self.c2.area, areas[0])
+        self.assertEqual(self.c3.area, areas[6])
+        self.assertEqual(self.c3.area, old_areas[7])
+
+        self.c1.assert_ooc('Area list reload. Moving you to the new {}.'.format(areas[3].name),
+                           ooc_over=True)
+        self.c2.assert_ooc('Area list reload. Your previous area no longer exists. Moving you to '
+                           'the server default area {}.'.format(areas[0].name), ooc_over=True)
+        for c in [self.c0, self.c3]:
+            c.assert_packet('FM', None, somewhere=True, ooc_over=True)
+            c.assert_no_ooc()
+        self.c0.discard_all()
+        self.c1.discard_all()
+        self.c2.discard_all()
+        self.c3.discard_all()
+
+    def test_03_samelist(self):
+        """
+        Situation: The same area list is loaded incrementally again. Nothing changes, and nobody
+        gets any packets.
+        """
+
+        old_areas = list(self.server.area_manager.areas)
+        self.load_areas('same', self.area_list)
+        self.assertEqual(self.server.area_manager.areas, old_areas)
+
+class TestAreaListReload_02_DayCyclesGlobalIC(_TestAreaListReload):
+    def test_01_keepsomecancelothers(self):
+        """
+        Situation: C0 has a day cycle and global IC over areas 0 through 2, and C3 over areas 5
+        through 6. An area list where areas 4 through 7 change IDs is loaded incrementally. C0 keeps
+        theirs, while C3's are cancelled, as their area range no longer refers to the same areas.
+        """
+
+        tasker = self.server.tasker
+        tasker.create_task(self.c0, ['as_day_cycle', time.time(), 0, 2, 60, 0, False])
+        tasker.create_task(self.c3, ['as_day_cycle', time.time(), 5, 6, 60, 0, False])
+        self.c0.multi_ic = [self.area0, self.area2]
+        self.c0.multi_ic_pre = '>>'
+        self.c3.multi_ic = [self.area5, self.area6]
+        self.c3.multi_ic_pre = '>>'
+
+        self.load_areas('extended', self.extended_area_list())
+
+        self.assertEqual(tasker.get_task_args(self.c0, ['as_day_cycle'])[1:3], [0, 2])
+        self.assertRaises(KeyError, tasker.get_task, self.c3, ['as_day_cycle'])
+        self.assertEqual(self.c0.multi_ic, [self.area0, self.area2])
+        self.assertEqual(self.c0.multi_ic_pre, '>>')
+        self.assertIsNone(self.c3.multi_ic)
+        self.assertEqual(self.c3.multi_ic_pre, '')
+
+        self.c3.assert_ooc('Due to an area list reload, your global IC was turned off. You may '
+                           'turn it on again manually.', ooc_over=False)
+        self.c3.assert_ooc('Due to an area list reload, your global IC prefix was removed. You '
+                           'may set it again manually.', ooc_over=True)
+        self.c0.assert_no_ooc()
+        tasker.remove_task(self.c0, ['as_day_cycle'])
+        self.c0.discard_all()
+        self.c1.discard_all()
+        self.c2.discard_all()
+        self.c3.discard_all()
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from unittest.mock import Mock, patch
+
+from server import ban_manager
+from server.ban_manager import BanManager
+from server.exceptions import ServerError
+
+from .structures import _TestSituation4Mc1Gc2
+
+class TestBanManager_01_Storage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, 'banlist.json')
+        self.server = Mock(loop=None)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_01_addremove(self):
+        """
+        Situation: IPIDs and HDIDs are banned and unbanned. Each change is written right away as
+        the server is not running.
+        """
+
+        bans = BanManager(self.server, file=self.file)
+        bans.add_ban(1234)
+        bans.add_ban('5678')
+        bans.add_hdid_ban('abcd')
+        self.assertTrue(bans.is_banned(1234))
+        self.assertTrue(bans.is_banned(5678))
+        self.assertFalse(bans.is_banned(9012))
+        self.assertTrue(bans.is_hdid_banned('abcd'))
+        self.assertFalse(bans.is_hdid_banned('efgh'))
+        self.assertRaises(ServerError, bans.add_ban, 1234)
+        self.assertRaises(ServerError, bans.add_hdid_ban, 'abcd')
+        self.assertRaises(ServerError, bans.add_ban, 'not an ip')
+
+        with open(self.file) as banlist_file:
+            saved = json.load(banlist_file)
+        self.assertCountEqual(saved, [1234, 5678, {'hdid': 'abcd'}])
+
+        bans.remove_ban(1234)
+        bans.remove_hdid_ban('abcd')
+        self.assertFalse(bans.is_banned(1234))
+        self.assertFalse(bans.is_hdid_banned('abcd'))
+        self.assertRaises(ServerError, bans.remove_ban, 1234)
+        self.assertRaises(ServerError, bans.remove_hdid_ban, 'abcd')
+
+        with open(self.file) as banlist_file:
+            self.assertEqual(json.load(banlist_file), [5678])
+
+    def test_02_load(self):
+        """
+        Situation: A ban list is loaded. IPID bans written before HDID bans existed load unchanged.
+        """
+
+        with open(self.file, 'w') as banlist_file:
+            json.dump([1234, 5678, {'hdid': 'abcd'}], banlist_file)
+
+        bans = BanManager(self.server, file=self.file)
+        self.assertEqual(bans.ipid_bans, {1234: None, 5678: None})
+        self.assertEqual(bans.hdid_bans, {'abcd': None})
+
+        bans = BanManager(self.server, file=os.path.join(self.directory.name, 'missing.json'))
+        self.assertEqual(bans.ipid_bans, dict())
+        self.assertEqual(bans.hdid_bans, dict())
+
+    def test_03_delayedwrite(self):
+        """
+        Situation: Several bans are added while the server is running. They are written together
+        once, after the write delay.
+        """
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.server.loop = loop
+        bans = BanManager(self.server, file=self.file)
+
+        written = list()
+        write = ban_manager.submit_write
+        def submit_write(function, *args):
+            written.append(args)
+            return write(function, *args)
+
+        async def ban_all():
+            bans.add_ban(1234)
+            bans.add_ban(5678)
+            bans.add_hdid_ban('abcd')
+            self.assertEqual(written, [])
+            self.assertFalse(os.path.exists(self.file))
+            await asyncio.sleep(0.1)
+
+        with patch.object(BanManager, 'WRITE_DELAY', 0.01), \
+             patch.object(ban_manager, 'submit_write', side_effect=submit_write):
+            loop.run_until_complete(ban_all())
+            self.assertEqual(len(written), 1)
+            self.assertCountEqual(written[0][1], [1234, 5678, {'hdid': 'abcd'}])
+
+            # Changes not yet written are written when the ban list is flushed
+            async def unban():
+                bans.remove_ban(1234)
+            loop.run_until_complete(unban())
+            self.assertEqual(len(written), 1)
+            bans.flush_banlist()
+            self.assertEqual(len(written), 2)
+
+        with open(self.file) as banlist_file:
+            self.assertCountEqual(json.load(banlist_file), [5678, {'hdid': 'abcd'}])
+
+    def test_04_expiry(self):
+        """
+        Situation: An IPID and an HDID are banned until a time that then passes. They are no longer
+        banned, and the expired bans are removed from the ban list file.
+        """
+
+        bans = BanManager(self.server, file=self.file)
+        now = time.time()
+        bans.add_ban(1234, expires=now+60)
+        bans.add_hdid_ban('abcd', expires=now+60)
+        bans.add_ban(5678)
+        self.assertTrue(bans.is_banned(1234))
+        self.assertTrue(bans.is_hdid_banned('abcd'))
+
+        with open(self.file) as banlist_file:
+            self.assertCountEqual(json.load(banlist_file),
+                                  [{'ipid': 1234, 'expires': now+60}, 5678,
+                                   {'hdid': 'abcd', 'expires': now+60}])
+
+        with patch('time.time', return_value=now+60):
+            self.assertFalse(bans.is_banned(1234))
+            self.assertFalse(bans.is_hdid_banned('abcd'))
+            self.assertTrue(bans.is_banned(5678))
+            # An expired ban may be added again
+            bans.add_ban(1234, expires=now+120)
+        self.assertEqual(bans.ipid_bans, {1234: now+120, 5678: None})
+
+        with open(self.file) as banlist_file:
+            self.assertCountEqual(json.load(banlist_file),
+                                  [{'ipid': 1234, 'expires': now+120}, 5678])
+
+    def test_05_importexport(self):
+        """
+        Situation: Bans are exported and imported into another ban list, which already has some
+        bans. For IPIDs and HDIDs banned in both, the longer ban is kept.
+        """
+
+        bans = BanManager(self.server, file=self.file)
+        bans.add_ban(1111)
+        bans.add_ban(2222, expires=200)
+        bans.add_ban(3333, expires=100)
+        bans.add_hdid_ban('abcd', expires=300)
+        exported = os.path.join(self.directory.name, 'exported.json')
+        bans.export_banlist(exported)
+
+        other = BanManager(self.server, file=os.path.join(self.directory.name, 'other.json'))
+        with patch('time.time', return_value=0):
+            other.add_ban(1111, expires=50)
+            other.add_ban(2222)
+            other.add_ban(3333, expires=50)
+            other.add_hdid_ban('abcd', expires=400)
+            self.assertEqual(other.import_banlist(exported), 2)
+
+        self.assertEqual(other.ipid_bans, {1111: None, 2222: None, 3333: 100})
+        self.assertEqual(other.hdid_bans, {'abcd': 400})
+        self.assertRaises(ServerError, other.import_bans, [{'name': 'Nobody'}])
+
+        with open(exported, 'w') as banlist_file:
+            banlist_file.write('Not JSON')
+        self.assertRaises(ServerError, other.import_banlist, exported)
+        self.assertRaises(ServerError, other.import_banlist,
+                          os.path.join(self.directory.name, 'missing.json'))
+
+    def test_06_importonload(self):
+        """
+        Situation: A ban list is loaded with two import files, one of which is missing. The bans of
+        the other one are merged in and written to the ban list file.
+        """
+
+        with open(self.file, 'w') as banlist_file:
+            json.dump([1234], banlist_file)
+        imported = os.path.join(self.directory.name, 'imported.json')
+        with open(imported, 'w') as banlist_file:
+            json.dump([5678, {'hdid': 'abcd', 'expires': None}], banlist_file)
+        missing = os.path.join(self.directory.name, 'missing.json')
+
+        with patch.object(ban_manager.logger, 'log_pdebug') as log_pdebug:
+            bans = BanManager(self.server, file=self.file, imports=[missing, imported])
+        self.assertEqual(log_pdebug.call_count, 2)
+        self.assertEqual(bans.ipid_bans, {1234: None, 5678: None})
+        self.assertEqual(bans.hdid_bans, {'abcd': None})
+
+        with open(self.file) as banlist_file:
+            self.assertCountEqual(json.load(banlist_file), [1234, 5678, {'hdid': 'abcd'}])
+
+class TestBanManager_02_BanHDID(_TestSituation4Mc1Gc2):
+    def test_01_banhdid(self):
+        """
+        Situation: C1 bans an HDID. Both the HDID and all IPIDs it is associated with are banned.
+        """
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        bans = BanManager(self.server, file=os.path.join(directory.name, 'banlist.json'))
+
+        with patch.object(self.server, 'ban_manager', bans), \
+             patch.dict(self.server.hdid_list, {'BANNEDHDID': [1111, 2222, 1111]}):
+            self.c1.ooc('/banhdid BANNEDHDID')
+            self.c1.assert_ooc('You banned HDID `BANNEDHDID`. As a result, 0 clients were kicked '
+                               'as well.', over=True)
+            self.c0.discard_all()
+            self.c2.discard_all()
+            self.c3.discard_all()
+
+            self.assertTrue(bans.is_hdid_banned('BANNEDHDID'))
+            self.assertTrue(bans.is_banned(1111))
+            self.assertTrue(bans.is_banned(2222))
+
+            self.c1.ooc('/banhdid BANNEDHDID')
+            self.c1.assert_ooc('Player is already banned.', over=True)
+
+            self.c1.ooc('/unbanhdid BANNEDHDID')
+            self.c1.discard_all()
+            self.c0.discard_all()
+            self.c2.discard_all()
+            self.c3.discard_all()
+            self.assertFalse(bans.is_hdid_banned('BANNEDHDID'))
+            self.assertFalse(bans.is_banned(1111))
+            self.assertFalse(bans.is_banned(2222))
+
+class TestBanManager_03_BanLength(_TestSituation4Mc1Gc2):
+    def test_01_banlength(self):
+        """
+        Situation: C1 bans an IPID and an HDID for a while. The bans expire after that long.
+        """
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        bans = BanManager(self.server, file=os.path.join(directory.name, 'banlist.json'))
+
+        with patch.object(self.server, 'ban_manager', bans), \
+             patch.dict(self.server.hdid_list, {'BANNEDHDID': [1111]}):
+            now = time.time()
+            with patch('time.time', return_value=now):
+                self.c1.ooc('/ban 1234 30m')
+                self.c1.assert_ooc('You banned `1234` for 30m. As a result, 0 clients were kicked '
+                                   'as well.', over=True)
+                self.c1.ooc('/banhdid BANNEDHDID 2d')
+                self.c1.assert_ooc('You banned HDID `BANNEDHDID` for 2d. As a result, 0 clients '
+                                   'were kicked as well.', over=True)
+            self.c0.discard_all()
+            self.c2.discard_all()
+            self.c3.discard_all()
+
+            self.assertEqual(bans.ipid_bans, {1234: now+1800, 1111: now+172800})
+            self.assertEqual(bans.hdid_bans, {'BANNEDHDID': now+172800})
+            with patch('time.time', return_value=now+1800):
+                self.assertFalse(bans.is_banned(1234))
+                self.assertTrue(bans.is_hdid_banned('BANNEDHDID'))
+
+    def test_02_badlength(self):
+        """
+        Situation: C1 attempts to ban an IPID with an invalid length. Nobody is banned.
+        """
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        bans = BanManager(self.server, file=os.path.join(directory.name, 'banlist.json'))
+
+        with patch.object(self.server, 'ban_manager', bans):
+            for length in ['7w', 'd']:
+                self.c1.ooc('/ban 1234 {}'.format(length))
+                self.c1.assert_ooc('Expected ban length, such as 30m, 12h or 7d.', over=True)
+            for length in ['0h', '-2d']:
+                self.c1.ooc('/ban 1234 {}'.format(length))
+                self.c1.assert_ooc('Expected positive ban length.', over=True)
+            self.c1.ooc('/ban 1234 7d extra')
+            self.c1.assert_ooc('This command has from 1 to 2 arguments.', over=True)
+        self.assertEqual(bans.ipid_bans, dict())
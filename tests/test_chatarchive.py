@@ -0,0 +1,172 @@
+import asyncio
+import calendar
+import os
+import tempfile
+import unittest
+
+from unittest.mock import Mock, patch
+
+from server import chat_archive, logger
+from server.chat_archive import ChatArchive
+
+from .structures import _TestSituation4Mc1Gc2
+
+class _TestChatArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.archive = ChatArchive(self.directory.name)
+        self.area = Mock(id=3)
+
+    @staticmethod
+    def make_client(ipid):
+        client = Mock(ipid=ipid, id=ipid % 10)
+        client.name = 'Name{}'.format(ipid)
+        client.get_char_name.return_value = 'Char{}'.format(ipid)
+        return client
+
+class TestChatArchive_01_Search(_TestChatArchive):
+    def test_01_recordsearch(self):
+        """
+        Situation: Entries of two players are recorded, and the history of each is looked up.
+        """
+
+        c1, c2 = self.make_client(1), self.make_client(2)
+        self.archive.record('IC', c1, self.area, 'Hello')
+        self.archive.record('OOC', c2, self.area, 'Hi')
+        self.archive.record('SHOUT', c1, self.area, 'HELLO THERE')
+        self.archive.record('DICE', c1, self.area, 'rolled 4')
+
+        entries = self.archive.search(1).result()
+        self.assertEqual([(e['type'], e['text']) for e in entries],
+                         [('IC', 'Hello'), ('SHOUT', 'HELLO THERE'), ('DICE', 'rolled 4')])
+        self.assertEqual(entries[0]['area'], 3)
+        self.assertEqual(entries[0]['char'], 'Char1')
+        self.assertEqual(entries[0]['name'], 'Name1')
+
+        entries = self.archive.search(2).result()
+        self.assertEqual([e['text'] for e in entries], ['Hi'])
+        self.assertEqual(self.archive.search(3).result(), [])
+
+        entries = self.archive.search(1, text='hello').result()
+        self.assertEqual([e['text'] for e in entries], ['Hello', 'HELLO THERE'])
+        entries = self.archive.search(1, limit=2).result()
+        self.assertEqual([e['text'] for e in entries], ['HELLO THERE', 'rolled 4'])
+
+        # Entries recorded after the first search are found as well
+        self.archive.record('IC', c2, self.area, 'Bye')
+        entries = self.archive.search(2).result()
+        self.assertEqual([e['text'] for e in entries], ['Hi', 'Bye'])
+
+    def test_02_reload(self):
+        """
+        Situation: The server restarts, and entries archived before the restart are looked up.
+        """
+
+        c1 = self.make_client(1)
+        self.archive.record('IC', c1, self.area, 'Before')
+        self.archive.flush()
+
+        archive = ChatArchive(self.directory.name)
+        archive.record('IC', c1, self.area, 'After')
+        entries = archive.search(1).result()
+        self.assertEqual([e['text'] for e in entries], ['Before', 'After'])
+
+    def test_03_disabled(self):
+        """
+        Situation: Nothing is recorded if the archive is disabled.
+        """
+
+        archive = ChatArchive(self.directory.name, enabled=False)
+        archive.record('IC', self.make_client(1), self.area, 'Hello')
+        self.assertEqual(archive.search(1).result(), [])
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+class TestChatArchive_02_Segments(_TestChatArchive):
+    def test_01_monthrollover(self):
+        """
+        Situation: Entries are recorded right before and after a month starts in UTC. They are
+        archived in the segments of their UTC months, and looked up across both segments.
+        """
+
+        c1 = self.make_client(1)
+        month_start = calendar.timegm((2026, 2, 1, 0, 0, 0))
+        for (moment, text) in [(month_start - 1, 'January'), (month_start, 'February'),
+                               (month_start + 1, 'Also February')]:
+            with patch.object(chat_archive.time, 'time', return_value=moment):
+                self.archive.record('IC', c1, self.area, text)
+
+        self.archive.flush()
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['2026-01.idx', '2026-01.jsonl', '2026-02.idx', '2026-02.jsonl'])
+        with open(os.path.join(self.directory.name, '2026-01.jsonl'), encoding='utf-8') as segment:
+            self.assertEqual(len(segment.readlines()), 1)
+
+        entries = self.archive.search(1).result()
+        self.assertEqual([e['text'] for e in entries], ['January', 'February', 'Also February'])
+        entries = self.archive.search(1, limit=2).result()
+        self.assertEqual([e['text'] for e in entries], ['February', 'Also February'])
+        entries = self.archive.search(1, text='january').result()
+        self.assertEqual([e['text'] for e in entries], ['January'])
+
+    def test_02_formatentry(self):
+        """
+        Situation: An entry recorded right before a month starts in UTC is described. Its time is
+        given in UTC, matching the segment it is archived in.
+        """
+
+        c1 = self.make_client(1)
+        month_start = calendar.timegm((2026, 2, 1, 0, 0, 0))
+        with patch.object(chat_archive.time, 'time', return_value=month_start - 1):
+            self.archive.record('IC', c1, self.area, 'January')
+
+        entry = self.archive.search(1).result()[0]
+        self.assertEqual(self.archive.format_entry(entry),
+                         '2026-01-31 23:59:59 UTC | [IC][3] [1] Char1 (Name1): January')
+
+class TestChatArchive_03_ChatHistory(_TestSituation4Mc1Gc2):
+    def test_01_chathistory(self):
+        """
+        Situation: C1 looks up the chat history of C0, which is done in the background.
+        """
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive = ChatArchive(directory.name)
+
+        with patch.object(self.server, 'chat_archive', archive):
+            self.area0.add_to_shoutlog(self.c0, 'Over here!')
+            self.c1.ooc('/chat_history {}'.format(self.c0.ipid))
+            self.c1.assert_no_ooc()
+
+            archive.flush()
+            for _ in range(3):
+                self.server.loop.run_until_complete(asyncio.sleep(0))
+
+            entry = archive.search(self.c0.ipid).result()[0]
+            self.c1.assert_ooc('== Chat history of IPID {} ==\r\n*{}'
+                               .format(self.c0.ipid, archive.format_entry(entry)), over=True)
+            self.assertEqual(entry['type'], 'SHOUT')
+            self.assertEqual(entry['text'], 'Over here!')
+
+    def test_02_searcherror(self):
+        """
+        Situation: C1 looks up the chat history of C0, but the search fails. C1 is told so.
+        """
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive = ChatArchive(directory.name)
+
+        with patch.object(self.server, 'chat_archive', archive), \
+             patch.object(archive, '_search', side_effect=OSError('Disk on fire')), \
+             patch.object(logger, 'log_pdebug') as log_pdebug:
+            self.c1.ooc('/chat_history {}'.format(self.c0.ipid))
+            archive.flush()
+            for _ in range(3):
+                self.server.loop.run_until_complete(asyncio.sleep(0))
+
+        self.c1.assert_ooc('Unable to look up the chat history of IPID {}.'.format(self.c0.ipid),
+                           over=True)
+        log_pdebug.assert_called_once_with('Unable to search the chat archive: OSError: Disk on '
+                                           'fire')
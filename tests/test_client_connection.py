@@ -1,3 +1,8 @@
+import unittest
+from unittest.mock import patch
+
+from server.client_manager import _ConnectionLimiter
+
 from .structures import _Unittest
 
 class TestClientConnection(_Unittest):
@@ -353,3 +358,94 @@ class TestClientConnection(_Unittest):
         self.server.make_clients(105)
         self.assertEqual(len(self.server.client_manager.clients), 100)
         self.assertEqual(self.server.get_player_count(), 100)
+
+class TestClientConnection_02_IDs(_Unittest):
+    def test_01_lowestfreeid(self):
+        """
+        Situation: Three clients connect and get IDs 0, 1 and 2. The client with ID 1 leaves, and
+        the next two clients to connect get IDs 1 and 3.
+        """
+
+        clients = [self.server.create_client() for _ in range(3)]
+        self.assertEqual([c.id for c in clients], [0, 1, 2])
+        clients[1].disconnect()
+
+        clients.append(self.server.create_client())
+        clients.append(self.server.create_client())
+        self.assertEqual([c.id for c in clients[3:]], [1, 3])
+
+        for c in clients:
+            c.discard_all()
+            if c is not clients[1]:
+                c.disconnect()
+
+    def test_02_playerlimit(self):
+        """
+        Situation: The player limit is 2, and two clients are connected. A third client is turned
+        away without getting an ID, and once one client leaves, their ID is handed out again.
+        """
+
+        client_manager = self.server.client_manager
+        playerlimit = self.server.config['playerlimit']
+        self.server.config['playerlimit'] = 2
+        self.addCleanup(self.server.config.__setitem__, 'playerlimit', playerlimit)
+
+        clients = [self.server.create_client() for _ in range(2)]
+        self.assertEqual({c.id for c in clients}, {0, 1})
+        self.assertEqual(client_manager._take_id(), -1)
+
+        turned_away = self.server.create_client()
+        self.assertEqual(turned_away.id, -1)
+        turned_away.assert_packet('PN', (0, 2), somewhere=True)
+        self.assertNotIn(turned_away, client_manager.clients)
+
+        clients[0].disconnect()
+        self.assertEqual(client_manager._take_id(), 0)
+        self.assertEqual(client_manager._take_id(), -1)
+        turned_away.discard_all()
+        clients[0].discard_all()
+        clients[1].discard_all()
+        clients[1].disconnect()
+
+class TestClientConnection_03_Limiter(unittest.TestCase):
+    def admit_at(self, limiter, moment, ip='1.1.1.1'):
+        with patch('server.client_manager.time.monotonic', return_value=moment):
+            return limiter.admit(ip, 3, 30)
+
+    def test_01_burstrefill(self):
+        """
+        Situation: An IP address connects in a burst until they are refused. They regain one
+        connection every 10 seconds, up to three connections. Other IP addresses are unaffected.
+        """
+
+        limiter = _ConnectionLimiter()
+        self.assertEqual([self.admit_at(limiter, 0) for _ in range(4)], [True]*3 + [False])
+        self.assertTrue(self.admit_at(limiter, 0, ip='2.2.2.2'))
+        self.assertFalse(self.admit_at(limiter, 9))
+        self.assertTrue(self.admit_at(limiter, 10))
+        self.assertFalse(self.admit_at(limiter, 10))
+
+        # After a long wait, only three connections are regained
+        self.assertEqual([self.admit_at(limiter, 1000) for _ in range(4)], [True]*3 + [False])
+        self.assertTrue(limiter.admit('1.1.1.1', 3, 0))
+
+    def test_02_prune(self):
+        """
+        Situation: Enough IP addresses connect to reach the pruning size. Those that regained
+        every connection by then are forgotten, while the rest are still limited.
+        """
+
+        limiter = _ConnectionLimiter()
+        limiter.PRUNE_SIZE = 4
+        limiter._prune_at = 4
+        for _ in range(3):
+            self.assertTrue(self.admit_at(limiter, 0))
+        self.assertTrue(self.admit_at(limiter, 0, ip='2.2.2.2'))
+        self.assertTrue(self.admit_at(limiter, 20, ip='3.3.3.3'))
+        self.assertEqual(len(limiter._buckets), 3)
+
+        self.assertTrue(self.admit_at(limiter, 20, ip='4.4.4.4'))
+        self.assertEqual(set(limiter._buckets), {'1.1.1.1', '3.3.3.3', '4.4.4.4'})
+        self.assertEqual(limiter._prune_at, 6)
+        # 1.1.1.1 regained two of their connections, but not all of them
+        self.assertEqual([self.admit_at(limiter, 20) for _ in range(3)], [True, True, False])
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+from server.config_store import ConfigStore
+from server.exceptions import ServerError
+
+class TestConfigStore_01_Load(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.file = os.path.join(self.directory.name, 'music.yaml')
+        self.store = ConfigStore()
+
+    def write(self, contents, mtime_ns=None):
+        with open(self.file, 'w', encoding='utf-8') as yaml_file:
+            yaml_file.write(contents)
+        if mtime_ns is not None:
+            os.utime(self.file, ns=(mtime_ns, mtime_ns))
+
+    def test_01_cached(self):
+        """
+        Situation: A file is loaded several times without changing. The same document is returned
+        each time.
+        """
+
+        self.write('- a\n- b\n')
+        document = self.store.load(self.file)
+        self.assertEqual(document, ['a', 'b'])
+        self.assertIs(self.store.load(self.file), document)
+        self.assertIs(self.store.load(self.file), document)
+
+        # Rewriting the same contents with the same modification time is not a change
+        self.write('- a\n- b\n', mtime_ns=os.stat(self.file).st_mtime_ns)
+        self.assertIs(self.store.load(self.file), document)
+
+    def test_02_mtimechanged(self):
+        """
+        Situation: A file is changed without changing its size, but its modification time
+        changes. It is parsed again.
+        """
+
+        self.write('- a\n- b\n', mtime_ns=1_000_000_000)
+        document = self.store.load(self.file)
+
+        self.write('- c\n- d\n', mtime_ns=2_000_000_000)
+        new_document = self.store.load(self.file)
+        self.assertEqual(new_document, ['c', 'd'])
+        self.assertIsNot(new_document, document)
+        self.assertIs(self.store.load(self.file), new_document)
+
+    def test_03_sizechanged(self):
+        """
+        Situation: A file is changed, keeping its modification time, but its size changes. It is
+        parsed again.
+        """
+
+        self.write('- a\n- b\n', mtime_ns=1_000_000_000)
+        document = self.store.load(self.file)
+
+        self.write('- a\n- b\n- c\n', mtime_ns=1_000_000_000)
+        new_document = self.store.load(self.file)
+        self.assertEqual(new_document, ['a', 'b', 'c'])
+        self.assertIsNot(new_document, document)
+
+    def test_04_errors(self):
+        """
+        Situation: A missing file and an invalid file are loaded. Errors are raised, and a
+        previously loaded document is not returned for the invalid file.
+        """
+
+        with self.assertRaises(ServerError) as context:
+            self.store.load(os.path.join(self.directory.name, 'missing.yaml'))
+        self.assertEqual(context.exception.code, 'FileNotFound')
+
+        self.write('- a\n', mtime_ns=1_000_000_000)
+        self.store.load(self.file)
+        self.write('- a\n  b: [\n', mtime_ns=2_000_000_000)
+        self.assertRaises(ServerError.YAMLInvalidError, self.store.load, self.file)
@@ -0,0 +1,108 @@
+from unittest.mock import Mock, patch
+
+from server import logger
+from server.aoprotocol import AOProtocol
+
+from .structures import _Unittest
+
+class _RecordingDispatcher(dict):
+    """
+    Packet dispatcher that records every packet it is asked to handle.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.received = list()
+
+    def __missing__(self, cmd):
+        return lambda protocol, args: self.received.append((cmd, args))
+
+class TestFramer_01_Messages(_Unittest):
+    def setUp(self):
+        self.protocol = AOProtocol(self.server)
+        self.protocol.client = Mock()
+        self.protocol.net_cmd_dispatcher = _RecordingDispatcher()
+        self.received = self.protocol.net_cmd_dispatcher.received
+
+    def test_01_splitpacket(self):
+        """
+        Situation: Packets arrive split across several chunks, including between the two
+        characters of the delimiter. Each is handled once complete.
+        """
+
+        self.protocol.data_received(b'HI#a#%ID#1')
+        self.assertEqual(self.received, [('HI', ['a'])])
+        self.protocol.data_received(b'#2#%CH#0#')
+        self.assertEqual(self.received, [('HI', ['a']), ('ID', ['1', '2'])])
+        self.protocol.data_received(b'%CT#n#')
+        self.assertEqual(self.received[2:], [('CH', ['0'])])
+        self.protocol.data_received(b'hi#%')
+        self.assertEqual(self.received[3:], [('CT', ['n', 'hi'])])
+        self.assertEqual(self.protocol.buffer, b'')
+        self.protocol.client.disconnect.assert_not_called()
+
+    def test_02_nomessage(self):
+        """
+        Situation: A chunk without any complete packet arrives. As clients following the protocol
+        never send those, the client is disconnected.
+        """
+
+        with patch.object(logger, 'log_server') as log_server:
+            self.protocol.data_received(b'GET / HTTP/1.1')
+        self.protocol.client.disconnect.assert_called_once_with()
+        self.assertIn('(packet syntax unrecognized)', log_server.call_args[0][0])
+        self.assertEqual(self.received, [])
+
+    def test_03_severalpackets(self):
+        """
+        Situation: Several packets, and the start of another, arrive in a single chunk. Null bytes
+        are dropped and invalid UTF-8 is ignored.
+        """
+
+        self.protocol.data_received(b'HI#a#%ID#1#2#%\0CT#n#h\xffi#%MS#')
+        self.assertEqual(self.received, [('HI', ['a']), ('ID', ['1', '2']),
+                                         ('CT', ['n', 'hi'])])
+        self.assertEqual(self.protocol.buffer, b'MS#')
+
+        self.protocol.data_received(b'#%')
+        self.assertEqual(self.received[-1], ('MS', ['']))
+        self.assertEqual(self.protocol.buffer, b'')
+
+    def test_04_bufferlimit(self):
+        """
+        Situation: Data keeps arriving after a packet without a delimiter, until there is more
+        than the buffer limit waiting. The client is disconnected without looking for packets.
+        """
+
+        self.protocol.data_received(b'HI#a#%CT#' + b'x' * (AOProtocol.BUFFER_LIMIT - 9))
+        self.assertEqual(self.received, [('HI', ['a'])])
+        self.assertEqual(len(self.protocol.buffer), AOProtocol.BUFFER_LIMIT - 6)
+        self.protocol.client.disconnect.assert_not_called()
+
+        with patch.object(logger, 'log_server') as log_server:
+            self.protocol.data_received(b'x' * 6 + b'#%')
+        self.protocol.client.disconnect.assert_called_once_with()
+        self.assertIn('(packet too long)', log_server.call_args[0][0])
+        self.assertEqual(self.received, [('HI', ['a'])])
+
+    def test_05_askchar2(self):
+        """
+        Situation: An old client asks for the character list with a packet not terminated with
+        the usual delimiter. It is still handled.
+        """
+
+        self.protocol.data_received(AOProtocol.ASKCHAR2)
+        self.assertEqual(self.received, [('askchar2', [''])])
+        self.assertEqual(self.protocol.buffer, b'')
+        self.protocol.client.disconnect.assert_not_called()
+
+    def test_06_tooshort(self):
+        """
+        Situation: A client sends a packet shorter than any valid one. They are disconnected.
+        """
+
+        with patch.object(logger, 'log_server') as log_server:
+            self.protocol.data_received(b'H#%HI#a#%')
+        self.protocol.client.disconnect.assert_called_once_with()
+        self.assertIn('(packet too short)', log_server.call_args[0][0])
+        self.assertEqual(self.received, [])
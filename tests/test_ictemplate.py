@@ -0,0 +1,77 @@
+from .structures import _TestSituation6
+
+class _TestICTemplate(_TestSituation6):
+    """
+    All clients are in area 0, and only C3 wants to see shownames.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for c in cls.clients[:6]:
+            c.show_shownames = False
+        cls.c3.show_shownames = True
+        cls.c0.showname = 'Sender'
+
+    def make_template(self, msg):
+        params = {'msg': msg, 'folder': self.c0.char_folder, 'anim': 'happy', 'pos': 'wit',
+                  'cid': self.c0.char_id, 'showname': 'Default'}
+        return self.server.client_manager.ICTemplate(params=params)
+
+    def send_template(self, template, sender):
+        expected_pargs = dict(template.get_pargs(sender))
+        for c in self.clients[:6]:
+            c.send_ic(sender=sender, template=template)
+        self.assertEqual(template.get_pargs(sender), expected_pargs)
+
+class TestICTemplate_01_Receivers(_TestICTemplate):
+    def test_01_specialreceivers(self):
+        """
+        Situation: C0 has global IC prefix >> and sends a message with it through a template
+        shared by everyone. C0 is in first person mode, C1 is blind, C2 is deaf and C3 sees
+        shownames. Each of them gets their own version of the message, everyone but C0 gets it
+        without the prefix, and the shared template is unchanged.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        c0.multi_ic_pre = '>>'
+        c1.is_blind = True
+        c2.is_deaf = True
+        c0.first_person = True
+
+        template = self.make_template('>>Hello there.')
+        self.send_template(template, c0)
+
+        c0.assert_ic('>>Hello there.', anim='../../misc/blank', showname='Default', over=True)
+        c1.assert_packet('BN', None, somewhere=True)
+        c1.assert_ic('Hello there.', anim='../../misc/blank', showname='Default', over=True)
+        c2.assert_ic('(Your ears are ringing)', anim='happy', showname='Default', over=True)
+        c3.assert_ic('Hello there.', anim='happy', showname='Sender', over=True)
+        for c in [c4, c5]:
+            c.assert_ic('Hello there.', anim='happy', showname='Default', over=True)
+
+        c0.multi_ic_pre = ''
+        c1.is_blind = False
+        c2.is_deaf = False
+        c0.first_person = False
+
+    def test_02_ordinaryreceivers(self):
+        """
+        Situation: C0 sends a message without a prefix through a template shared by everyone.
+        C3 sees shownames and gets their own version of the message, while everyone else gets the
+        message the template prepared once.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        template = self.make_template('Hello again.')
+        self.send_template(template, c0)
+
+        for c in [c0, c1, c2, c4, c5]:
+            c.assert_ic('Hello again.', anim='happy', showname='Default', over=True)
+        c3.assert_ic('Hello again.', anim='happy', showname='Sender', over=True)
+
+        shared_pargs, _ = template.get_prepared(c0)
+        for c in [c1, c2, c4, c5]:
+            self.assertIs(c.last_ic_notme[1], shared_pargs)
+        self.assertIsNot(c3.last_ic_notme[1], shared_pargs)
+        self.assertEqual(c3.last_ic_notme[1]['showname'], 'Sender')
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from server.id_store import IDStore, submit_write
+
+class _TestIDStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.file = os.path.join(self.directory.name, 'ids.json')
+
+    @staticmethod
+    def wait_writes():
+        submit_write(lambda: None).result()
+
+    def read_file(self):
+        with open(self.file, encoding='utf-8') as whole_list:
+            return json.load(whole_list)
+
+    def read_journal(self):
+        with open('{}.journal'.format(self.file), encoding='utf-8') as journal:
+            return [json.loads(line) for line in journal]
+
+class TestIDStore_01_Journal(_TestIDStore):
+    def test_01_replay(self):
+        """
+        Situation: A store is loaded from its JSON file and a journal with a partly written last
+        entry. The complete journal entries are applied on top of the JSON file.
+        """
+
+        with open(self.file, 'w', encoding='utf-8') as whole_list:
+            json.dump({'a': [1], 'b': [2]}, whole_list)
+        with open('{}.journal'.format(self.file), 'w', encoding='utf-8') as journal:
+            journal.write('["a", 3]\n["b", 2]\n["c", 4]\n["d", ')
+
+        store = IDStore(self.file, multivalued=True)
+        self.assertEqual(store.load(), {'a': [1, 3], 'b': [2], 'c': [4]})
+        self.assertIs(store.load(), store.data)
+
+    def test_02_add(self):
+        """
+        Situation: Entries are added to a store. They are appended to the journal, and a store
+        loaded afterwards has them.
+        """
+
+        with open(self.file, 'w', encoding='utf-8') as whole_list:
+            json.dump({'a': 1}, whole_list)
+        store = IDStore(self.file)
+        store.load()
+        store.add('b', 2)
+        store.add('a', 3)
+        self.wait_writes()
+
+        self.assertEqual(store.data, {'a': 3, 'b': 2})
+        self.assertEqual(self.read_file(), {'a': 1})
+        self.assertEqual(self.read_journal(), [['b', 2], ['a', 3]])
+        self.assertEqual(IDStore(self.file).load(), {'a': 3, 'b': 2})
+
+class TestIDStore_02_Compaction(_TestIDStore):
+    def test_01_compact(self):
+        """
+        Situation: Enough entries are added to a store that its journal is merged into its JSON
+        file. Later entries go to the emptied journal.
+        """
+
+        store = IDStore(self.file, multivalued=True, compact_every=3)
+        store.add('a', 1)
+        store.add('a', 2)
+        store.add('b', 3)
+        self.wait_writes()
+        store.add('b', 4)
+        self.wait_writes()
+
+        self.assertEqual(self.read_file(), {'a': [1, 2], 'b': [3]})
+        self.assertEqual(self.read_journal(), [['b', 4]])
+        self.assertEqual(IDStore(self.file, multivalued=True).load(), {'a': [1, 2], 'b': [3, 4]})
+
+        store.close()
+        self.assertEqual(self.read_file(), {'a': [1, 2], 'b': [3, 4]})
+        self.assertEqual(self.read_journal(), [])
+
+    def test_02_snapshotinwriter(self):
+        """
+        Situation: A store is compacted while the writer thread is busy, and an entry is added
+        before the writer gets to it. The contents are copied when the writer gets to them, and
+        the entry added in the meantime is in both the JSON file and the journal.
+        """
+
+        store = IDStore(self.file, multivalued=True)
+        store.add('a', 1)
+        release = threading.Event()
+        submit_write(release.wait)
+        store.compact()
+        store.add('a', 2)
+        release.set()
+        self.wait_writes()
+
+        self.assertEqual(self.read_file(), {'a': [1, 2]})
+        self.assertEqual(self.read_journal(), [['a', 2]])
+        self.assertEqual(IDStore(self.file, multivalued=True).load(), {'a': [1, 2]})
@@ -0,0 +1,54 @@
+import unittest
+
+from server.tsuserver import TsuserverDR
+
+from .structures import _TestSituation4
+
+class TestIniswaps_01_Table(unittest.TestCase):
+    def test_01_groups(self):
+        """
+        Situation: An iniswap table is built from groups of mutually permissible iniswaps, where
+        Spam_HD is part of two groups. Every character may iniswap to every folder of the groups
+        they are part of, but not to folders that are only grouped with them through others.
+        """
+
+        table = TsuserverDR.build_iniswap_table([['Phantom_HD', 'Spam_HD', 'Persona1'],
+                                                 ['Persona2', 'Eggs_HD'],
+                                                 ['Spam_HD', 'Eggs_HD']])
+        self.assertEqual(table, {
+            'Phantom_HD': {'Phantom_HD', 'Spam_HD', 'Persona1'},
+            'Spam_HD': {'Phantom_HD', 'Spam_HD', 'Persona1', 'Eggs_HD'},
+            'Persona1': {'Phantom_HD', 'Spam_HD', 'Persona1'},
+            'Persona2': {'Persona2', 'Eggs_HD'},
+            'Eggs_HD': {'Persona2', 'Eggs_HD', 'Spam_HD'},
+            })
+
+    def test_02_empty(self):
+        """
+        Situation: An iniswap table is built from no groups, or from empty groups. Nobody may
+        iniswap.
+        """
+
+        self.assertEqual(TsuserverDR.build_iniswap_table([]), dict())
+        self.assertEqual(TsuserverDR.build_iniswap_table([[]]), dict())
+
+class TestIniswaps_02_IsIniswap(_TestSituation4):
+    def test_01_allowediniswaps(self):
+        """
+        Situation: C0's character may iniswap to Spam_HD. Messages with C0's character folder or
+        Spam_HD are not iniswaps, while messages with other folders or with animations outside
+        the folder are.
+        """
+
+        old_table = self.server.iniswap_table
+        self.addCleanup(setattr, self.server, 'iniswap_table', old_table)
+        self.server.iniswap_table = TsuserverDR.build_iniswap_table([[self.c0_cname, 'Spam_HD']])
+
+        area = self.c0.area
+        self.assertFalse(area.is_iniswap(self.c0, '-', 'happy', self.c0_cname))
+        self.assertFalse(area.is_iniswap(self.c0, '-', 'happy', 'Spam_HD'))
+        self.assertTrue(area.is_iniswap(self.c0, '-', 'happy', 'Eggs_HD'))
+        self.assertTrue(area.is_iniswap(self.c0, '-', '../../misc/happy', 'Spam_HD'))
+        self.assertTrue(area.is_iniswap(self.c0, '../../misc/pre', 'happy', 'Spam_HD'))
+        # Other characters are not part of the group
+        self.assertTrue(area.is_iniswap(self.c1, '-', 'happy', 'Spam_HD'))
@@ -0,0 +1,67 @@
+from .structures import _TestSituation4
+
+class TestLazyAttributes_01_Build(_TestSituation4):
+    def test_01_firstaccess(self):
+        """
+        Situation: A new client connects. Their lazily built attributes are not built until they
+        are first accessed, and are the same objects on later accesses.
+        """
+
+        joining = self.server.create_client()
+        self.addCleanup(joining.disconnect)
+        joining.discard_all()
+
+        lazy_names = ['area_changer', 'evi_list', 'followedby', 'showname_history', 'dicelog',
+                      'mus_change_time']
+        for name in lazy_names:
+            self.assertFalse(hasattr(joining, '_{}'.format(name)), name)
+
+        self.assertEqual(joining.evi_list, list())
+        self.assertEqual(joining.followedby, set())
+        self.assertEqual(joining.showname_history, list())
+        self.assertEqual(joining.dicelog.maxlen, 20)
+        self.assertIs(joining.area_changer.client, joining)
+        self.assertEqual(joining.mus_change_time,
+                         [x * joining.mflood_interval for x in range(joining.mflood_times)])
+        for name in lazy_names:
+            self.assertTrue(hasattr(joining, '_{}'.format(name)), name)
+            self.assertIs(getattr(joining, name), getattr(joining, name), name)
+
+    def test_02_set(self):
+        """
+        Situation: C0's evidence list is set before it was ever built. The set value is kept.
+        """
+
+        evi_list = [1, 2]
+        self.c0.evi_list = evi_list
+        self.assertIs(self.c0.evi_list, evi_list)
+
+class TestLazyAttributes_02_Sources(_TestSituation4):
+    def test_01_sourcechange(self):
+        """
+        Situation: C0's music flood guard allows more changes over a longer interval. Their music
+        change timestamps are built again for the new flood guard, and C0 can still change music.
+        """
+
+        c0 = self.c0
+        self.addCleanup(setattr, c0, 'mflood_times', c0.mflood_times)
+        self.addCleanup(setattr, c0, 'mflood_interval', c0.mflood_interval)
+
+        old_mus_change_time = c0.mus_change_time
+        self.assertIs(c0.mus_change_time, old_mus_change_time)
+
+        c0.mflood_times += 2
+        self.assertIsNot(c0.mus_change_time, old_mus_change_time)
+        self.assertEqual(len(c0.mus_change_time), len(old_mus_change_time) + 2)
+
+        c0.mflood_interval += 1
+        self.assertEqual(c0.mus_change_time,
+                         [x * c0.mflood_interval for x in range(c0.mflood_times)])
+        self.assertEqual(c0.change_music_cd(), 0)
+
+        # Values set after the source changed are kept until the source changes again
+        c0.mus_change_time = [0] * c0.mflood_times
+        self.assertEqual(c0.mus_change_time, [0] * c0.mflood_times)
+        c0.mflood_times -= 2
+        self.assertEqual(c0.mus_change_time,
+                         [x * c0.mflood_interval for x in range(c0.mflood_times)])
@@ -0,0 +1,142 @@
+import logging
+import os
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+from server import logger
+
+from .structures import _TestSituation4
+
+class TestLogger_01_ErrorDump(_TestSituation4):
+    def test_01_dumpatreporttime(self):
+        """
+        Situation: An error log is written in the background while a client disconnects. The log
+        shows the clients as they were when the error was reported.
+        """
+
+        submitted = list()
+        with patch.object(logger._ERROR_WRITER, 'submit',
+                          side_effect=lambda *args: submitted.append(args)):
+            logger.log_error('Something broke.', self.server, errortype='C', wait=False)
+
+        self.assertEqual(len(submitted), 1)
+        _, _, record, snapshot = submitted[0]
+        client_strings = [str(c) for c in self.clients[:4]]
+        self.clients[3].disconnect()
+
+        dump = logger._format_error_dump(record.msg, snapshot)
+        self.assertTrue(dump.startswith('Something broke.'))
+        self.assertIn('*Number of clients: 4', dump)
+        for client_string in client_strings:
+            self.assertIn('\n***{}'.format(client_string), dump)
+
+    def test_02_plainsnapshot(self):
+        """
+        Situation: An error log is requested. Only plain data is copied from the clients and areas
+        before it is handed to the background writer.
+        """
+
+        snapshot = logger._snapshot_server(self.server)
+        self.assertEqual([c['id'] for c in snapshot['clients']],
+                         sorted(c.id for c in self.server.client_manager.clients))
+        for area_id, area_name, client_ids in snapshot['areas']:
+            self.assertIsInstance(area_id, int)
+            self.assertIsInstance(area_name, str)
+            self.assertTrue(all(isinstance(client_id, int) for client_id in client_ids))
+        for client in snapshot['clients']:
+            for value in client.values():
+                self.assertIsInstance(value, (int, str, bool, tuple, type(None)))
+
+    def test_03_noserver(self):
+        """
+        Situation: An error happens before the server finished loading.
+        """
+
+        dump = logger._format_error_dump('Something broke.', logger._snapshot_server(None))
+        self.assertEqual(dump, 'Something broke.\nServer was not initialized, so client and '
+                               'area dumps could not be generated.')
+
+class TestLogger_02_QueuedLogHandler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.file = os.path.join(self.directory.name, 'server.log')
+
+    @staticmethod
+    def make_record(msg):
+        return logging.makeLogRecord({'msg': msg, 'levelno': logging.INFO,
+                                      'levelname': 'INFO'})
+
+    def test_01_writeclose(self):
+        """
+        Situation: Records are logged, and then the handler is closed. The records are written to
+        the file by then.
+        """
+
+        handler = logger.QueuedLogHandler(logger.BufferedFileHandler(self.file, delay=True))
+        handler.handle(self.make_record('First'))
+        handler.handle(self.make_record('Second'))
+        handler.close()
+
+        with open(self.file) as log_file:
+            self.assertEqual(log_file.read(), 'First\nSecond\n')
+
+    def test_02_afterclose(self):
+        """
+        Situation: A record is logged after the handler was closed. It is dropped, and the file is
+        not reopened.
+        """
+
+        target = logger.BufferedFileHandler(self.file, delay=True)
+        handler = logger.QueuedLogHandler(target)
+        handler.handle(self.make_record('First'))
+        handler.close()
+
+        handler.handle(self.make_record('Late'))
+        self.assertIsNone(target.stream)
+        with open(self.file) as log_file:
+            self.assertEqual(log_file.read(), 'First\n')
+
+class TestLogger_03_ErrorReports(_TestSituation4):
+    def report(self, client, cmd='CT'):
+        try:
+            raise ValueError('Something broke.')
+        except ValueError as ex:
+            with self.assertRaises(ValueError):
+                self.server.send_error_report(client, cmd, list(), ex)
+        client.discard_all()
+
+    def test_01_lasterroralways(self):
+        """
+        Situation: The same error is raised twice in a row by different clients. The second one is
+        not reported again, but /lasterror still shows it.
+        """
+
+        self.server.error_reports.clear()
+        with patch.object(logger, 'log_error') as log_error:
+            self.report(self.c0)
+            self.assertIn('*Client status: {}'.format(self.c0), self.server.last_error[0])
+            self.report(self.c1)
+            self.assertIn('*Client status: {}'.format(self.c1), self.server.last_error[0])
+
+        self.assertEqual(log_error.call_count, 1)
+        self.assertEqual(len(self.server.error_reports), 1)
+        self.assertEqual(list(self.server.error_reports.values())[0][1], 1)
+
+    def test_02_expirekeys(self):
+        """
+        Situation: An error is reported, and after its interval ran out a different error is
+        reported. Only the second one is still remembered.
+        """
+
+        self.server.error_reports.clear()
+        with patch.object(logger, 'log_error'):
+            self.report(self.c0, cmd='CT')
+            for key, (last_report, suppressed) in self.server.error_reports.items():
+                self.server.error_reports[key] = (
+                    last_report-self.server.ERROR_REPORT_INTERVAL, suppressed)
+            self.report(self.c0, cmd='MS')
+
+        self.assertEqual([key[-1] for key in self.server.error_reports], ['MS'])
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+from server.exceptions import AreaError, ServerError
+
+from .structures import _TestSituation4
+
+class TestLookups_01_Areas(_TestSituation4):
+    def test_01_byidandname(self):
+        """
+        Situation: Areas are looked up by ID, by name and by ID range. Lookups of areas that do
+        not exist fail.
+        """
+
+        area_manager = self.server.area_manager
+        for area in area_manager.areas:
+            self.assertIs(area_manager.get_area_by_id(area.id), area)
+            self.assertIs(area_manager.get_area_by_name(area.name), area)
+
+        for num in [-1, len(area_manager.areas), '0', None, [0]]:
+            self.assertRaises(AreaError, area_manager.get_area_by_id, num)
+        for name in ['Nowhere', self.area0.name.upper(), None, [self.area0.name]]:
+            self.assertRaises(AreaError, area_manager.get_area_by_name, name)
+
+        self.assertEqual(area_manager.get_areas_in_range(self.area1, self.area3),
+                         {self.area1, self.area2, self.area3})
+        self.assertEqual(area_manager.get_areas_in_range(self.area2, self.area2), {self.area2})
+        self.assertEqual(area_manager.get_areas_in_range(self.area3, self.area1), set())
+
+    def test_02_newarealist(self):
+        """
+        Situation: The area list is loaded again. Lookups find the new areas rather than the old
+        ones.
+        """
+
+        area_manager = self.server.area_manager
+        old_areas = list(area_manager.areas)
+        area_manager.load_areas()
+        for c in [self.c0, self.c1, self.c2, self.c3]:
+            c.discard_all()
+
+        for (area, old_area) in zip(area_manager.areas, old_areas):
+            self.assertIsNot(area, old_area)
+            self.assertIs(area_manager.get_area_by_id(area.id), area)
+            self.assertIs(area_manager.get_area_by_name(area.name), area)
+
+class TestLookups_02_Music(_TestSituation4):
+    def test_01_servermusiclist(self):
+        """
+        Situation: Songs and categories of the server music list are looked up. Songs come with
+        their length, or -1 if they have none, as do categories. Lookups of music that does not
+        exist fail.
+        """
+
+        self.assertEqual(self.server.get_song_data('BOX 15.mp3'), ('BOX 15.mp3', 244))
+        self.assertEqual(self.server.get_song_data('--Deadly Life--'), ('--Deadly Life--', -1))
+        self.assertEqual(self.server.get_song_data('Trial Underground.mp3', c=self.c0),
+                         ('Trial Underground.mp3', 108))
+        self.assertRaises(ServerError.MusicNotFoundError, self.server.get_song_data, 'None.mp3')
+        self.assertRaises(ServerError.MusicNotFoundError, self.server.get_song_data, 'None.mp3',
+                          c=self.c0)
+
+        # The index is only built once
+        index = self.server.get_music_index(self.server)
+        self.assertIs(self.server.get_music_index(self.server), index)
+
+    def test_02_clientmusiclist(self):
+        """
+        Situation: C0 picks a music list with a song the server music list does not have, and a
+        song it has with another length. The former is only found for C0, and for the latter the
+        server music list wins. Once C0 picks yet another music list, the index of C0's music list
+        is rebuilt.
+        """
+
+        self.c0.music_list = [{'category': '--Custom--',
+                               'songs': [{'name': 'Custom.mp3', 'length': 60},
+                                         {'name': 'BOX 15.mp3', 'length': 10}]}]
+        self.assertEqual(self.server.get_song_data('Custom.mp3', c=self.c0), ('Custom.mp3', 60))
+        self.assertEqual(self.server.get_song_data('BOX 15.mp3', c=self.c0), ('BOX 15.mp3', 244))
+        self.assertRaises(ServerError.MusicNotFoundError, self.server.get_song_data,
+                          'Custom.mp3', c=self.c1)
+        self.assertRaises(ServerError.MusicNotFoundError, self.server.get_song_data,
+                          'Custom.mp3')
+
+        self.c0.music_list = [{'category': '--Other--', 'songs': [{'name': 'Other.mp3'}]}]
+        self.assertEqual(self.server.get_song_data('Other.mp3', c=self.c0), ('Other.mp3', -1))
+        self.assertRaises(ServerError.MusicNotFoundError, self.server.get_song_data,
+                          'Custom.mp3', c=self.c0)
+
+        self.c0.music_list = None
+        self.assertRaises(ServerError.MusicNotFoundError, self.server.get_song_data,
+                          'Other.mp3', c=self.c0)
+
+    def test_03_repeatednames(self):
+        """
+        Situation: A music list has a song twice, and a song with the name of a category. The
+        earliest entry of each name is indexed.
+        """
+
+        owner = SimpleNamespace(music_list_index=None, music_list=[
+            {'category': '--A--', 'songs': [{'name': 'Song.mp3', 'length': 1},
+                                            {'name': '--B--', 'length': 2}]},
+            {'category': '--B--', 'songs': [{'name': 'Song.mp3', 'length': 3}]},
+            ])
+        self.assertEqual(self.server.get_music_index(owner), {'--A--': ('--A--', -1),
+                                                              'Song.mp3': ('Song.mp3', 1),
+                                                              '--B--': ('--B--', 2)})
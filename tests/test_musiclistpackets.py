@@ -0,0 +1,127 @@
+from unittest.mock import Mock
+
+from server.client_manager import ClientManager
+
+from .structures import _TestSituation4
+
+class _TestMusicListPackets(_TestSituation4):
+    def get_packet(self, command='FM', **kwargs):
+        return self.server.get_music_list_packet(command, from_area=self.area0, c=self.c0,
+                                                 **kwargs)
+
+    @staticmethod
+    def entry(area):
+        return '{}-{}'.format(area.id, area.name)
+
+    def expected_args(self, **kwargs):
+        return tuple(self.server.build_music_list_ao2(from_area=self.area0, c=self.c0,
+                                                      **kwargs))
+
+class TestMusicListPackets_01_Cache(_TestMusicListPackets):
+    def test_01_reused(self):
+        """
+        Situation: C0 is a player in area 0, which only reaches some areas, and gets their
+        packets several times. They are only built and encoded once.
+        """
+
+        args, data = self.get_packet()
+        self.assertEqual(args, self.expected_args())
+        self.assertEqual(data, self.server.packet_cache.encode('FM', args))
+        self.assertNotIn(self.entry(self.area2), args)
+
+        again_args, again_data = self.get_packet()
+        self.assertIs(again_args, args)
+        self.assertIs(again_data, data)
+
+        # Packets with other IDs or contents are kept apart
+        fa_args, fa_data = self.get_packet('FA', include_music=False)
+        self.assertEqual(fa_args, self.expected_args(include_music=False))
+        self.assertEqual(fa_data, self.server.packet_cache.encode('FA', fa_args))
+        self.assertIs(self.get_packet()[1], data)
+        self.assertIs(self.get_packet('FA', include_music=False)[1], fa_data)
+
+    def test_02_staff(self):
+        """
+        Situation: C1 becomes a mod. Their packet from area 0 includes every area, while C0's
+        does not.
+        """
+
+        self.c1.make_mod()
+        args, _ = self.server.get_music_list_packet('FM', from_area=self.area0, c=self.c1)
+        self.assertIn(self.entry(self.area2), args)
+        self.assertNotIn(self.entry(self.area2), self.get_packet()[0])
+
+class TestMusicListPackets_02_Invalidation(_TestMusicListPackets):
+    def test_01_reachability(self):
+        """
+        Situation: Area 0 is changed so that it only reaches area 1, and then changed back. C0's
+        packet changes both times.
+        """
+
+        old_reachable_areas = self.area0.reachable_areas
+        old_args, old_data = self.get_packet()
+
+        self.area0.reachable_areas = {self.area1.name}
+        args, data = self.get_packet()
+        self.assertEqual(args, self.expected_args())
+        self.assertNotEqual(data, old_data)
+        self.assertNotIn(self.entry(self.area3), args)
+
+        self.area0.reachable_areas = old_reachable_areas
+        self.assertEqual(self.get_packet(), (old_args, old_data))
+
+    def test_02_musiclist(self):
+        """
+        Situation: C0 picks another music list, and then goes back to the server music list. C0's
+        packet changes both times.
+        """
+
+        old_args, old_data = self.get_packet()
+
+        self.c0.music_list = self.server.load_music('config/music_lists/trial.yaml',
+                                                    server_music_list=False)
+        args, data = self.get_packet()
+        self.assertEqual(args, self.expected_args())
+        self.assertNotEqual(data, old_data)
+
+        self.c0.music_list = None
+        self.assertEqual(self.get_packet(), (old_args, old_data))
+
+    def test_03_arealist(self):
+        """
+        Situation: The area list is loaded again. C0's packet is built anew, and as the area list
+        is the same, it has the same contents.
+        """
+
+        old_args, old_data = self.get_packet()
+        self.server.area_manager.load_areas()
+        for c in [self.c0, self.c1, self.c2, self.c3]:
+            c.discard_all()
+
+        self.area0 = self.server.area_manager.get_area_by_id(0)
+        args, data = self.get_packet()
+        self.assertIsNot(args, old_args)
+        self.assertEqual((args, data), (old_args, old_data))
+
+class TestMusicListPackets_03_Transport(_TestMusicListPackets):
+    def test_01_reloadmusiclist(self):
+        """
+        Situation: A client that is not a test client reloads its music list twice. The packet
+        written to its transport both times is the cached one.
+        """
+
+        transport = Mock()
+        transport.is_closing.return_value = False
+        # Bypass the test client manager, whose clients record packets instead of encoding them
+        client = ClientManager.new_client(self.server.client_manager, transport,
+                                          client_obj=ClientManager.Client, ip='127.0.0.1')
+        self.addCleanup(self.server.client_manager.remove_client, client)
+        client.flush_output()
+        transport.write.reset_mock()
+
+        client.reload_music_list()
+        client.reload_music_list()
+        client.flush_output()
+
+        _, data = self.server.get_music_list_packet('FM', from_area=client.area, c=client)
+        transport.write.assert_called_once_with(data*2)
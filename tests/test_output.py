@@ -0,0 +1,166 @@
+from server.aoprotocol import AOProtocol
+from server.client_manager import ClientManager
+
+from .structures import _TestSituation4
+
+class _FakeTransport:
+    """
+    Transport that records the data written to it, and that calls the pause_writing and
+    resume_writing methods of its protocol as its buffer crosses the watermarks, as asyncio
+    transports do.
+    """
+
+    def __init__(self):
+        self.protocol = None
+        self.writes = list()
+        self.buffered = 0
+        self.limits = None
+        self.paused = False
+        self.closed = False
+        self.aborted = False
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.limits = (high, low)
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def write(self, data):
+        self.writes.append(data)
+        self.buffered += len(data)
+        if not self.paused and self.buffered > self.limits[0]:
+            self.paused = True
+            self.protocol.pause_writing()
+
+    def drain(self, size):
+        self.buffered = max(0, self.buffered - size)
+        if self.paused and self.buffered <= self.limits[1]:
+            self.paused = False
+            self.protocol.resume_writing()
+
+    def is_closing(self):
+        return self.closed or self.aborted
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+class TestOutput_01_Transport(_TestSituation4):
+    def setUp(self):
+        self.transport = _FakeTransport()
+        # Bypass the test client manager, whose clients record packets instead of writing them
+        self.client = ClientManager.new_client(self.server.client_manager, self.transport,
+                                               client_obj=ClientManager.Client, ip='127.0.0.1')
+        self.addCleanup(self.server.client_manager.remove_client, self.client)
+        self.protocol = AOProtocol(self.server)
+        self.protocol.client = self.client
+        self.transport.protocol = self.protocol
+        self.transport.set_write_buffer_limits(high=self.client.OUTPUT_HIGH_WATER,
+                                               low=self.client.OUTPUT_LOW_WATER)
+        self.run_loop()
+        self.transport.writes.clear()
+
+    def run_loop(self):
+        # Run one iteration of the event loop
+        self.server.loop.call_soon(self.server.loop.stop)
+        self.server.loop.run_forever()
+
+    def test_01_coalescing(self):
+        """
+        Situation: Several packets are sent to a client. They are written to the transport
+        together, once the event loop iteration ends.
+        """
+
+        self.client.send_command('HP', 1, 5)
+        self.client.send_command('HP', 2, 7)
+        self.client.send_raw_message('TI#0#%')
+        self.assertEqual(self.transport.writes, [])
+        self.assertEqual(self.client.queued_bytes, 22)
+
+        self.run_loop()
+        self.assertEqual(self.transport.writes, [b'HP#1#5#%HP#2#7#%TI#0#%'])
+        self.assertEqual(self.client.bytes_sent, 22)
+
+        self.run_loop()
+        self.assertEqual(len(self.transport.writes), 1)
+
+    def test_02_watermarks(self):
+        """
+        Situation: More than the high watermark is sent to a client. Further packets are held back
+        until the transport drains down to the low watermark.
+        """
+
+        big = 'x' * (self.client.OUTPUT_HIGH_WATER + 1)
+        self.client.send_raw_message(big)
+        self.run_loop()
+        self.assertEqual(len(self.transport.writes), 1)
+        self.assertTrue(self.client.is_output_paused)
+
+        self.client.send_command('HP', 1, 5)
+        self.run_loop()
+        self.assertEqual(len(self.transport.writes), 1)
+        self.assertEqual(self.client.queued_bytes, len(big) + 8)
+
+        # Draining to just above the low watermark is not enough
+        self.transport.drain(len(big) - self.client.OUTPUT_LOW_WATER - 1)
+        self.assertTrue(self.client.is_output_paused)
+        self.assertEqual(len(self.transport.writes), 1)
+
+        self.transport.drain(1)
+        self.assertFalse(self.client.is_output_paused)
+        self.assertEqual(self.transport.writes[1:], [b'HP#1#5#%'])
+
+    def test_03_backloglimit(self):
+        """
+        Situation: A client does not read what is sent to it while more than the backlog limit
+        is sent. The client is disconnected, and nothing is queued for it anymore.
+        """
+
+        self.protocol.pause_writing()
+        chunk = 'x' * (64 * 1024)
+        for _ in range(self.client.OUTPUT_BACKLOG_LIMIT // len(chunk)):
+            self.client.send_raw_message(chunk)
+        self.assertFalse(self.transport.aborted)
+        self.assertEqual(self.client.queued_bytes, self.client.OUTPUT_BACKLOG_LIMIT)
+
+        self.client.send_raw_message('x')
+        self.assertTrue(self.transport.aborted)
+        self.assertEqual(self.client.queued_bytes, 0)
+
+        self.client.send_raw_message(chunk)
+        self.assertEqual(self.client.queued_bytes, 0)
+        self.run_loop()
+        self.assertEqual(self.transport.writes, [])
+
+    def test_04_disconnectpaused(self):
+        """
+        Situation: A client is disconnected while packets to it are held back. They are written
+        to the transport before it is closed.
+        """
+
+        self.protocol.pause_writing()
+        self.client.send_command('HP', 1, 5)
+        self.client.disconnect()
+        self.assertEqual(self.transport.writes, [b'HP#1#5#%'])
+        self.assertTrue(self.transport.closed)
+
+        self.client.send_command('HP', 2, 7)
+        self.run_loop()
+        self.assertEqual(self.transport.writes, [b'HP#1#5#%'])
+
+class TestOutput_02_Limits(_TestSituation4):
+    def test_01_limitsset(self):
+        """
+        Situation: A client connects. The write buffer limits of its transport are set to the
+        output watermarks.
+        """
+
+        transport = _FakeTransport()
+        protocol = self.server.ao_protocol(self.server)
+        protocol.connection_made(transport, my_protocol=protocol)
+        self.addCleanup(protocol.client.disconnect)
+        protocol.client.discard_all()
+        self.assertEqual(transport.limits, (ClientManager.Client.OUTPUT_HIGH_WATER,
+                                            ClientManager.Client.OUTPUT_LOW_WATER))
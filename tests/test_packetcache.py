@@ -0,0 +1,130 @@
+import unittest
+
+from unittest.mock import Mock
+
+from server.client_manager import ClientManager
+from server.constants import PacketCache
+
+from .structures import _TestSituation4
+
+class TestPacketCache_01_Encode(unittest.TestCase):
+    def test_01_equalarguments(self):
+        """
+        Situation: Packets whose arguments compare equal but are written differently are sent
+        during a broadcast. Each is encoded as written.
+        """
+
+        cache = PacketCache()
+        with cache:
+            self.assertEqual(cache.encode('TI', (1,)), b'TI#1#%')
+            self.assertEqual(cache.encode('TI', (True,)), b'TI#True#%')
+            self.assertEqual(cache.encode('TI', (1.0,)), b'TI#1.0#%')
+            self.assertEqual(cache.encode('TI', (1,)), b'TI#1#%')
+            self.assertEqual(cache.encode_split('TI', (0, True, 2), 1), (b'TI#0#', b'#2#%'))
+            self.assertEqual(cache.encode_split('TI', (0.0, True, 2), 1), (b'TI#0.0#', b'#2#%'))
+
+        # Persistent packets are told apart the same way
+        self.assertEqual(cache.encode('OPPASS', (1,)), b'OPPASS#1#%')
+        self.assertEqual(cache.encode('OPPASS', (True,)), b'OPPASS#True#%')
+
+    def test_02_alternatingpackets(self):
+        """
+        Situation: A broadcast alternates between two packets with the same ID. Both stay cached.
+        """
+
+        cache = PacketCache()
+        with cache:
+            hp1 = cache.encode('HP', (1, 10))
+            hp2 = cache.encode('HP', (2, 10))
+            self.assertIs(cache.encode('HP', (1, 10)), hp1)
+            self.assertIs(cache.encode('HP', (2, 10)), hp2)
+
+            # Only the most recent packets are kept
+            for i in range(PacketCache.BROADCAST_PACKETS):
+                cache.encode('TI', (i,))
+            self.assertIsNot(cache.encode('HP', (1, 10)), hp1)
+            self.assertEqual(cache.encode('HP', (1, 10)), hp1)
+
+        # Nothing is kept once the broadcast ends
+        self.assertIsNot(cache.encode('HP', (2, 10)), hp2)
+
+class TestPacketCache_02_Transport(_TestSituation4):
+    def make_client(self):
+        transport = Mock()
+        transport.is_closing.return_value = False
+        # Bypass the test client manager, whose clients record packets instead of encoding them
+        client = ClientManager.new_client(self.server.client_manager, transport,
+                                          client_obj=ClientManager.Client, ip='127.0.0.1')
+        self.addCleanup(self.server.client_manager.remove_client, client)
+        client.flush_output()
+        transport.write.reset_mock()
+        return client, transport
+
+    def test_01_sendcommand(self):
+        """
+        Situation: Packets are sent to a client during a broadcast, and the bytes written to its
+        transport are checked.
+        """
+
+        client, transport = self.make_client()
+        with self.server.packet_cache:
+            client.send_command('HP', 1, 5)
+            client.send_command('HP', 2, True)
+            client.send_command('HP', 1, 5)
+            client.send_command('HP', 2, 1)
+            client.send_command('MS', *([0]*11 + [None] + [1.0]*2))
+        client.flush_output()
+
+        transport.write.assert_called_once_with(b'HP#1#5#%HP#2#True#%HP#1#5#%HP#2#1#%'
+                                                b'MS#0#0#0#0#0#0#0#0#0#0#0#None#1.0#1.0#%')
+
+class TestPacketCache_03_Persistent(unittest.TestCase):
+    def test_01_outsidebroadcasts(self):
+        """
+        Situation: Packets are sent outside of a broadcast. Those of persistent commands are
+        encoded once and then reused, while the rest are encoded every time.
+        """
+
+        cache = PacketCache()
+        fm = cache.encode('FM', ('0-Basement', '--Music--', 'Song.mp3'))
+        self.assertEqual(fm, b'FM#0-Basement#--Music--#Song.mp3#%')
+        self.assertIs(cache.encode('FM', ('0-Basement', '--Music--', 'Song.mp3')), fm)
+        self.assertEqual(cache.encode('FA', ('0-Basement',)), b'FA#0-Basement#%')
+
+        ct = cache.encode('CT', ('user', 'Hello.'))
+        self.assertEqual(ct, b'CT#user#Hello.#%')
+        self.assertIsNot(cache.encode('CT', ('user', 'Hello.')), ct)
+
+    def test_02_size(self):
+        """
+        Situation: More distinct packets of a persistent command are sent than are kept for it.
+        The oldest ones are encoded again, while those of other commands are still kept.
+        """
+
+        cache = PacketCache()
+        size = PacketCache.PERSISTENT_COMMANDS['OPPASS']
+        sm = cache.encode('SM', ('0-Basement',))
+        oppasses = [cache.encode('OPPASS', (i,)) for i in range(size)]
+        self.assertIs(cache.encode('OPPASS', (0,)), oppasses[0])
+
+        cache.encode('OPPASS', (size,))
+        self.assertEqual(cache.encode('OPPASS', (0,)), oppasses[0])
+        self.assertIsNot(cache.encode('OPPASS', (1,)), oppasses[1])
+        self.assertIs(cache.encode('OPPASS', (size-1,)), oppasses[size-1])
+        self.assertIs(cache.encode('SM', ('0-Basement',)), sm)
+
+    def test_03_insidebroadcasts(self):
+        """
+        Situation: Packets of a persistent command are sent during a broadcast, along with more
+        distinct packets than a broadcast keeps. The persistent packets are kept, also after the
+        broadcast ends.
+        """
+
+        cache = PacketCache()
+        with cache:
+            sc = cache.encode('SC', ('Kaede', 'Shuichi'))
+            for i in range(PacketCache.BROADCAST_PACKETS):
+                cache.encode('TI', (i,))
+            self.assertIs(cache.encode('SC', ('Kaede', 'Shuichi')), sc)
+        self.assertIs(cache.encode('SC', ('Kaede', 'Shuichi')), sc)
+        self.assertEqual(cache.encode('SC', ('Kaede', 'Kokichi')), b'SC#Kaede#Kokichi#%')
@@ -0,0 +1,92 @@
+import unittest
+
+from server.constants import ArgType, Clients, PacketSchema
+
+from .structures import _TestSituation4
+
+class TestPacketSchema_01_Parse(unittest.TestCase):
+    def setUp(self):
+        self.schema = PacketSchema([('name', ArgType.STR), ('showname', ArgType.STR_OR_EMPTY),
+                                    ('cid', ArgType.INT)], True)
+
+    def test_01_matching(self):
+        """
+        Situation: Arguments that match the schema are parsed. They are returned by name and
+        converted to their types, and the given arguments are not modified.
+        """
+
+        args = ['Song.mp3', '', '3']
+        self.assertEqual(self.schema.parse(args), {'name': 'Song.mp3', 'showname': '', 'cid': 3})
+        self.assertEqual(args, ['Song.mp3', '', '3'])
+        self.assertEqual(self.schema.parse(['Song.mp3', 'Kaede', '-1']),
+                         {'name': 'Song.mp3', 'showname': 'Kaede', 'cid': -1})
+
+    def test_02_notmatching(self):
+        """
+        Situation: Arguments that do not match the schema are parsed. None is returned.
+        """
+
+        self.assertIsNone(self.schema.parse(['Song.mp3', '']))
+        self.assertIsNone(self.schema.parse(['Song.mp3', '', '3', '4']))
+        self.assertIsNone(self.schema.parse(['', '', '3']))
+        self.assertIsNone(self.schema.parse(['Song.mp3', '', '']))
+        self.assertIsNone(self.schema.parse(['Song.mp3', '', 'three']))
+
+    def test_03_protocolschemas(self):
+        """
+        Situation: The schemas of every packet of every protocol are compiled when the module is
+        imported, in the order the protocol lists them.
+        """
+
+        for protocol in Clients.INBOUND_SCHEMAS:
+            for (identifier, schema) in Clients.INBOUND_SCHEMAS[protocol].items():
+                fields = protocol['{}_INBOUND'.format(identifier)].value
+                self.assertEqual(schema.names, tuple(name for (name, _) in fields))
+                self.assertIsNone(schema.defaults)
+            for (identifier, schema) in Clients.OUTBOUND_SCHEMAS[protocol].items():
+                fields = protocol['{}_OUTBOUND'.format(identifier)].value
+                self.assertEqual(schema.names, tuple(name for (name, _) in fields))
+                self.assertEqual(schema.defaults, tuple(default for (_, default) in fields))
+
+class TestPacketSchema_02_ProcessArguments(_TestSituation4):
+    def test_01_fallback(self):
+        """
+        Situation: C0 uses the AO 2.6 protocol, and sends music change arguments without a
+        showname, as DRO clients do. They only match once the DRO protocol is tried as a fallback.
+        """
+
+        protocol = self.c0.my_protocol
+        old_packet_handler = self.c0.packet_handler
+        self.c0.packet_handler = Clients.ClientAO2d6
+        self.addCleanup(setattr, self.c0, 'packet_handler', old_packet_handler)
+
+        args = ['Song.mp3', str(self.c0.char_id)]
+        self.assertIsNone(protocol.process_arguments('MC', args))
+        self.assertEqual(protocol.process_arguments('mc', args,
+                                                    fallback_protocols=[Clients.ClientDROLegacy]),
+                         {'name': 'Song.mp3', 'cid': self.c0.char_id})
+        self.assertEqual(args, ['Song.mp3', str(self.c0.char_id)])
+
+        # Arguments that match the client protocol do not use the fallback
+        self.assertEqual(protocol.process_arguments('MC', args + ['Kaede'],
+                                                    fallback_protocols=[Clients.ClientDROLegacy]),
+                         {'name': 'Song.mp3', 'cid': self.c0.char_id, 'showname': 'Kaede'})
+        # Arguments that match no protocol do not parse
+        self.assertIsNone(protocol.process_arguments('MC', ['Song.mp3'],
+                                                     fallback_protocols=[Clients.ClientDROLegacy]))
+
+    def test_02_needsauth(self):
+        """
+        Situation: C3 becomes a spectator and sends arguments that match their protocol. They
+        only parse if the packet does not need a character.
+        """
+
+        self.c3.change_character(-1)
+        self.c3.discard_all()
+
+        args = ['Song.mp3', '-1']
+        protocol = self.c3.my_protocol
+        self.assertIsNone(protocol.process_arguments('MC', args))
+        self.assertEqual(protocol.process_arguments('MC', args, needs_auth=False,
+                                                    fallback_protocols=[Clients.ClientDROLegacy]),
+                         {'name': 'Song.mp3', 'cid': -1})
@@ -0,0 +1,99 @@
+from .structures import _TestSituation4Mc1Gc2
+
+class TestPassages_01_Minimap(_TestSituation4Mc1Gc2):
+    def test_01_defaultpassages(self):
+        """
+        Situation: C0 checks the areas reachable from area 0 when the area list was just loaded.
+        """
+
+        self.c0.ooc('/minimap')
+        self.c0.assert_ooc('== Areas reachable from {} ==\r\n'
+                           '*1-{}\r\n*3-{}\r\n*4-{}\r\n*5-{}\r\n*6-{}\r\n*7-{}'
+                           .format(self.area0.name, self.area1.name, self.area3.name,
+                                   self.area4.name, self.area5.name, self.area6.name,
+                                   self.area7.name), over=True)
+
+    def test_02_changedpassages(self):
+        """
+        Situation: C1 locks the passage from area 0 to area 1, and C0 checks the reachable areas
+        again. C1 then clears the passages of area 0.
+        """
+
+        self.c1.ooc('/unilock 1')
+        self.c1.assert_ooc('You have locked the passage from {} to {}.'
+                           .format(self.area0.name, self.area1.name), over=True)
+        self.c0.discard_all()
+        self.c2.discard_all()
+        self.c3.discard_all()
+
+        self.c0.ooc('/minimap')
+        self.c0.assert_ooc('== Areas reachable from {} ==\r\n'
+                           '*3-{}\r\n*4-{}\r\n*5-{}\r\n*6-{}\r\n*7-{}'
+                           .format(self.area0.name, self.area3.name, self.area4.name,
+                                   self.area5.name, self.area6.name, self.area7.name), over=True)
+
+        self.c1.ooc('/passage_clear 0')
+        self.c1.discard_all()
+        self.c0.ooc('/minimap')
+        self.c0.assert_ooc('== Areas reachable from {} ==\r\n<ALL>'.format(self.area0.name),
+                           over=True)
+
+    def test_03_restoredpassages(self):
+        """
+        Situation: C1 restores the passages of area 0, and C0 checks the reachable areas again.
+        """
+
+        self.c1.ooc('/passage_restore 0')
+        self.c1.discard_all()
+        self.c0.ooc('/minimap')
+        self.c0.assert_ooc('== Areas reachable from {} ==\r\n'
+                           '*1-{}\r\n*3-{}\r\n*4-{}\r\n*5-{}\r\n*6-{}\r\n*7-{}'
+                           .format(self.area0.name, self.area1.name, self.area3.name,
+                                   self.area4.name, self.area5.name, self.area6.name,
+                                   self.area7.name), over=True)
+
+class TestPassages_02_Paths(_TestSituation4Mc1Gc2):
+    def test_01_reachableareas(self):
+        """
+        Situation: Areas reachable by following passages are looked up.
+        """
+
+        area_manager = self.server.area_manager
+
+        self.assertEqual(area_manager.get_reachable_areas(self.area1, max_steps=1),
+                         [self.area0, self.area2])
+        self.assertEqual(area_manager.get_reachable_areas(self.area1),
+                         [self.area0, self.area2, self.area3, self.area4, self.area5, self.area6,
+                          self.area7])
+        self.assertEqual(area_manager.get_reachable_areas(self.area3), [])
+
+    def test_02_shortestpaths(self):
+        """
+        Situation: Shortest ways between areas are looked up.
+        """
+
+        area_manager = self.server.area_manager
+
+        self.assertEqual(area_manager.get_shortest_path(self.area1, self.area1), [self.area1])
+        self.assertEqual(area_manager.get_shortest_path(self.area1, self.area0),
+                         [self.area1, self.area0])
+        self.assertEqual(area_manager.get_shortest_path(self.area1, self.area4),
+                         [self.area1, self.area0, self.area4])
+        self.assertIsNone(area_manager.get_shortest_path(self.area3, self.area0))
+
+    def test_03_changedpaths(self):
+        """
+        Situation: C1 locks the passage from area 1 to area 0, so area 4 can now only be reached
+        from area 1 through area 2.
+        """
+
+        self.c1.ooc('/unilock 1, 0')
+        self.c1.assert_ooc('You have locked the passage from {} to {}.'
+                           .format(self.area1.name, self.area0.name), over=True)
+        self.c0.discard_all()
+        self.c2.discard_all()
+        self.c3.discard_all()
+
+        area_manager = self.server.area_manager
+        self.assertEqual(area_manager.get_shortest_path(self.area1, self.area4),
+                         [self.area1, self.area2, self.area4])
@@ -0,0 +1,180 @@
+from server.constants import Constants, RecipientCondition
+
+from .structures import _TestSituation6Mc1Gc25
+
+class _TestRecipients(_TestSituation6Mc1Gc25):
+    """
+    C0 and C4 are normal players in area 4, C1 is a mod in area 0, C2 is a GM in area 1, C3 is a
+    CM in area 0, and C5 is a GM in area 5. C1 and C2 watch a zone made up of areas 4 and 5.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.c3.make_cm()
+        cls.c0.move_area(4)
+        cls.c2.move_area(1)
+        cls.c4.move_area(4)
+        cls.c5.move_area(5)
+        cls.zone = cls.server.zone_manager.get_zone(
+            cls.server.zone_manager.new_zone({cls.area4, cls.area5}, {cls.c1, cls.c2}))
+        for c in cls.clients[:6]:
+            c.discard_all()
+
+    def recipients(self, sender, **kwargs):
+        cond = Constants.build_cond(sender, **kwargs)
+        return {c for c in self.clients[:6] if cond(c)}
+
+    def candidates(self, sender, **kwargs):
+        cond = Constants.build_cond(sender, **kwargs)
+        return cond.get_candidates(self.server.client_manager.clients)
+
+class TestRecipients_01_Flags(_TestRecipients):
+    def test_01_ranks(self):
+        """
+        Situation: Recipients are filtered by rank.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        self.assertEqual(self.recipients(c0, is_staff=True), {c1, c2, c3, c5})
+        self.assertEqual(self.recipients(c0, is_staff=False), {c0, c4})
+        self.assertEqual(self.recipients(c0, is_officer=True), {c1, c3})
+        self.assertEqual(self.recipients(c0, is_officer=False), {c0, c2, c4, c5})
+        self.assertEqual(self.recipients(c0, is_mod=True), {c1})
+        self.assertEqual(self.recipients(c0, is_mod=False), {c0, c2, c3, c4, c5})
+        self.assertEqual(self.recipients(c0, is_staff=True, is_officer=False), {c2, c5})
+
+    def test_02_senses(self):
+        """
+        Situation: C0 is blind, C4 is deaf, and C5 is both. Recipients are filtered by senses.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        c0.is_blind, c4.is_deaf, c5.is_blind, c5.is_deaf = True, True, True, True
+        try:
+            self.assertEqual(self.recipients(c1, to_blind=True), {c0, c5})
+            self.assertEqual(self.recipients(c1, to_blind=False), {c1, c2, c3, c4})
+            self.assertEqual(self.recipients(c1, to_deaf=True), {c4, c5})
+            self.assertEqual(self.recipients(c1, to_deaf=False), {c0, c1, c2, c3})
+            self.assertEqual(self.recipients(c1, to_blind=True, to_deaf=False), {c0})
+            self.assertEqual(self.recipients(c1, to_blind=True, is_staff=True), {c5})
+        finally:
+            c0.is_blind, c4.is_deaf, c5.is_blind, c5.is_deaf = False, False, False, False
+
+    def test_03_compiledflags(self):
+        """
+        Situation: Flag checks are compiled once for each combination of flags. No flags need no
+        check, and invalid flag values are rejected.
+        """
+
+        compile_check = Constants._compile_flag_check
+        self.assertIsNone(compile_check(None, None, None, None, None))
+        self.assertIs(compile_check(True, None, None, False, None),
+                      compile_check(True, None, None, False, None))
+        self.assertIs(Constants.build_cond(self.c0), RecipientCondition.ALWAYS)
+        for flag in ['is_staff', 'is_officer', 'is_mod', 'to_blind', 'to_deaf']:
+            self.assertRaises(KeyError, Constants.build_cond, self.c0, **{flag: 'yes'})
+
+class TestRecipients_02_Areas(_TestRecipients):
+    def test_01_inarea(self):
+        """
+        Situation: Recipients are filtered by area, in each supported way.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        self.assertEqual(self.recipients(c0, in_area=True), {c0, c4})
+        self.assertEqual(self.recipients(c0, in_area=False), {c1, c2, c3, c5})
+        self.assertEqual(self.recipients(c0, in_area=self.area0), {c1, c3})
+        self.assertEqual(self.recipients(c0, in_area={self.area1, self.area5}), {c2, c5})
+        self.assertEqual(self.recipients(c0, in_area=set()), set())
+        self.assertEqual(self.recipients(c0, in_area=None), {c0, c1, c2, c3, c4, c5})
+        self.assertRaises(KeyError, Constants.build_cond, c0, in_area=4)
+
+    def test_02_sets(self):
+        """
+        Situation: Recipients are filtered by being part of, or not being part of, some sets.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        self.assertEqual(self.recipients(c0, part_of={c0, c1, c2}), {c0, c1, c2})
+        self.assertEqual(self.recipients(c0, not_to={c0, c1, c2}), {c3, c4, c5})
+        self.assertEqual(self.recipients(c0, part_of={c0, c1, c2}, not_to={c0}, is_staff=True,
+                                         pred=lambda c: c.area == self.area1), {c2})
+
+class TestRecipients_03_ZoneStaff(_TestRecipients):
+    def test_01_zstaff(self):
+        """
+        Situation: Recipients are filtered with is_zstaff, from inside and outside the zone.
+        Outside of a zone, nobody is a recipient.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        self.assertEqual(self.recipients(c0, is_zstaff=True), {c1, c2})
+        self.assertEqual(self.recipients(c0, is_zstaff=False), {c0, c3, c4, c5})
+        self.assertEqual(self.recipients(c0, is_zstaff=self.area5), {c1, c2})
+        # C1 is not in the zone, but watches it
+        self.assertEqual(self.recipients(c1, is_zstaff=True), {c1, c2})
+
+        for cond in [Constants.build_cond(c3, is_zstaff=True),
+                     Constants.build_cond(c3, is_zstaff=False),
+                     Constants.build_cond(c0, is_zstaff=self.area0)]:
+            self.assertTrue(cond.never)
+            self.assertEqual({c for c in self.clients[:6] if cond(c)}, set())
+            self.assertEqual(cond.get_candidates(self.server.client_manager.clients), ())
+        self.assertRaises(KeyError, Constants.build_cond, c0, is_zstaff='yes')
+
+    def test_02_zstaffflex(self):
+        """
+        Situation: Recipients are filtered with is_zstaff_flex, from inside and outside the zone.
+        Outside of a zone, it acts as is_staff.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        self.assertEqual(self.recipients(c0, is_zstaff_flex=True), {c1, c2})
+        self.assertEqual(self.recipients(c3, is_zstaff_flex=True), {c1, c2, c3, c5})
+        self.assertEqual(self.recipients(c0, is_zstaff_flex=False), {c0, c3, c4, c5})
+        self.assertEqual(self.recipients(c3, is_zstaff_flex=False), {c0, c4})
+        self.assertEqual(self.recipients(c0, is_zstaff_flex=self.area5), {c1, c2})
+        # Area 0 is in no zone, so it goes to staff members that watch no zone
+        self.assertEqual(self.recipients(c0, is_zstaff_flex=self.area0), {c3, c5})
+        self.assertRaises(KeyError, Constants.build_cond, c0, is_zstaff_flex='yes')
+
+class TestRecipients_04_Candidates(_TestRecipients):
+    def test_01_smallestsource(self):
+        """
+        Situation: Candidates for recipient conditions are taken from the smallest collection of
+        clients known to contain every recipient.
+        """
+
+        c0, c1, c2, c3, c4, c5 = self.clients[:6]
+        client_manager = self.server.client_manager
+        all_clients = set(client_manager.clients)
+        self.assertEqual(set(self.candidates(c0)), all_clients)
+        self.assertEqual(set(self.candidates(c0, is_staff=False)), all_clients)
+        self.assertEqual(set(self.candidates(c0, in_area=True)), {c0, c4})
+        self.assertEqual(set(self.candidates(c0, in_area=False)), all_clients)
+        self.assertEqual(set(self.candidates(c0, in_area=self.area0)), {c1, c3})
+        self.assertEqual(set(self.candidates(c0, in_area={self.area1, self.area5})), {c2, c5})
+        self.assertEqual(set(self.candidates(c0, is_staff=True)), {c1, c2, c3, c5})
+        self.assertEqual(set(self.candidates(c0, is_officer=True)), {c1, c3})
+        self.assertEqual(set(self.candidates(c0, is_mod=True)), {c1})
+        self.assertEqual(set(self.candidates(c0, is_staff=True, part_of={c4})), {c4})
+        self.assertEqual(set(self.candidates(c0, is_staff=True, in_area=True)), {c0, c4})
+        self.assertEqual(set(self.candidates(c0, is_zstaff=True)), {c1, c2})
+        self.assertEqual(set(self.candidates(c3, is_zstaff_flex=True)), {c1, c2, c3, c5})
+        self.assertEqual(set(self.candidates(c0, is_zstaff_flex=self.area5)), {c1, c2})
+
+    def test_02_snapshot(self):
+        """
+        Situation: Candidates are taken from the clients of C0's area, and then C4 leaves the area.
+        The candidates already handed out do not change.
+        """
+
+        candidates = self.candidates(self.c0, in_area=True)
+        self.assertIsInstance(candidates, tuple)
+        self.assertEqual(set(candidates), {self.c0, self.c4})
+
+        self.c4.move_area(0)
+        self.assertEqual(set(candidates), {self.c0, self.c4})
+        for c in self.clients[:6]:
+            c.discard_all()
@@ -0,0 +1,44 @@
+from .structures import _TestSituation4Mc1Gc2
+
+class TestStaffIndex_01_Staff(_TestSituation4Mc1Gc2):
+    def test_01_initialstaff(self):
+        """
+        Situation: C1 is a moderator and C2 is a game master.
+        """
+
+        client_manager = self.server.client_manager
+        self.assertEqual(client_manager.get_staff(), {self.c1, self.c2})
+        self.assertEqual(client_manager.get_staff(officers_only=True), {self.c1})
+
+    def test_02_loginlogout(self):
+        """
+        Situation: C0 logs in as a community manager and C2 logs out. The staff found by the
+        client manager follow along, and are the same sets each time.
+        """
+
+        client_manager = self.server.client_manager
+        staff = client_manager.get_staff()
+        officers = client_manager.get_staff(officers_only=True)
+
+        self.c0.make_cm()
+        self.assertEqual(staff, {self.c0, self.c1, self.c2})
+        self.assertEqual(officers, {self.c0, self.c1})
+
+        self.c2.make_normie()
+        self.assertEqual(staff, {self.c0, self.c1})
+        self.assertEqual(officers, {self.c0, self.c1})
+
+        self.c0.make_normie()
+        self.assertEqual(staff, {self.c1})
+        self.assertEqual(officers, {self.c1})
+        self.assertIs(client_manager.get_staff(), staff)
+        self.assertIs(client_manager.get_staff(officers_only=True), officers)
+
+    def test_03_disconnect(self):
+        """
+        Situation: C1 disconnects and is no longer part of the staff.
+        """
+
+        self.c1.disconnect()
+        self.assertEqual(self.server.client_manager.get_staff(), set())
+        self.assertEqual(self.server.client_manager.get_staff(officers_only=True), set())
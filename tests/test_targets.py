@@ -0,0 +1,65 @@
+from server.constants import TargetType
+
+from .structures import _TestSituation4, _Unittest
+
+class TestTargets_01_Joining(_TestSituation4):
+    def test_01_joiningtargeted(self):
+        """
+        Situation: A new client connects with the same IP as the others but has not joined yet.
+        As they are already in the default area, they are found when looking for targets, so
+        that /kick and /ban reach them as well.
+        """
+
+        client_manager = self.server.client_manager
+        joining = self.server.create_client()
+        self.addCleanup(joining.disconnect)
+        joining.discard_all()
+
+        self.assertEqual(joining.area, self.server.area_manager.default_area())
+        self.assertEqual(client_manager.get_targets(self.c0, TargetType.ID, joining.id), [joining])
+        for (key, value) in [(TargetType.IPID, joining.ipid), (TargetType.IP, '127.0.0.1'),
+                             (TargetType.OOC_NAME, '')]:
+            targets = client_manager.get_targets(self.c0, key, value)
+            self.assertIn(joining, targets, key)
+            self.assertIn(self.c0, targets, key)
+
+    def test_02_all(self):
+        """
+        Situation: Targets are looked up for all target types at once. The results of each target
+        type are concatenated.
+        """
+
+        client_manager = self.server.client_manager
+        targets = client_manager.get_targets(self.c0, TargetType.ALL, 'showname2')
+        self.assertEqual(targets, [self.c2])
+
+        targets = client_manager.get_targets(self.c0, TargetType.ALL, self.c1.name)
+        self.assertEqual(targets, [self.c1])
+
+class TestTargets_02_Multiclients(_Unittest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        super().setUpClients(1)
+
+    def test_01_joiningmulticlient(self):
+        """
+        Situation: A new client connects with the same IP as C0 but has not joined yet. They are
+        already counted as a multiclient of C0, and they stop being one once they disconnect.
+        """
+
+        client_manager = self.server.client_manager
+        self.assertEqual(client_manager.get_multiclients(self.c0), {self.c0})
+        self.assertFalse(client_manager.is_multiclienting(self.c0))
+
+        joining = self.server.create_client()
+        joining.discard_all()
+
+        self.assertEqual(client_manager.get_multiclients(self.c0), {self.c0, joining})
+        self.assertTrue(client_manager.is_multiclienting(self.c0))
+        self.assertEqual(client_manager.get_multiclients(joining), {self.c0, joining})
+        self.assertTrue(client_manager.is_multiclienting(joining))
+
+        joining.disconnect()
+        self.assertEqual(client_manager.get_multiclients(self.c0), {self.c0})
+        self.assertFalse(client_manager.is_multiclienting(self.c0))
@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+
+from unittest.mock import Mock
+
+from server.tasker import Tasker
+
+class TestTasker_01_Deadlines(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.tasker = Tasker(Mock(), self.loop)
+        self.fired = list()
+
+    def fire(self, *args):
+        self.fired.append(args)
+
+    def wait(self, delay):
+        self.loop.run_until_complete(asyncio.sleep(delay))
+
+    def test_01_ordering(self):
+        """
+        Situation: Several deadlines are set out of order. They fire in the order they are due.
+        """
+
+        self.tasker.set_deadline('A', 'x', 0.15, self.fire, 'A3')
+        self.tasker.set_deadline('A', 'y', 0.05, self.fire, 'A1')
+        self.tasker.set_deadline('B', 'x', 0.10, self.fire, 'B2')
+        self.assertEqual(len(self.tasker.deadlines), 3)
+
+        self.wait(0.075)
+        self.assertEqual(self.fired, [('A1',)])
+        self.wait(0.125)
+        self.assertEqual(self.fired, [('A1',), ('B2',), ('A3',)])
+        self.assertEqual(self.tasker.deadlines, dict())
+
+    def test_02_cancel(self):
+        """
+        Situation: A deadline is canceled before it is due. It never fires, while others do.
+        """
+
+        self.tasker.set_deadline('A', 'x', 0.02, self.fire, 'A')
+        self.tasker.set_deadline('B', 'x', 0.02, self.fire, 'B')
+        self.assertTrue(self.tasker.cancel_deadline('A', 'x'))
+        self.assertFalse(self.tasker.cancel_deadline('A', 'x'))
+        self.assertFalse(self.tasker.cancel_deadline('C', 'x'))
+        self.assertRaises(KeyError, self.tasker.get_deadline, 'A', 'x')
+
+        self.wait(0.04)
+        self.assertEqual(self.fired, [('B',)])
+
+    def test_03_replace(self):
+        """
+        Situation: Deadlines are set again under the same owner and name, both with the same
+        callback and arguments (pushing them back or forward) and with different ones. Only the
+        last deadline set under each name fires, when it is due.
+        """
+
+        # Pushed back
+        self.tasker.set_deadline('A', 'x', 0.05, self.fire, 'A')
+        self.tasker.set_deadline('A', 'x', 0.15, self.fire, 'A')
+        self.assertGreater(self.tasker.get_deadline('A', 'x'), 0.1)
+        # Pushed forward
+        self.tasker.set_deadline('B', 'x', 0.15, self.fire, 'B')
+        self.tasker.set_deadline('B', 'x', 0.05, self.fire, 'B')
+        # Replaced by a different one
+        self.tasker.set_deadline('C', 'x', 0.05, self.fire, 'C')
+        self.tasker.set_deadline('C', 'x', 0.10, self.fire, 'C2')
+
+        self.wait(0.075)
+        self.assertEqual(self.fired, [('B',)])
+        self.wait(0.125)
+        self.assertEqual(self.fired, [('B',), ('C2',), ('A',)])
+        self.assertEqual(self.tasker.deadlines, dict())
+
+    def test_04_afterfiring(self):
+        """
+        Situation: A deadline fires and raises an error. It is removed from the pending
+        deadlines, other deadlines due with it still fire, and it may be set again afterwards.
+        """
+
+        def fail():
+            raise ValueError
+        self.loop.set_exception_handler(lambda loop, context: self.fire(context['exception']))
+
+        self.tasker.set_deadline('A', 'x', 0.01, fail)
+        self.tasker.set_deadline('B', 'x', 0.01, self.fire, 'B')
+        self.wait(0.03)
+        self.assertEqual(len(self.fired), 2)
+        self.assertIn(('B',), self.fired)
+        self.assertRaises(KeyError, self.tasker.get_deadline, 'A', 'x')
+        self.assertFalse(self.tasker.cancel_deadline('A', 'x'))
+
+        self.fired.clear()
+        self.tasker.set_deadline('A', 'x', 0.01, self.fire, 'A')
+        self.wait(0.03)
+        self.assertEqual(self.fired, [('A',)])